@@ -2,39 +2,176 @@
 黑名单管理模块
 
 功能:
-    - 管理IP黑名单和域名黑名单
+    - 管理IP黑名单和域名黑名单(IP可以是单个地址或IPv4/IPv6网段,网段用前缀树查找)
+    - 域名黑名单/白名单按后缀匹配(条目覆盖所有子域名),两者都匹配时更具体的后缀优先
+    - 可选第三方IP黑名单源(本地文件,批量导入的区间表,后台按修改时间重新加载)
+    - 条目可以有过期时间(按拉黑类别设置默认时长),后台任务按最小堆批量移除到期条目
+    - IP查询前置布隆过滤器(单个地址和网段按前缀长度存入): 一定不在IP黑名单中的地址不必解析和查前缀树;
+      删除条目不清除过滤器的位,后台刷新时在线程中重建
     - 自动记录垃圾邮件发送者
-    - 持久化存储黑名单
-    - 提供查询和管理接口
+    - 持久化存储黑名单(快照 + 追加日志: 每次修改追加一条记录,后台任务定期在线程中
+      成批写入日志并fsync一次,日志过大或到达压缩间隔时写入新快照;
+      storage以.db/.sqlite/.sqlite3结尾时改用SQLite存储,内存中只保留键集合)
+    - 热加载: 后台按修改时间检查快照文件,被外部修改(手工编辑/从其他节点同步)时在写入线程中
+      重新加载(新快照 + 插入外部修改差异后的日志),再应用尚未写入的修改,最后整体替换内存中的黑名单
+    - 提供查询和管理接口: 按键分页列出(游标为上一页最后一个键,可按前缀/原因/添加时间过滤),
+      逐条导出,批量导入(一次加锁应用全部条目,只写入一次)
+
+调用链:
+    main.lifespan -> init_blacklist -> Blacklist.start(后台刷新) ... Blacklist.stop(最后一次写入)
+    _watch_loop -> JournalStore.changed_externally -> reload(写入线程) -> _reload_sync -> _install
+    smtp_server / 黑名单API -> add/remove/learn -> 待写入记录 -> _flush_loop -> flush(写入线程) -> JournalStore / SqliteStore
+    黑名单API -> list_entries / export_entries / import_entries -> flush
 
 输入: IP地址、域名、发件人邮箱
 输出: 是否在黑名单中
 """
-import json
+import heapq
+import ipaddress
 import logging
-from typing import Set, Dict, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from operator import itemgetter
+from typing import Hashable, Iterable, Iterator, Set, Dict, List, Optional, Tuple
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 import asyncio
 
+from core.blacklist_store import BlacklistState, apply_record, make_record, open_store
+from utils.bloom import BloomFilter
+from utils.domain_trie import DomainTrie, normalize_domain
+from utils.ip_ranges import IPRangeFeeds
+from utils.ip_trie import IPTrie, address_value, parse_address, parse_ip_or_network
+
 
 logger = logging.getLogger(__name__)
 
 
+# 拉黑类别: 自动拉黑陌生发件人 / 发送超大邮件 / 手动添加(API)
+CATEGORY_AUTO = "auto"
+CATEGORY_OVERSIZE = "oversize"
+CATEGORY_MANUAL = "manual"
+
+# 每次清理最多移除的条目数(之后让出事件循环)
+REAP_BATCH = 1000
+
+# 分页列出的最大每页条目数
+MAX_PAGE_SIZE = 1000
+
+# 批量导入条目的默认拉黑原因
+IMPORT_REASON = "批量导入"
+
+# 有条目删除后,过滤器至少间隔这么久(秒)重建一次
+FILTER_REBUILD_INTERVAL = 60
+
+# 地址位数
+_WIDTHS = {4: 32, 6: 128}
+
+
+def _expiry_ts(expires_at: str) -> float:
+    """过期时间(ISO格式)转为时间戳"""
+    return datetime.fromisoformat(expires_at).timestamp()
+
+
+def _ip_filter_key(key: str) -> Optional[Tuple]:
+    """
+    IP黑名单条目在过滤器中的键
+    
+    输入:
+        key: 规范化的IP地址或网段
+        
+    输出:
+        ("net", 版本, 前缀长度, 网络地址整数)(单个地址的前缀长度为地址位数),无法解析的旧条目为None
+    """
+    if '/' in key:
+        try:
+            network = ipaddress.ip_network(key, strict=False)
+        except ValueError:
+            return None
+        return "net", network.version, network.prefixlen, int(network.network_address)
+    parsed = address_value(key)
+    if parsed is None:
+        return None
+    version, value = parsed
+    return "net", version, _WIDTHS[version], value
+
+
+def _filter_keys(ips: Iterable[str]) -> Iterator[Hashable]:
+    """
+    IP黑名单的全部过滤器键
+    
+    输入:
+        ips: IP黑名单的键
+        
+    输出:
+        过滤器键
+    """
+    for ip in ips:
+        key = _ip_filter_key(ip)
+        if key is not None:
+            yield key
+
+
+class _Indexes:
+    """由黑名单条目派生的查询结构(加载/重新加载时整体构建后替换)"""
+    
+    __slots__ = ("networks", "blocked_suffixes", "whitelist_suffixes", "expiry_heap", "bloom", "bloom_stale")
+    
+    def __init__(self):
+        self.networks = IPTrie()
+        self.blocked_suffixes = DomainTrie()
+        self.whitelist_suffixes = DomainTrie()
+        self.expiry_heap: List[Tuple[float, str, str]] = []
+        self.bloom: Optional[BloomFilter] = None
+        self.bloom_stale = 0
+
+
 class Blacklist:
     """黑名单管理器"""
     
-    def __init__(self, storage_path: str = "data/blacklist.json"):
+    def __init__(
+        self,
+        storage_path: str = "data/blacklist.json",
+        flush_interval: float = 2.0,
+        compact_records: int = 50000,
+        compact_interval: int = 3600,
+        ip_feeds: Iterable[str] = (),
+        feed_reload_interval: int = 300,
+        default_ttls: Optional[Dict[str, int]] = None,
+        reap_interval: int = 60,
+        bloom_fp_rate: float = 0.01,
+        reload_interval: int = 5
+    ):
         """
         初始化黑名单管理器
         
         输入:
-            storage_path: 黑名单存储文件路径
+            storage_path: 黑名单快照文件路径(日志文件为同名.journal;
+                .db/.sqlite/.sqlite3为SQLite数据库)
+            flush_interval: 后台刷新间隔(秒),修改最多延迟这么久写入日志
+            compact_records: 日志记录数达到该值时压缩为新快照
+            compact_interval: 日志非空时至少每隔这么久(秒)压缩一次
+            ip_feeds: 第三方IP黑名单源文件
+            feed_reload_interval: 检查黑名单源文件变化的间隔(秒),0表示只手动重新加载
+            default_ttls: 各拉黑类别(auto/oversize/manual)的默认有效期(秒),0或缺省表示永久
+            reap_interval: 清理到期条目的间隔(秒)
+            bloom_fp_rate: IP查询前置布隆过滤器的目标误判率,0表示关闭
+            reload_interval: 检查快照文件外部修改的间隔(秒),0表示不检查(仅JSON存储)
         """
         self.storage_path = Path(storage_path)
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.feed_reload_interval = feed_reload_interval
+        self.default_ttls: Dict[str, int] = dict(default_ttls or {})
+        self.reap_interval = reap_interval
+        self.bloom_fp_rate = bloom_fp_rate
+        self.reload_interval = reload_interval
         self.storage_path.parent.mkdir(parents=True, exist_ok=True)
         
-        # IP黑名单: {ip: {"reason": str, "added_at": str, "count": int}}
+        # IP黑名单: {ip或网段: {"reason": str, "added_at": str, "count": int}}
+        # (SQLite存储时为SqliteTable: 键在内存中,条目在数据库中;条目只读,修改时整体替换)
         self.blocked_ips: Dict[str, Dict] = {}
         
         # 域名黑名单: {domain: {"reason": str, "added_at": str, "count": int}}
@@ -43,45 +180,577 @@ class Blacklist:
         # 白名单域名(用户规则中的合法域名,自动学习)
         self.whitelist_domains: Set[str] = set()
         
-        self._lock = asyncio.Lock()
+        # IP黑名单中的网段(单个地址直接查blocked_ips)
+        self._networks = IPTrie()
+        
+        # 域名黑名单/白名单的后缀树
+        self._blocked_suffixes = DomainTrie()
+        self._whitelist_suffixes = DomainTrie()
+        
+        # 到期时间最小堆: (时间戳, "ip"/"domain", 键);条目的过期时间变化后旧堆项失效,弹出时跳过
+        self._expiry_heap: List[Tuple[float, str, str]] = []
+        self.expired = 0
+        
+        # IP查询前置的布隆过滤器(关闭时为None);删除的条目计入stale,重建时清除
+        self._bloom: Optional[BloomFilter] = None
+        self._bloom_stale = 0
+        # 后台重建期间新增的键(重建完成替换前补上)
+        self._bloom_backlog: Optional[List[Hashable]] = None
+        self._bloom_built = time.monotonic()
+        self.bloom_rebuilds = 0
+        # 黑名单整体替换(重新加载)的次数,用于丢弃基于旧黑名单的后台重建结果
+        self._generation = 0
+        # 过滤器查询统计(不加锁,只用于估算)
+        self.bloom_queries = 0
+        self.bloom_negatives = 0
+        self.bloom_false_positives = 0
+        
+        # SMTP线程和API事件循环都会修改黑名单,用线程锁保护(临界区内没有await)
+        self._lock = threading.Lock()
+        # 写文件互斥,先于self._lock获取(保证记录按产生顺序写入)
+        self._write_lock = threading.Lock()
+        
+        # 尚未写入日志的记录
+        self._pending: List[Dict] = []
+        self._store = open_store(self.storage_path, compact_records=compact_records)
+        # 专用写入线程: 写入按顺序进行,SQLite写连接只在这里(和停止时)使用
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blacklist-writer")
+        self._last_compaction = time.monotonic()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._feed_task: Optional[asyncio.Task] = None
+        self._reap_task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.last_flush_at: Optional[str] = None
+        self.reloads = 0
+        self.last_reload_at: Optional[str] = None
         
         # 加载黑名单
         self._load()
+        
+        # 第三方IP黑名单源(启动时同步加载,之后在后台重新加载)
+        self.feeds = IPRangeFeeds(ip_feeds)
+        self.feeds.load()
     
     def _load(self):
-        """从文件加载黑名单"""
+        """从快照和日志加载黑名单"""
         try:
-            if self.storage_path.exists():
-                with open(self.storage_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.blocked_ips = data.get('blocked_ips', {})
-                    self.blocked_domains = data.get('blocked_domains', {})
-                    self.whitelist_domains = set(data.get('whitelist_domains', []))
-                    logger.info(
-                        f"已加载黑名单: {len(self.blocked_ips)}个IP, "
-                        f"{len(self.blocked_domains)}个域名, "
-                        f"{len(self.whitelist_domains)}个白名单域名"
-                    )
+            state = self._store.load()
+            self._install(state, self._build_indexes(state))
+            logger.info(
+                f"已加载黑名单: {len(self.blocked_ips)}个IP({len(self._networks)}个网段), "
+                f"{len(self.blocked_domains)}个域名, "
+                f"{len(self.whitelist_domains)}个白名单域名"
+            )
         except Exception as e:
             logger.error(f"加载黑名单失败: {e}")
     
-    def _save(self):
-        """保存黑名单到文件"""
+    def _build_indexes(self, state: BlacklistState) -> _Indexes:
+        """
+        根据黑名单状态构建网段前缀树、域名后缀树、到期堆和过滤器(只读取state,可在锁外进行)
+        
+        输入:
+            state: 黑名单状态
+            
+        输出:
+            查询结构
+        """
+        indexes = _Indexes()
+        for key in state.blocked_ips:
+            if '/' in key:
+                indexes.networks.add(key)
+        for domain in state.blocked_domains:
+            indexes.blocked_suffixes.add(domain)
+        for domain in state.whitelist_domains:
+            indexes.whitelist_suffixes.add(domain)
+        
+        heap = indexes.expiry_heap
+        for kind, table in (("ip", state.blocked_ips), ("domain", state.blocked_domains)):
+            # SQLite存储按索引只读取有过期时间的条目
+            expiring = getattr(table, "expiring", None)
+            items = expiring() if expiring is not None else (
+                (key, entry.get('expires_at')) for key, entry in table.items()
+            )
+            for key, expires_at in items:
+                if expires_at:
+                    heap.append((_expiry_ts(expires_at), kind, key))
+        heapq.heapify(heap)
+        
+        if self.bloom_fp_rate > 0:
+            indexes.bloom = BloomFilter.build(_filter_keys(state.blocked_ips), self.bloom_fp_rate)
+        return indexes
+    
+    def _install(self, state: BlacklistState, indexes: _Indexes):
+        """
+        替换黑名单和查询结构(重新加载时调用方持有self._lock)
+        
+        输入:
+            state: 黑名单状态
+            indexes: 由state构建的查询结构
+        """
+        self.blocked_ips = state.blocked_ips
+        self.blocked_domains = state.blocked_domains
+        self.whitelist_domains = state.whitelist_domains
+        self._networks = indexes.networks
+        self._blocked_suffixes = indexes.blocked_suffixes
+        self._whitelist_suffixes = indexes.whitelist_suffixes
+        self._expiry_heap = indexes.expiry_heap
+        self._bloom = indexes.bloom
+        self._bloom_stale = indexes.bloom_stale
+        self._bloom_built = time.monotonic()
+        # 正在进行的过滤器重建基于旧的黑名单,完成后丢弃
+        self._generation += 1
+    
+    def _index_add(self, kind: str, key: str):
+        """
+        把新条目加入网段前缀树/域名后缀树和过滤器(调用方持有self._lock)
+        
+        输入:
+            kind: "ip" / "domain"
+            key: 规范化的IP/网段/域名
+        """
+        if kind == "ip":
+            if '/' in key:
+                self._networks.add(key)
+            self._filter_add(_ip_filter_key(key))
+        else:
+            self._blocked_suffixes.add(key)
+    
+    def _filter_add(self, key: Optional[Hashable]):
+        """
+        把新IP条目的键加入过滤器(调用方持有self._lock)
+        
+        输入:
+            key: 过滤器键(None表示不加入)
+        """
+        if self._bloom is None or key is None:
+            return
+        self._bloom.add(key)
+        if self._bloom_backlog is not None:
+            self._bloom_backlog.append(key)
+    
+    def _filter_misses_ip(self, ip: str) -> bool:
+        """
+        用过滤器判断IP一定不在IP黑名单中(单个地址及已有的每种前缀长度的网段都不存在)
+        
+        输入:
+            ip: IP地址
+            
+        输出:
+            True: 一定不在, False: 可能在(或过滤器关闭、地址无效)
+        """
+        bloom = self._bloom
+        if bloom is None:
+            return False
+        parsed = address_value(ip)
+        if parsed is None:
+            return False
+        
+        version, value = parsed
+        width = _WIDTHS[version]
+        self.bloom_queries += 1
+        if ("net", version, width, value) in bloom:
+            return False
+        for length in self._networks.prefix_lengths(version):
+            shift = width - length
+            if ("net", version, length, value >> shift << shift) in bloom:
+                return False
+        self.bloom_negatives += 1
+        return True
+    
+    def _filter_rebuild_due(self) -> bool:
+        """过滤器需要重建: 键数超过容量,或有条目删除且距上次重建超过重建间隔"""
+        bloom = self._bloom
+        if bloom is None or self._bloom_backlog is not None:
+            return False
+        if len(bloom) > bloom.capacity:
+            return True
+        return self._bloom_stale > 0 and time.monotonic() - self._bloom_built >= FILTER_REBUILD_INTERVAL
+    
+    async def rebuild_filter(self) -> bool:
+        """
+        在线程中按当前IP黑名单重建过滤器(清除已删除条目的位,按条目数重新确定大小),完成后替换
+        
+        输出:
+            True: 已重建, False: 过滤器关闭、正在重建或期间黑名单已重新加载
+        """
+        if self._bloom is None or self._bloom_backlog is not None:
+            return False
+        with self._lock:
+            ips = list(self.blocked_ips)
+            stale, self._bloom_stale = self._bloom_stale, 0
+            self._bloom_backlog = []
+            generation = self._generation
+        
+        bloom = None
         try:
-            data = {
-                'blocked_ips': self.blocked_ips,
-                'blocked_domains': self.blocked_domains,
-                'whitelist_domains': list(self.whitelist_domains),
-                'updated_at': datetime.now().isoformat()
-            }
-            with open(self.storage_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f"保存黑名单失败: {e}")
+            bloom = await asyncio.to_thread(
+                BloomFilter.build, _filter_keys(ips), self.bloom_fp_rate
+            )
+        finally:
+            with self._lock:
+                if generation != self._generation:
+                    # 期间黑名单已重新加载(过滤器已随之重建)
+                    bloom = None
+                elif bloom is not None:
+                    for key in self._bloom_backlog:
+                        bloom.add(key)
+                    self._bloom = bloom
+                else:
+                    # 重建失败或被取消: 沿用旧过滤器
+                    self._bloom_stale += stale
+                self._bloom_backlog = None
+        if bloom is None:
+            return False
+        self._bloom_built = time.monotonic()
+        self.bloom_rebuilds += 1
+        logger.debug(f"重建黑名单过滤器: {len(bloom)}个键, {bloom.nbytes()}字节")
+        return True
+    
+    def _record(self, op: str, kind: str, key: str, entry: Optional[Dict] = None):
+        """
+        记录一次修改(调用方持有self._lock)
+        
+        输入:
+            op: "set" / "del"
+            kind: "ip" / "domain" / "whitelist"
+            key: IP地址或域名
+            entry: 条目的完整内容
+        """
+        self._pending.append(make_record(op, kind, key, entry))
+    
+    def _save(self):
+        """
+        保存待写入的记录(调用方不持有self._lock)
+        
+        后台刷新任务运行时由它合并写入;未启动时(独立使用)立即写入
+        """
+        if self._flush_task is None:
+            self._flush_sync()
+    
+    def _snapshot(self) -> Dict:
+        """
+        复制当前黑名单(调用方持有self._lock)
+        
+        输出:
+            可序列化的快照(条目为副本,之后的计数修改不影响快照)
+        """
+        return {
+            'blocked_ips': {ip: dict(entry) for ip, entry in self.blocked_ips.items()},
+            'blocked_domains': {domain: dict(entry) for domain, entry in self.blocked_domains.items()},
+            'whitelist_domains': list(self.whitelist_domains),
+            'updated_at': datetime.now().isoformat()
+        }
+    
+    def _flush_sync(self, compact: bool = False) -> bool:
+        """
+        把待写入的记录追加到日志;需要压缩时改为写入新快照(已包含这些记录)
+        
+        输入:
+            compact: 强制压缩
+            
+        输出:
+            True: 有内容写入
+        """
+        with self._write_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+                # 快照被外部修改后先等重新加载,避免压缩覆盖外部修改;
+                # 没有快照的存储(SQLite)不压缩,待写入的记录照常追加
+                compact = (
+                    self._store.writes_snapshot
+                    and (compact or self._store.needs_compaction())
+                    and not self._store.changed_externally()
+                )
+                snapshot = self._snapshot() if compact else None
+            
+            if not records and snapshot is None:
+                return False
+            
+            try:
+                if snapshot is not None:
+                    self._store.compact(snapshot)
+                    self._last_compaction = time.monotonic()
+                    logger.info(
+                        f"✓ 黑名单已压缩: {len(snapshot['blocked_ips'])}个IP, "
+                        f"{len(snapshot['blocked_domains'])}个域名"
+                    )
+                else:
+                    self._store.append(records)
+                    with self._lock:
+                        self._store.settle(records)
+            except Exception as e:
+                logger.error(f"保存黑名单失败: {e}")
+                # 写入失败: 放回待写入记录,下次重试
+                with self._lock:
+                    self._pending[:0] = records
+                return False
+    
+            self.flushes += 1
+            self.last_flush_at = datetime.now().isoformat()
+            return True
+    
+    async def flush(self, compact: bool = False) -> bool:
+        """
+        在写入线程中写入待写入的记录(不阻塞事件循环)
+        
+        输入:
+            compact: 强制压缩为新快照(没有快照的SQLite存储照常写入)
+        
+        输出:
+            True: 有内容写入, False: 没有修改或写入失败
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._flush_sync, compact)
+    
+    def start(self):
+        """启动后台刷新、到期清理和黑名单源重新加载任务(需在事件循环中调用)"""
+        if self._flush_task is not None:
+            return
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info(f"✓ 启动黑名单后台写入: 间隔{self.flush_interval}秒")
+        
+        if self.reap_interval > 0:
+            self._reap_task = asyncio.create_task(self._reap_loop())
+    
+        if self.feeds.paths and self.feed_reload_interval > 0:
+            self._feed_task = asyncio.create_task(self._feed_loop())
+    
+        if self.reload_interval > 0:
+            self._watch_task = asyncio.create_task(self._watch_loop())
+    
+    def stop(self):
+        """停止后台任务,并同步写入尚未保存的修改"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._feed_task is not None:
+            self._feed_task.cancel()
+            self._feed_task = None
+        if self._reap_task is not None:
+            self._reap_task.cancel()
+            self._reap_task = None
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+        
+        self._flush_sync()
+        logger.info("✓ 停止黑名单后台写入")
+    
+    def _compaction_due(self) -> bool:
+        """日志非空且距上次压缩超过压缩间隔"""
+        return (
+            bool(self.compact_interval)
+            and self._store.journal_records > 0
+            and time.monotonic() - self._last_compaction >= self.compact_interval
+        )
+    
+    async def _flush_loop(self):
+        """后台刷新循环(之后按需重建过滤器)"""
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush(compact=self._compaction_due())
+                if self._filter_rebuild_due():
+                    await self.rebuild_filter()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"黑名单后台写入出错: {e}", exc_info=True)
+    
+    async def _watch_loop(self):
+        """快照文件监视循环(按修改时间轮询,被外部修改时重新加载)"""
+        while True:
+            try:
+                await asyncio.sleep(self.reload_interval)
+                if self._store.changed_externally():
+                    await self.reload()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"重新加载黑名单出错: {e}", exc_info=True)
+    
+    async def reload(self, force: bool = False) -> bool:
+        """
+        在写入线程中重新加载黑名单(与写入互斥,不阻塞事件循环和查询)
+        
+        输入:
+            force: 快照文件没有变化也重新加载
+            
+        输出:
+            True: 已重新加载
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._reload_sync, force)
+    
+    def _reload_sync(self, force: bool = False) -> bool:
+        """
+        重新加载快照和日志,应用尚未写入的修改后整体替换
+        
+        加载和构建查询结构在锁外进行,只有应用未写入的修改和替换时持有self._lock;
+        快照被外部修改时,外部修改的差异插入日志中修改发生的位置后重放:
+        早于修改的记录(如尚未压缩的自动拉黑)保留,但不会撤销手工删除/修改的条目
+        
+        输入:
+            force: 快照文件没有变化也重新加载
+            
+        输出:
+            True: 已重新加载, False: 没有变化或加载失败(保留当前黑名单)
+        """
+        with self._write_lock:
+            external = self._store.changed_externally()
+            if not force and not external:
+                return False
+            try:
+                state = self._store.load(external=external)
+                indexes = self._build_indexes(state)
+            except Exception as e:
+                logger.error(f"重新加载黑名单失败,保留当前黑名单: {e}")
+                return False
+            
+            with self._lock:
+                replayed = self._replay_pending(state, indexes)
+                self._install(state, indexes)
+            self.reloads += 1
+            self.last_reload_at = datetime.now().isoformat()
+        
+        logger.info(
+            f"✓ 黑名单已重新加载: {len(state.blocked_ips)}个IP, {len(state.blocked_domains)}个域名, "
+            f"{len(state.whitelist_domains)}个白名单域名(重新应用{replayed}条未写入的修改)"
+        )
+        return True
+    
+    def _replay_pending(self, state: BlacklistState, indexes: _Indexes) -> int:
+        """
+        把尚未写入的记录应用到重新加载的状态和查询结构上(调用方持有self._lock)
+        
+        输入:
+            state: 重新加载的黑名单状态
+            indexes: 由state构建的查询结构
+            
+        输出:
+            应用的记录数
+        """
+        for record in self._pending:
+            apply_record(state, record)
+            op, kind, key = record['op'], record['kind'], record['key']
+            if kind == "whitelist":
+                if op == "set":
+                    indexes.whitelist_suffixes.add(key)
+                else:
+                    indexes.whitelist_suffixes.remove(key)
+                continue
+            
+            if kind == "ip":
+                if '/' in key:
+                    if op == "set":
+                        indexes.networks.add(key)
+                    else:
+                        indexes.networks.remove(key)
+                if op == "set" and indexes.bloom is not None:
+                    filter_key = _ip_filter_key(key)
+                    if filter_key is not None:
+                        indexes.bloom.add(filter_key)
+                elif op == "del":
+                    indexes.bloom_stale += 1
+            elif op == "set":
+                indexes.blocked_suffixes.add(key)
+            else:
+                indexes.blocked_suffixes.remove(key)
+            
+            expires_at = record.get('entry', {}).get('expires_at') if op == "set" else None
+            if expires_at:
+                heapq.heappush(indexes.expiry_heap, (_expiry_ts(expires_at), kind, key))
+        return len(self._pending)
+    
+    async def _feed_loop(self):
+        """黑名单源重新加载循环(文件变化时在线程中构建新表后替换)"""
+        while True:
+            try:
+                await asyncio.sleep(self.feed_reload_interval)
+                await self.feeds.reload()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"重新加载IP黑名单源出错: {e}", exc_info=True)
+    
+    async def _reap_loop(self):
+        """到期清理循环"""
+        while True:
+            try:
+                await asyncio.sleep(self.reap_interval)
+                await self.reap_expired()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"清理到期黑名单出错: {e}", exc_info=True)
+    
+    def _reap_batch(self, now: float) -> int:
+        """
+        从到期堆中移除一批到期条目(每批最多REAP_BATCH个)
+        
+        输入:
+            now: 当前时间戳
+            
+        输出:
+            本批移除的条目数
+        """
+        removed = 0
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now and removed < REAP_BATCH:
+                ts, kind, key = heapq.heappop(heap)
+                table = self.blocked_ips if kind == "ip" else self.blocked_domains
+                entry = table.get(key)
+                # 条目已移除或过期时间已变化(重新拉黑延长/改为永久): 堆项失效
+                if entry is None or not entry.get('expires_at') or _expiry_ts(entry['expires_at']) != ts:
+                    continue
+                
+                del table[key]
+                if kind == "ip":
+                    if '/' in key:
+                        self._networks.remove(key)
+                    self._bloom_stale += 1
+                else:
+                    self._blocked_suffixes.remove(key)
+                self._record("del", kind, key)
+                removed += 1
+            self.expired += removed
+        return removed
+    
+    async def reap_expired(self) -> int:
+        """
+        移除所有到期条目(分批进行,批之间让出事件循环)
+        
+        输出:
+            移除的条目数
+        """
+        now = time.time()
+        total = 0
+        while True:
+            removed = self._reap_batch(now)
+            total += removed
+            if removed < REAP_BATCH:
+                break
+            await asyncio.sleep(0)
+        
+        if total:
+            self._save()
+            logger.info(f"✓ 清理到期黑名单: {total}个条目")
+        return total
+    
+    async def reload_feeds(self) -> bool:
+        """
+        立即重新加载全部IP黑名单源
+        
+        输出:
+            True: 已重新加载
+        """
+        return await self.feeds.reload(force=True)
     
     async def is_ip_blocked(self, ip: str) -> bool:
         """
-        检查IP是否在黑名单中
+        检查IP是否在黑名单中(单个地址或所在网段被拉黑,或在IP黑名单源中)
         
         输入:
             ip: IP地址
@@ -89,20 +758,100 @@ class Blacklist:
         输出:
             True: 已拉黑, False: 未拉黑
         """
-        return ip in self.blocked_ips
+        if ip in self.blocked_ips:
+            return True
+        if not self._networks and not self.feeds and ':' not in ip:
+            return False
+        
+        if self._filter_misses_ip(ip):
+            # 不在IP黑名单中,只需再查黑名单源
+            if not self.feeds:
+                return False
+            address = parse_address(ip)
+            return address is not None and self.feeds.lookup(address) is not None
+        
+        # IPv6地址写法不唯一(及IPv4映射地址),规范化后再查
+        address = parse_address(ip)
+        if address is None:
+            return False
+        if str(address) in self.blocked_ips:
+            return True
+        if self._networks.lookup(address) is not None:
+            return True
+        if self._bloom is not None:
+            self.bloom_false_positives += 1
+        return self.feeds.lookup(address) is not None
+    
+    async def check_ips(self, ips: List[str]) -> List[Dict]:
+        """
+        批量检查IP(审计用,IP黑名单源按排序后的地址批量查找)
+        
+        输入:
+            ips: IP地址列表
+            
+        输出:
+            每个IP的结果: {"ip", "blocked", "source"}
+            source: "ip"(单个地址) / "network:<网段>" / "feed:<源名称>" / 无效地址为"invalid" / 未拉黑为None
+        """
+        addresses = [parse_address(ip) for ip in ips]
+        feed_hits = self.feeds.lookup_many(addresses)
+        
+        results = []
+        for ip, address, feed in zip(ips, addresses, feed_hits):
+            if address is None:
+                source = "invalid"
+            elif ip in self.blocked_ips or str(address) in self.blocked_ips:
+                source = "ip"
+            else:
+                network = self._networks.lookup(address)
+                if network is not None:
+                    source = f"network:{network}"
+                elif feed is not None:
+                    source = f"feed:{feed}"
+                else:
+                    source = None
+            results.append({
+                "ip": ip,
+                "blocked": source is not None and source != "invalid",
+                "source": source
+            })
+        return results
     
     async def is_domain_blocked(self, domain: str) -> bool:
         """
         检查域名是否在黑名单中
         
+        域名或它的任一上级域名被拉黑即为拉黑;白名单中有更具体的后缀时不拉黑
+        (拉黑 spam.example 覆盖 a1.spam.example;同时白名单 ok.spam.example 时后者放行)
+        
         输入:
             domain: 域名
             
         输出:
             True: 已拉黑, False: 未拉黑
         """
-        domain = domain.lower()
-        return domain in self.blocked_domains
+        blocked = self._blocked_suffixes.match(domain)
+        if blocked is None:
+            return False
+        allowed = self._whitelist_suffixes.match(domain)
+        # 两者都是同一域名的后缀: 更长即更具体,长度相同时拉黑优先
+        return allowed is None or len(allowed) <= len(blocked)
+    
+    def _is_whitelisted(self, domain: str) -> bool:
+        """
+        检查域名是否在白名单中(后缀匹配,黑名单中有更具体或相同的后缀时不算)
+        
+        输入:
+            domain: 域名
+            
+        输出:
+            True: 在白名单中
+        """
+        allowed = self._whitelist_suffixes.match(domain)
+        if allowed is None:
+            return False
+        blocked = self._blocked_suffixes.match(domain)
+        return blocked is None or len(allowed) > len(blocked)
     
     async def is_sender_blocked(self, sender_email: str) -> bool:
         """
@@ -120,101 +869,152 @@ class Blacklist:
         domain = sender_email.split('@')[1].lower()
         return await self.is_domain_blocked(domain)
     
+    def _upsert(self, kind: str, key: str, reason: str, ttl: int) -> bool:
+        """
+        添加条目或增加已有条目的计数(调用方持有self._lock)
+        
+        已有条目重新拉黑时,过期时间取较晚者;任一方为永久则为永久
+        
+        输入:
+            kind: "ip" / "domain"
+            key: 规范化的IP/网段/域名
+            reason: 拉黑原因
+            ttl: 有效期(秒),0表示永久
+            
+        输出:
+            True: 新添加, False: 已存在
+        """
+        table = self.blocked_ips if kind == "ip" else self.blocked_domains
+        now = datetime.now()
+        expires_at = (now + timedelta(seconds=ttl)).isoformat() if ttl > 0 else None
+        
+        entry = table.get(key)
+        added = entry is None
+        previous = None if added else entry.get('expires_at')
+        if added:
+            entry = {
+                'reason': reason,
+                'added_at': now.isoformat(),
+                'count': 1,
+                'expires_at': expires_at
+            }
+        else:
+            # 已存在,增加计数
+            if previous is None or expires_at is None:
+                expires_at = None
+            elif _expiry_ts(previous) > _expiry_ts(expires_at):
+                expires_at = previous
+            entry = dict(entry, count=entry['count'] + 1, expires_at=expires_at)
+        
+        table[key] = entry
+        if expires_at is not None and expires_at != previous:
+            heapq.heappush(self._expiry_heap, (_expiry_ts(expires_at), kind, key))
+        self._record("set", kind, key, entry)
+        return added
+    
+    def _ttl(self, ttl: Optional[int], category: str) -> int:
+        """有效期: 指定值优先,否则为类别的默认值"""
+        if ttl is not None:
+            return max(0, ttl)
+        return self.default_ttls.get(category, 0)
+    
     async def add_ip(
         self, 
         ip: str, 
         reason: str = "垃圾邮件发送者",
-        save: bool = True
+        save: bool = True,
+        ttl: Optional[int] = None,
+        category: str = CATEGORY_MANUAL
     ) -> bool:
         """
         添加IP到黑名单
         
         输入:
-            ip: IP地址
+            ip: IP地址或CIDR网段(如 1.2.3.0/24、2001:db8::/32)
             reason: 拉黑原因
-            save: 是否立即保存
+            save: 是否立即保存(批量修改时由调用方最后统一保存)
+            ttl: 有效期(秒),0表示永久,None表示按类别的默认值
+            category: 拉黑类别(auto/oversize/manual),决定默认有效期
             
         输出:
-            True: 添加成功, False: 已存在
+            True: 添加成功, False: 已存在或不是合法的地址/网段
         """
-        async with self._lock:
-            if ip in self.blocked_ips:
-                # 已存在,增加计数
-                self.blocked_ips[ip]['count'] += 1
-                if save:
-                    self._save()
-                return False
-            
-            self.blocked_ips[ip] = {
-                'reason': reason,
-                'added_at': datetime.now().isoformat(),
-                'count': 1
-            }
-            
-            logger.warning(f"🚫 拉黑IP: {ip} (原因: {reason})")
-            
-            if save:
-                self._save()
+        try:
+            ip = parse_ip_or_network(ip)
+        except ValueError:
+            logger.warning(f"忽略无效的IP: {ip}")
+            return False
+        
+        with self._lock:
+            added = self._upsert("ip", ip, reason, self._ttl(ttl, category))
+            if added:
+                self._index_add("ip", ip)
+                logger.warning(f"🚫 拉黑IP: {ip} (原因: {reason})")
             
-            return True
+        if save:
+            self._save()
+        return added
     
     async def add_domain(
         self, 
         domain: str, 
         reason: str = "垃圾邮件域名",
-        save: bool = True
+        save: bool = True,
+        ttl: Optional[int] = None,
+        category: str = CATEGORY_MANUAL
     ) -> bool:
         """
-        添加域名到黑名单
+        添加域名到黑名单(同时覆盖其所有子域名)
         
         输入:
             domain: 域名
             reason: 拉黑原因
-            save: 是否立即保存
+            save: 是否立即保存(批量修改时由调用方最后统一保存)
+            ttl: 有效期(秒),0表示永久,None表示按类别的默认值
+            category: 拉黑类别(auto/oversize/manual),决定默认有效期
             
         输出:
             True: 添加成功, False: 已存在
         """
-        async with self._lock:
-            domain = domain.lower()
-            
-            if domain in self.blocked_domains:
-                # 已存在,增加计数
-                self.blocked_domains[domain]['count'] += 1
-                if save:
-                    self._save()
-                return False
+        domain = normalize_domain(domain)
+        with self._lock:
+            added = self._upsert("domain", domain, reason, self._ttl(ttl, category))
+            if added:
+                self._index_add("domain", domain)
+                logger.warning(f"🚫 拉黑域名: {domain} (原因: {reason})")
             
-            self.blocked_domains[domain] = {
-                'reason': reason,
-                'added_at': datetime.now().isoformat(),
-                'count': 1
-            }
-            
-            logger.warning(f"🚫 拉黑域名: {domain} (原因: {reason})")
-            
-            if save:
-                self._save()
-            
-            return True
+        if save:
+            self._save()
+        return added
     
     async def remove_ip(self, ip: str) -> bool:
         """
         从黑名单移除IP
         
         输入:
-            ip: IP地址
+            ip: IP地址或CIDR网段(与添加时的网段相同,不会拆分更大的网段)
             
         输出:
             True: 移除成功, False: 不存在
         """
-        async with self._lock:
-            if ip in self.blocked_ips:
-                del self.blocked_ips[ip]
-                self._save()
-                logger.info(f"✓ 移除IP黑名单: {ip}")
-                return True
-            return False
+        try:
+            ip = parse_ip_or_network(ip)
+        except ValueError:
+            # 不是合法地址的旧条目按原样移除
+            pass
+        
+        with self._lock:
+            if ip not in self.blocked_ips:
+                return False
+            del self.blocked_ips[ip]
+            if '/' in ip:
+                self._networks.remove(ip)
+            self._bloom_stale += 1
+            self._record("del", "ip", ip)
+        
+        self._save()
+        logger.info(f"✓ 移除IP黑名单: {ip}")
+        return True
     
     async def remove_domain(self, domain: str) -> bool:
         """
@@ -226,28 +1026,37 @@ class Blacklist:
         输出:
             True: 移除成功, False: 不存在
         """
-        async with self._lock:
-            domain = domain.lower()
-            if domain in self.blocked_domains:
-                del self.blocked_domains[domain]
-                self._save()
-                logger.info(f"✓ 移除域名黑名单: {domain}")
-                return True
-            return False
+        domain = normalize_domain(domain)
+        with self._lock:
+            if domain not in self.blocked_domains:
+                return False
+            del self.blocked_domains[domain]
+            self._blocked_suffixes.remove(domain)
+            self._record("del", "domain", domain)
+        
+        self._save()
+        logger.info(f"✓ 移除域名黑名单: {domain}")
+        return True
     
     async def learn_whitelist_domain(self, domain: str):
         """
         学习白名单域名(从用户规则中提取)
         
+        已被白名单中的上级域名覆盖时不再单独记录
+        
         输入:
             domain: 域名
         """
-        async with self._lock:
-            domain = domain.lower()
-            if domain not in self.whitelist_domains:
-                self.whitelist_domains.add(domain)
-                self._save()
-                logger.info(f"✓ 学习白名单域名: {domain}")
+        domain = normalize_domain(domain)
+        with self._lock:
+            if self._is_whitelisted(domain):
+                return
+            self.whitelist_domains.add(domain)
+            self._whitelist_suffixes.add(domain)
+            self._record("set", "whitelist", domain)
+        
+        self._save()
+        logger.info(f"✓ 学习白名单域名: {domain}")
     
     async def auto_block_stranger(
         self, 
@@ -269,19 +1078,181 @@ class Blacklist:
         
         domain = sender_email.split('@')[1].lower()
         
-        # 检查是否在白名单中
-        if domain in self.whitelist_domains:
+        # 检查是否在白名单中(含上级域名)
+        if self._is_whitelisted(domain):
             return False
         
         # 拉黑IP和域名
-        await self.add_ip(ip, f"未授权域名发件: {domain}", save=False)
-        await self.add_domain(domain, "未授权域名", save=False)
+        await self.add_ip(ip, f"未授权域名发件: {domain}", save=False, category=CATEGORY_AUTO)
+        await self.add_domain(domain, "未授权域名", save=False, category=CATEGORY_AUTO)
         
         # 批量保存
         self._save()
         
         return True
     
+    def _restore(self, kind: str, key: str, entry: Dict):
+        """
+        按原样写入条目(导入导出的条目,替换已有条目;调用方持有self._lock)
+        
+        输入:
+            kind: "ip" / "domain"
+            key: 规范化的IP/网段/域名
+            entry: 完整条目
+        """
+        table = self.blocked_ips if kind == "ip" else self.blocked_domains
+        expires_at = entry.get('expires_at')
+        if expires_at:
+            heapq.heappush(self._expiry_heap, (_expiry_ts(expires_at), kind, key))
+        table[key] = entry
+        self._record("set", kind, key, entry)
+    
+    async def import_entries(self, entries: List[Dict]) -> Dict:
+        """
+        批量导入条目: 在一次加锁中全部应用,之后只写入一次(日志一次追加/数据库一个事务)
+        
+        输入:
+            entries: 已校验和规范化的条目(BlacklistImportEntry字段):
+                kind, key, reason, ttl, added_at, count, expires_at;
+                有added_at的条目按原样恢复,否则按手动拉黑处理(已存在时增加计数)
+                
+        输出:
+            各类型新增/更新的条目数
+        """
+        result = {kind: {'added': 0, 'updated': 0} for kind in ("ip", "domain", "whitelist")}
+        with self._lock:
+            for item in entries:
+                kind, key = item['kind'], item['key']
+                if kind == "whitelist":
+                    if key not in self.whitelist_domains:
+                        self.whitelist_domains.add(key)
+                        self._whitelist_suffixes.add(key)
+                        self._record("set", "whitelist", key)
+                        result[kind]['added'] += 1
+                    continue
+                
+                table = self.blocked_ips if kind == "ip" else self.blocked_domains
+                added = key not in table
+                reason = item.get('reason') or IMPORT_REASON
+                if item.get('added_at'):
+                    self._restore(kind, key, {
+                        'reason': reason,
+                        'added_at': item['added_at'],
+                        'count': item.get('count') or 1,
+                        'expires_at': item.get('expires_at')
+                    })
+                else:
+                    self._upsert(kind, key, reason, self._ttl(item.get('ttl'), CATEGORY_MANUAL))
+                if added:
+                    self._index_add(kind, key)
+                result[kind]['added' if added else 'updated'] += 1
+        
+        await self.flush()
+        logger.warning(
+            f"🚫 批量导入黑名单: IP新增{result['ip']['added']}个/更新{result['ip']['updated']}个, "
+            f"域名新增{result['domain']['added']}个/更新{result['domain']['updated']}个, "
+            f"白名单新增{result['whitelist']['added']}个"
+        )
+        return result
+    
+    def list_entries(
+        self,
+        kind: str,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        prefix: Optional[str] = None,
+        reason: Optional[str] = None,
+        added_after: Optional[str] = None,
+        added_before: Optional[str] = None
+    ) -> Dict:
+        """
+        按键顺序分页列出条目
+        
+        游标为上一页最后一个键,翻页期间增删条目不会导致重复或跳过其余条目
+        (SQLite存储按主键范围查询,JSON存储在锁内扫描一遍取最小的limit个)
+        
+        输入:
+            kind: "ip" / "domain" / "whitelist"
+            cursor: 上一页返回的next_cursor,不指定时从头开始
+            limit: 每页条目数(最多MAX_PAGE_SIZE)
+            prefix: 只列出以此开头的键
+            reason: 只列出拉黑原因包含该文本的条目
+            added_after / added_before: 只列出添加时间在此区间的条目(ISO格式,前闭后开)
+            
+        输出:
+            {"kind", "total", "entries": [{"key", ...条目}], "next_cursor": 下一页游标(没有更多时为None)}
+        """
+        after = cursor or ""
+        prefix = prefix or ""
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        
+        def matches(item: Tuple[str, Dict]) -> bool:
+            key, entry = item
+            if key <= after or not key.startswith(prefix):
+                return False
+            if reason and reason not in (entry.get('reason') or ''):
+                return False
+            added_at = entry.get('added_at') or ''
+            if added_after and added_at < added_after:
+                return False
+            if added_before and added_at >= added_before:
+                return False
+            return True
+        
+        if kind == "whitelist":
+            table = self.whitelist_domains
+            with self._lock:
+                page = heapq.nsmallest(
+                    limit + 1, filter(matches, ((key, {}) for key in table)), key=itemgetter(0)
+                )
+        else:
+            table = self.blocked_ips if kind == "ip" else self.blocked_domains
+            items_from = getattr(table, "items_from", None)
+            if items_from is not None:
+                # SQLite存储: 按主键顺序从游标处读取,够一页即停
+                with self._lock:
+                    source = items_from(after, prefix)
+                page = list(islice(filter(matches, source), limit + 1))
+            else:
+                with self._lock:
+                    page = heapq.nsmallest(limit + 1, filter(matches, table.items()), key=itemgetter(0))
+        
+        more = len(page) > limit
+        page = page[:limit]
+        return {
+            'kind': kind,
+            'total': len(table),
+            'entries': [{'key': key, **entry} for key, entry in page],
+            'next_cursor': page[-1][0] if more else None
+        }
+    
+    def export_entries(self, kinds: Iterable[str] = ("ip", "domain", "whitelist")) -> Iterator[Dict]:
+        """
+        逐条导出(格式与import_entries的输入相同)
+        
+        JSON存储在锁内复制条目引用后释放锁(条目只读,修改时整体替换);SQLite存储按主键分批读取
+        
+        输入:
+            kinds: 要导出的类型
+            
+        输出:
+            {"kind", "key", ...条目} 迭代器
+        """
+        for kind in kinds:
+            if kind == "whitelist":
+                with self._lock:
+                    keys = sorted(self.whitelist_domains)
+                for key in keys:
+                    yield {'kind': kind, 'key': key}
+                continue
+            
+            table = self.blocked_ips if kind == "ip" else self.blocked_domains
+            items_from = getattr(table, "items_from", None)
+            with self._lock:
+                items = items_from() if items_from is not None else list(table.items())
+            for key, entry in items:
+                yield {'kind': kind, 'key': key, **entry}
+    
     def get_stats(self) -> Dict:
         """
         获取黑名单统计信息
@@ -291,11 +1262,63 @@ class Blacklist:
         """
         return {
             'blocked_ips_count': len(self.blocked_ips),
+            'blocked_networks_count': len(self._networks),
             'blocked_domains_count': len(self.blocked_domains),
             'whitelist_domains_count': len(self.whitelist_domains),
             'blocked_ips': list(self.blocked_ips.keys()),
             'blocked_domains': list(self.blocked_domains.keys()),
-            'whitelist_domains': list(self.whitelist_domains)
+            'whitelist_domains': list(self.whitelist_domains),
+            'ip_feeds': self.feeds.get_stats(),
+            'filter': self._filter_stats(),
+            'expiry': {
+                'default_ttls': self.default_ttls,
+                'reap_interval': self.reap_interval,
+                'expired': self.expired,
+                'heap_size': len(self._expiry_heap),
+                'next_expiry_at': (
+                    datetime.fromtimestamp(self._expiry_heap[0][0]).isoformat()
+                    if self._expiry_heap else None
+                )
+            },
+            'persistence': {
+                'flush_interval': self.flush_interval,
+                'write_behind': self._flush_task is not None,
+                'pending': len(self._pending),
+                'flushes': self.flushes,
+                'last_flush_at': self.last_flush_at,
+                'compact_interval': self.compact_interval,
+                'reload_interval': self.reload_interval,
+                'reloads': self.reloads,
+                'last_reload_at': self.last_reload_at,
+                **self._store.get_stats()
+            }
+        }
+    
+    def _filter_stats(self) -> Dict:
+        """
+        过滤器统计
+        
+        输出:
+            大小、键数、估算误判率(按置位比例)和实际误判率(不在IP黑名单中的查询里未被过滤器排除的比例)
+        """
+        bloom = self._bloom
+        if bloom is None:
+            return {'enabled': False}
+        checked = self.bloom_negatives + self.bloom_false_positives
+        return {
+            'enabled': True,
+            'target_fp_rate': self.bloom_fp_rate,
+            'bytes': bloom.nbytes(),
+            'hashes': bloom.hashes,
+            'keys': len(bloom),
+            'capacity': bloom.capacity,
+            'stale': self._bloom_stale,
+            'estimated_fp_rate': round(bloom.estimated_fp_rate(), 6),
+            'queries': self.bloom_queries,
+            'negatives': self.bloom_negatives,
+            'false_positives': self.bloom_false_positives,
+            'observed_fp_rate': round(self.bloom_false_positives / checked, 6) if checked else 0.0,
+            'rebuilds': self.bloom_rebuilds
         }
     
     def get_detailed_list(self) -> Dict:
@@ -306,8 +1329,8 @@ class Blacklist:
             详细黑名单字典
         """
         return {
-            'blocked_ips': self.blocked_ips,
-            'blocked_domains': self.blocked_domains,
+            'blocked_ips': dict(self.blocked_ips.items()),
+            'blocked_domains': dict(self.blocked_domains.items()),
             'whitelist_domains': list(self.whitelist_domains)
         }
 
@@ -316,6 +1339,52 @@ class Blacklist:
 _blacklist: Optional[Blacklist] = None
 
 
+def init_blacklist(
+    storage_path: str = "data/blacklist.json",
+    flush_interval: float = 2.0,
+    compact_records: int = 50000,
+    compact_interval: int = 3600,
+    ip_feeds: Iterable[str] = (),
+    feed_reload_interval: int = 300,
+    default_ttls: Optional[Dict[str, int]] = None,
+    reap_interval: int = 60,
+    bloom_fp_rate: float = 0.01,
+    reload_interval: int = 5
+) -> Blacklist:
+    """
+    按配置初始化全局黑名单实例
+    
+    输入:
+        storage_path: 黑名单快照文件路径
+        flush_interval: 后台刷新间隔(秒)
+        compact_records: 日志压缩的记录数阈值
+        compact_interval: 日志压缩间隔(秒)
+        ip_feeds: 第三方IP黑名单源文件
+        feed_reload_interval: 检查黑名单源文件变化的间隔(秒)
+        default_ttls: 各拉黑类别的默认有效期(秒)
+        reap_interval: 清理到期条目的间隔(秒)
+        bloom_fp_rate: IP查询前置布隆过滤器的目标误判率,0表示关闭
+        reload_interval: 检查快照文件外部修改的间隔(秒),0表示不检查
+        
+    输出:
+        Blacklist实例
+    """
+    global _blacklist
+    _blacklist = Blacklist(
+        storage_path=storage_path,
+        flush_interval=flush_interval,
+        compact_records=compact_records,
+        compact_interval=compact_interval,
+        ip_feeds=ip_feeds,
+        feed_reload_interval=feed_reload_interval,
+        default_ttls=default_ttls,
+        reap_interval=reap_interval,
+        bloom_fp_rate=bloom_fp_rate,
+        reload_interval=reload_interval
+    )
+    return _blacklist
+
+
 def get_blacklist() -> Blacklist:
     """
     获取全局黑名单实例
@@ -0,0 +1,759 @@
+"""
+黑名单持久化存储(快照 + 追加日志)
+
+功能:
+    - 每次修改以一行NDJSON记录追加到日志文件,写入成本与黑名单大小无关
+    - 一批记录只写一次、fsync一次
+    - 记录是幂等的(写入条目的完整内容/删除/加入白名单),重放多次结果相同
+    - 启动时加载快照再重放日志;日志末尾被截断的半行(写入中途崩溃)丢弃
+    - 压缩: 把当前状态原子写入新快照(临时文件+替换),再清空日志
+    - 记录快照文件的修改时间/大小/inode(加载和压缩时),据此判断快照是否被外部修改(手工编辑/从其他节点同步);
+      保留最近一次加载/写入的快照内容,重新加载时把外部修改前后的差异作为记录插入日志中外部修改发生的位置
+      (追加日志时发现快照已被外部修改则记下该位置),之前的记录(如尚未压缩的自动拉黑)照常保留,
+      手工删除的条目也不会被更早的记录恢复;插入后的日志在新快照上重放,重启与重新加载结果一致
+    - 可选SQLite存储(storage以.db/.sqlite/.sqlite3结尾): WAL模式,每批记录一个事务;
+      内存中只保留键集合(热成员集),条目内容按需从数据库读取,适合数百万条的黑名单
+
+调用链:
+    Blacklist.__init__ -> open_store -> JournalStore / SqliteStore
+    Blacklist.__init__ -> JournalStore.load -> 快照 + apply_record(日志每行)
+    Blacklist._flush_sync -> JournalStore.append(一批记录) / JournalStore.compact(快照)
+    Blacklist.__init__ -> SqliteStore.load -> SqliteTable(键集合 + 数据库)
+    Blacklist._flush_sync -> SqliteStore.append(一个事务) -> SqliteStore.settle(清除已提交的修改)
+
+输入: 黑名单修改记录 / 快照
+输出: 加载后的黑名单状态
+"""
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from collections.abc import MutableMapping
+from datetime import datetime
+from operator import itemgetter
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class BlacklistState:
+    """加载/重放得到的黑名单状态"""
+    
+    __slots__ = ("blocked_ips", "blocked_domains", "whitelist_domains")
+    
+    def __init__(self):
+        self.blocked_ips: Dict[str, Dict] = {}
+        self.blocked_domains: Dict[str, Dict] = {}
+        self.whitelist_domains: Set[str] = set()
+
+
+def make_record(op: str, kind: str, key: str, entry: Optional[Dict] = None) -> Dict:
+    """
+    构造日志记录
+    
+    输入:
+        op: "set"(写入条目) / "del"(删除条目)
+        kind: "ip" / "domain" / "whitelist"
+        key: IP地址或域名
+        entry: 条目的完整内容(set时,whitelist没有内容)
+        
+    输出:
+        日志记录
+    """
+    record = {"op": op, "kind": kind, "key": key}
+    if entry is not None:
+        # 复制: 记录写入前条目的计数可能继续变化
+        record["entry"] = dict(entry)
+    return record
+
+
+def copy_state(state: BlacklistState) -> BlacklistState:
+    """
+    复制状态(条目为副本,之后对条目的修改不影响副本)
+    
+    输入:
+        state: 黑名单状态
+        
+    输出:
+        状态副本
+    """
+    copy = BlacklistState()
+    copy.blocked_ips = {key: dict(entry) for key, entry in state.blocked_ips.items()}
+    copy.blocked_domains = {key: dict(entry) for key, entry in state.blocked_domains.items()}
+    copy.whitelist_domains = set(state.whitelist_domains)
+    return copy
+
+
+def diff_records(base: BlacklistState, new: BlacklistState) -> List[Dict]:
+    """
+    计算把base变为new的记录
+    
+    输入:
+        base: 原状态
+        new: 新状态
+        
+    输出:
+        日志记录(只包含有变化的条目)
+    """
+    records = []
+    for kind, old_table, new_table in (
+        ("ip", base.blocked_ips, new.blocked_ips),
+        ("domain", base.blocked_domains, new.blocked_domains),
+    ):
+        for key in old_table.keys() - new_table.keys():
+            records.append(make_record("del", kind, key))
+        for key, entry in new_table.items():
+            if old_table.get(key) != entry:
+                records.append(make_record("set", kind, key, entry))
+    for key in base.whitelist_domains - new.whitelist_domains:
+        records.append(make_record("del", "whitelist", key))
+    for key in new.whitelist_domains - base.whitelist_domains:
+        records.append(make_record("set", "whitelist", key))
+    return records
+
+
+def _encode_records(records: List[Dict]) -> bytes:
+    """日志记录编码为NDJSON"""
+    return "".join(
+        json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        for record in records
+    ).encode("utf-8")
+
+
+def apply_record(state: BlacklistState, record: Dict):
+    """
+    把一条日志记录应用到状态上(幂等)
+    
+    输入:
+        state: 黑名单状态
+        record: 日志记录
+    """
+    op, kind, key = record["op"], record["kind"], record["key"]
+    if kind == "whitelist":
+        if op == "set":
+            state.whitelist_domains.add(key)
+        else:
+            state.whitelist_domains.discard(key)
+        return
+    
+    table = state.blocked_ips if kind == "ip" else state.blocked_domains
+    if op == "set":
+        table[key] = record["entry"]
+    else:
+        table.pop(key, None)
+
+
+class JournalStore:
+    """JSON快照 + NDJSON追加日志"""
+    
+    # 压缩时写入完整快照(调用方需提供当前状态)
+    writes_snapshot = True
+    
+    def __init__(self, storage_path: Path, compact_records: int = 50000):
+        """
+        初始化存储
+        
+        输入:
+            storage_path: 快照文件路径(日志文件为同名.journal)
+            compact_records: 日志记录数达到该值时压缩
+        """
+        self.storage_path = Path(storage_path)
+        self.journal_path = self.storage_path.with_suffix(".journal")
+        self.compact_records = compact_records
+        
+        self.journal_records = 0
+        self.journal_bytes = 0
+        self.compactions = 0
+        self.last_compaction_at: Optional[str] = None
+        # 最近一次加载/写入的快照文件签名
+        self._signature: Optional[Tuple[int, int, int]] = None
+        # 最近一次加载/写入的快照内容(日志记录都基于它),外部修改后据此计算差异
+        self._base = BlacklistState()
+        # 发现快照被外部修改后第一次追加时的日志位置(之前的记录早于外部修改)
+        self._edit_offset: Optional[int] = None
+    
+    def _stat_signature(self) -> Optional[Tuple[int, int, int]]:
+        """快照文件的(修改时间, 大小, inode),不存在时为None"""
+        try:
+            st = os.stat(self.storage_path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+    
+    def changed_externally(self) -> bool:
+        """
+        快照文件是否在最近一次加载/压缩之后被外部修改
+        
+        文件被删除不算修改(避免同步工具先删后写时清空黑名单)
+        
+        输出:
+            True: 已被修改,需要重新加载
+        """
+        signature = self._stat_signature()
+        return signature is not None and signature != self._signature
+    
+    def load(self, external: bool = False) -> BlacklistState:
+        """
+        加载快照并重放日志
+        
+        输入:
+            external: 快照被外部修改后重新加载: 外部修改的差异(相对上次加载/写入的快照)
+                插入日志中外部修改发生的位置,之前的记录照常重放但不会撤销外部修改
+        
+        输出:
+            黑名单状态
+        """
+        state = BlacklistState()
+        # 读取前记录签名: 读取期间文件再次变化时,下次检查会再加载一次;解析失败时等文件再次变化
+        self._signature = self._stat_signature()
+        
+        if self.storage_path.exists():
+            with open(self.storage_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            state.blocked_ips = data.get("blocked_ips", {})
+            state.blocked_domains = data.get("blocked_domains", {})
+            state.whitelist_domains = set(data.get("whitelist_domains", []))
+        
+        inserted = b""
+        offset = 0
+        if external:
+            inserted = _encode_records(diff_records(self._base, state))
+            offset = self.journal_bytes if self._edit_offset is None else self._edit_offset
+        base = copy_state(state)
+        self.journal_records = self._replay(state, offset, inserted)
+        self._base = base
+        self._edit_offset = None
+        if self.journal_records:
+            logger.info(f"已重放黑名单日志: {self.journal_records}条记录")
+        return state
+    
+    def _replay(self, state: BlacklistState, offset: int = 0, inserted: bytes = b"") -> int:
+        """
+        重放日志
+        
+        输入:
+            state: 要应用记录的状态
+            offset: inserted插入日志的位置
+            inserted: 要插入日志的记录(外部修改的差异),插入后的日志原子替换原日志
+            
+        输出:
+            有效记录数
+        """
+        data = b""
+        if self.journal_path.exists():
+            with open(self.journal_path, "rb") as f:
+                data = f.read()
+        
+        # 末尾没有换行的半行是写入中途崩溃留下的: 丢弃并截断,避免下一条记录接在它后面
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            logger.warning(f"黑名单日志末尾有不完整的记录,已丢弃{len(data) - complete}字节")
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(complete)
+        data = data[:complete]
+        
+        if inserted:
+            offset = min(offset, complete)
+            changes = inserted.count(b"\n")
+            logger.info(f"快照已被外部修改,差异记录插入黑名单日志: {changes}条")
+            data = data[:offset] + inserted + data[offset:]
+            self._rewrite_journal(data)
+        self.journal_bytes = len(data)
+        
+        count = 0
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                apply_record(state, json.loads(line))
+                count += 1
+            except (ValueError, KeyError) as e:
+                logger.warning(f"跳过无效的黑名单日志记录: {e}")
+        return count
+    
+    def _rewrite_journal(self, data: bytes):
+        """用data原子替换日志文件"""
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.journal_path.parent, prefix=self.journal_path.name + ".", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.journal_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def append(self, records: List[Dict]):
+        """
+        追加一批记录(一次写入,一次fsync)
+        
+        输入:
+            records: 日志记录
+        """
+        if not records:
+            return
+        
+        # 快照已被外部修改、尚未重新加载: 之后的记录晚于外部修改,重新加载时需要保留
+        if self._edit_offset is None and self.changed_externally():
+            self._edit_offset = self.journal_bytes
+        
+        data = _encode_records(records)
+        with open(self.journal_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        self.journal_records += len(records)
+        self.journal_bytes += len(data)
+    
+    def settle(self, records: List[Dict]):
+        """记录已写入(日志存储没有需要清除的缓存)"""
+    
+    def needs_compaction(self) -> bool:
+        """日志记录数是否达到压缩阈值"""
+        return bool(self.compact_records) and self.journal_records >= self.compact_records
+    
+    def compact(self, snapshot: Dict):
+        """
+        写入新快照并清空日志
+        
+        快照先写临时文件再原子替换;替换后、清空日志前崩溃时,
+        重启会在新快照上重放旧日志,记录幂等,结果不变
+        
+        输入:
+            snapshot: 当前黑名单的完整状态(包含所有已追加和待追加的记录)
+        """
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.storage_path.parent, prefix=self.storage_path.name + ".", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp创建的文件只有属主可读,改为普通文件权限
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.storage_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._signature = self._stat_signature()
+        
+        with open(self.journal_path, "wb") as f:
+            os.fsync(f.fileno())
+        
+        # 快照由调用方新建,之后不再修改,直接作为差异基准
+        self._base = BlacklistState()
+        self._base.blocked_ips = snapshot["blocked_ips"]
+        self._base.blocked_domains = snapshot["blocked_domains"]
+        self._base.whitelist_domains = set(snapshot["whitelist_domains"])
+        
+        self.journal_records = 0
+        self.journal_bytes = 0
+        self._edit_offset = None
+        self.compactions += 1
+        self.last_compaction_at = datetime.now().isoformat()
+    
+    def get_stats(self) -> Dict:
+        """
+        获取存储统计
+        
+        输出:
+            日志记录数/字节数、压缩次数、最近一次压缩时间
+        """
+        return {
+            "backend": "journal",
+            "journal_records": self.journal_records,
+            "journal_bytes": self.journal_bytes,
+            "compact_records": self.compact_records,
+            "compactions": self.compactions,
+            "last_compaction_at": self.last_compaction_at
+        }
+
+
+# 使用SQLite存储的文件后缀
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+# 尚未提交的删除
+_DELETED = None
+
+
+def _row_entry(row) -> Dict:
+    """数据库行(reason, added_at, count, expires_at)转为条目"""
+    return {"reason": row[0], "added_at": row[1], "count": row[2], "expires_at": row[3]}
+
+
+class SqliteTable(MutableMapping):
+    """
+    数据库中的黑名单表(IP或域名)
+    
+    键集合常驻内存(成员检查不访问数据库);尚未提交的修改保存在覆盖层中,
+    读取时优先于数据库。修改由Blacklist在self._lock下进行
+    """
+    
+    def __init__(self, store: "SqliteStore", table: str, keys: Set[str]):
+        """
+        输入:
+            store: 所属存储(提供只读连接)
+            table: 表名
+            keys: 表中已有的键
+        """
+        self._store = store
+        self._table = table
+        self._keys = keys
+        # 尚未提交的修改: {键: 条目 / _DELETED}
+        self._overlay: Dict[str, Optional[Dict]] = {}
+    
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+    
+    def __len__(self) -> int:
+        return len(self._keys)
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._keys))
+    
+    def __getitem__(self, key: str) -> Dict:
+        if key in self._overlay:
+            entry = self._overlay[key]
+            if entry is _DELETED:
+                raise KeyError(key)
+            return entry
+        if key not in self._keys:
+            raise KeyError(key)
+        row = self._store.read_row(self._table, key)
+        if row is None:
+            raise KeyError(key)
+        return row
+    
+    def __setitem__(self, key: str, entry: Dict):
+        self._keys.add(key)
+        self._overlay[key] = entry
+    
+    def __delitem__(self, key: str):
+        self._keys.remove(key)
+        self._overlay[key] = _DELETED
+    
+    def items(self) -> Iterator[Tuple[str, Dict]]:
+        """
+        遍历所有条目(一次扫描数据库,覆盖层中的修改优先)
+        
+        输出:
+            按键排序的(键, 条目)迭代器
+        """
+        return self.items_from()
+    
+    def items_from(self, after: str = "", prefix: str = "") -> Iterator[Tuple[str, Dict]]:
+        """
+        按键顺序从某个键之后遍历条目(分页/导出用;调用时复制覆盖层,调用方持有Blacklist._lock)
+        
+        输入:
+            after: 只返回大于该键的条目
+            prefix: 只返回以此开头的键
+            
+        输出:
+            按键排序的(键, 条目)迭代器
+        """
+        overlay = {
+            key: entry for key, entry in self._overlay.items()
+            if key > after and key.startswith(prefix)
+        }
+        pending = sorted((key, entry) for key, entry in overlay.items() if entry is not _DELETED)
+        stored = (
+            (key, entry) for key, entry in self._store.scan_rows(self._table, after, prefix)
+            if key not in overlay
+        )
+        return heapq.merge(stored, pending, key=itemgetter(0))
+    
+    def expiring(self) -> Iterator[Tuple[str, str]]:
+        """
+        遍历有过期时间的条目(数据库索引 + 覆盖层)
+        
+        输出:
+            (键, 过期时间)迭代器
+        """
+        overlay = dict(self._overlay)
+        for key, expires_at in self._store.scan_expiring(self._table):
+            if key not in overlay:
+                yield key, expires_at
+        for key, entry in overlay.items():
+            if entry is not _DELETED and entry.get("expires_at"):
+                yield key, entry["expires_at"]
+    
+    def settle(self, key: str, entry: Optional[Dict]):
+        """
+        修改已提交: 覆盖层中的值没有再变化时移除(调用方持有Blacklist._lock)
+        
+        输入:
+            key: 键
+            entry: 已提交的条目(删除为None)
+        """
+        if key in self._overlay and self._overlay[key] == entry:
+            del self._overlay[key]
+    
+    @property
+    def unsettled(self) -> int:
+        """尚未提交的修改数"""
+        return len(self._overlay)
+
+
+class SqliteStore:
+    """SQLite存储(WAL模式,批量写入)"""
+    
+    # 记录类型 -> 表名
+    _TABLES = {"ip": "blocked_ips", "domain": "blocked_domains"}
+    
+    # 数据库即当前状态,没有快照: 待写入的记录只能通过append写入
+    writes_snapshot = False
+    
+    def __init__(self, storage_path: Path):
+        """
+        初始化存储
+        
+        输入:
+            storage_path: 数据库文件路径
+        """
+        self.storage_path = Path(storage_path)
+        self._tables: Dict[str, SqliteTable] = {}
+        
+        # 写连接只在持有Blacklist._write_lock时使用;读连接由自己的锁保护
+        self._writer = self._connect()
+        self._reader = self._connect()
+        self._read_lock = threading.Lock()
+        
+        self.batches = 0
+        self.rows_written = 0
+        self.compactions = 0
+        self.journal_records = 0
+    
+    def _connect(self) -> sqlite3.Connection:
+        """打开连接(WAL模式,普通同步级别)"""
+        conn = sqlite3.connect(self.storage_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def _create_schema(self):
+        """创建表和索引"""
+        for table in self._TABLES.values():
+            self._writer.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, reason TEXT, added_at TEXT, count INTEGER, expires_at TEXT"
+                ") WITHOUT ROWID"
+            )
+            # 早期版本的表没有过期时间列
+            columns = {row[1] for row in self._writer.execute(f"PRAGMA table_info({table})")}
+            if "expires_at" not in columns:
+                self._writer.execute(f"ALTER TABLE {table} ADD COLUMN expires_at TEXT")
+            self._writer.execute(f"CREATE INDEX IF NOT EXISTS {table}_added_at ON {table}(added_at)")
+            self._writer.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table}(expires_at)")
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS whitelist_domains (key TEXT PRIMARY KEY) WITHOUT ROWID"
+        )
+    
+    def load(self, external: bool = False) -> BlacklistState:
+        """
+        打开数据库,加载键集合和白名单
+        
+        数据库为空且旁边有同名的JSON快照或日志时,先导入(从JSON存储切换过来)
+        
+        输入:
+            external: 与JournalStore一致的参数(数据库不检查外部修改,忽略)
+        
+        输出:
+            黑名单状态(IP/域名为SqliteTable)
+        """
+        self._create_schema()
+        
+        legacy = JournalStore(self.storage_path.with_suffix(".json"))
+        if (legacy.storage_path.exists() or legacy.journal_path.exists()) and self._is_empty():
+            self._import(legacy.load())
+            logger.info(f"已从 {legacy.storage_path} 导入黑名单到SQLite")
+        
+        state = BlacklistState()
+        for kind, table in self._TABLES.items():
+            keys = {row[0] for row in self._writer.execute(f"SELECT key FROM {table}")}
+            self._tables[kind] = SqliteTable(self, table, keys)
+        state.blocked_ips = self._tables["ip"]
+        state.blocked_domains = self._tables["domain"]
+        state.whitelist_domains = {
+            row[0] for row in self._writer.execute("SELECT key FROM whitelist_domains")
+        }
+        return state
+    
+    def _is_empty(self) -> bool:
+        for table in list(self._TABLES.values()) + ["whitelist_domains"]:
+            if self._writer.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return False
+        return True
+    
+    def _import(self, state: BlacklistState):
+        """把JSON存储的状态整体写入数据库"""
+        records = [make_record("set", "ip", key, entry) for key, entry in state.blocked_ips.items()]
+        records += [make_record("set", "domain", key, entry) for key, entry in state.blocked_domains.items()]
+        records += [make_record("set", "whitelist", key) for key in state.whitelist_domains]
+        self.append(records)
+    
+    def read_row(self, table: str, key: str) -> Optional[Dict]:
+        """
+        读取一个条目
+        
+        输入:
+            table: 表名
+            key: 键
+            
+        输出:
+            条目,不存在时返回None
+        """
+        with self._read_lock:
+            row = self._reader.execute(
+                f"SELECT reason, added_at, count, expires_at FROM {table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return _row_entry(row)
+    
+    def scan_rows(self, table: str, after: str = "", prefix: str = "") -> Iterator[Tuple[str, Dict]]:
+        """
+        按键顺序遍历表(按主键分批读取,不一次加载整表)
+        
+        输入:
+            table: 表名
+            after: 从大于该键的行开始
+            prefix: 只返回以此开头的键(键有序,遇到第一个不匹配的键即结束)
+            
+        输出:
+            (键, 条目)迭代器
+        """
+        last = after
+        while True:
+            with self._read_lock:
+                rows = self._reader.execute(
+                    f"SELECT key, reason, added_at, count, expires_at FROM {table} "
+                    "WHERE key > ? AND key >= ? ORDER BY key LIMIT 1000",
+                    (last, prefix)
+                ).fetchall()
+            for row in rows:
+                if not row[0].startswith(prefix):
+                    return
+                yield row[0], _row_entry(row[1:])
+            if len(rows) < 1000:
+                return
+            last = rows[-1][0]
+    
+    def scan_expiring(self, table: str) -> Iterator[Tuple[str, str]]:
+        """
+        遍历有过期时间的条目(走expires_at索引)
+        
+        输入:
+            table: 表名
+            
+        输出:
+            (键, 过期时间)迭代器
+        """
+        with self._read_lock:
+            rows = self._reader.execute(
+                f"SELECT key, expires_at FROM {table} WHERE expires_at IS NOT NULL"
+            ).fetchall()
+        return iter(rows)
+    
+    def append(self, records: List[Dict]):
+        """
+        在一个事务中写入一批记录
+        
+        输入:
+            records: 日志记录
+        """
+        if not records:
+            return
+        
+        conn = self._writer
+        conn.execute("BEGIN")
+        try:
+            for record in records:
+                op, kind, key = record["op"], record["kind"], record["key"]
+                table = self._TABLES.get(kind, "whitelist_domains")
+                if op == "del":
+                    conn.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+                elif kind == "whitelist":
+                    conn.execute("INSERT OR IGNORE INTO whitelist_domains (key) VALUES (?)", (key,))
+                else:
+                    entry = record["entry"]
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO {table} (key, reason, added_at, count, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (key, entry.get("reason"), entry.get("added_at"), entry.get("count", 1),
+                         entry.get("expires_at"))
+                    )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        
+        self.batches += 1
+        self.rows_written += len(records)
+    
+    def settle(self, records: List[Dict]):
+        """
+        记录已提交: 清除表覆盖层中对应的修改(调用方持有Blacklist._lock)
+        
+        输入:
+            records: 已提交的记录
+        """
+        for record in records:
+            table = self._tables.get(record["kind"])
+            if table is not None:
+                table.settle(record["key"], record.get("entry"))
+    
+    def needs_compaction(self) -> bool:
+        """数据库没有需要压缩的日志(WAL由SQLite自动检查点)"""
+        return False
+    
+    def changed_externally(self) -> bool:
+        """数据库只由本进程写入,不检查外部修改"""
+        return False
+    
+    def compact(self, snapshot: Dict):
+        """数据库不写快照"""
+    
+    def get_stats(self) -> Dict:
+        """
+        获取存储统计
+        
+        输出:
+            写入批次数/行数、未提交的修改数、数据库大小
+        """
+        wal_path = Path(str(self.storage_path) + "-wal")
+        return {
+            "backend": "sqlite",
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "unsettled": sum(table.unsettled for table in self._tables.values()),
+            "db_bytes": self.storage_path.stat().st_size if self.storage_path.exists() else 0,
+            "wal_bytes": wal_path.stat().st_size if wal_path.exists() else 0
+        }
+
+
+def open_store(storage_path: Path, compact_records: int = 50000):
+    """
+    按文件后缀选择存储
+    
+    输入:
+        storage_path: 存储文件路径(.db/.sqlite/.sqlite3为SQLite,其他为JSON快照+日志)
+        compact_records: 日志压缩阈值(仅JSON存储)
+        
+    输出:
+        JournalStore / SqliteStore
+    """
+    if Path(storage_path).suffix.lower() in SQLITE_SUFFIXES:
+        return SqliteStore(storage_path)
+    return JournalStore(storage_path, compact_records=compact_records)
@@ -36,18 +36,46 @@ class SMTPConfig(BaseSettings):
     port: int = 8025
     allowed_domain: str
     max_message_size: int = 10  # MB
+    max_text_bytes: int = 1048576  # 每个正文部分最多解码的字节数,0表示不限制
+    max_inflight_mb: int = 0  # 同时处理中的邮件内存预算(MB),超出时返回452,0表示不限制
+    # 发件人谓词下推: off=关闭, header=只解析头部From判断, envelope=RCPT阶段按MAIL FROM临时拒收(450)
+    sender_pushdown: str = "off"
 
 
 class MonitorConfig(BaseSettings):
     """监控配置"""
     max_connections: int = 10
     timeout: int = 300  # 秒
+    match_budget_ms: int = 0  # 每个API Key在统计窗口内的匹配耗时预算(毫秒),0表示不限制
+    match_budget_window: int = 60  # 统计窗口(秒)
+    match_suspend_factor: float = 2.0  # 耗时超过预算的多少倍后暂停匹配
+
+
+class MatcherConfig(BaseSettings):
+    """规则匹配配置"""
+    max_scan_bytes: int = 0  # 正文/HTML最多扫描的长度(字符),0表示不限制
+    scan_mode: str = "head"  # head=只扫描开头, head_tail=开头和结尾各一半
+    workers: int = 0  # 多进程匹配的工作进程数,0表示在事件循环中匹配
+    shard_size: int = 16  # 每个任务包含的规则集数量
+    batch_window_ms: float = 0  # 微批匹配窗口(毫秒),0表示逐封匹配
+    batch_max_size: int = 64  # 每批最多邮件数
 
 
 class BlacklistConfig(BaseSettings):
     """黑名单配置"""
     storage: str = "data/blacklist.json"
     auto_block: bool = True
+    flush_interval: float = 2.0
+    compact_records: int = 50000
+    compact_interval: int = 3600
+    ip_feeds: List[str] = []
+    feed_reload_interval: int = 300
+    auto_block_ttl: int = 604800
+    oversize_ttl: int = 86400
+    manual_ttl: int = 0
+    reap_interval: int = 60
+    bloom_fp_rate: float = 0.01
+    reload_interval: int = 5
 
 
 class LogRotationConfig(BaseSettings):
@@ -74,6 +102,7 @@ class Settings(BaseSettings):
     server: ServerConfig
     smtp: SMTPConfig
     monitor: MonitorConfig
+    matcher: MatcherConfig = MatcherConfig()
     blacklist: BlacklistConfig
     logging: LoggingConfig
     
@@ -151,6 +180,7 @@ def load_config(config_path: str = "config.yml") -> Settings:
         server=ServerConfig(**config_data.get("server", {})),
         smtp=SMTPConfig(**config_data.get("smtp", {})),
         monitor=MonitorConfig(**config_data.get("monitor", {})),
+        matcher=MatcherConfig(**config_data.get("matcher", {})),
         blacklist=BlacklistConfig(**config_data.get("blacklist", {})),
         logging=LoggingConfig(**logging_config)
     )
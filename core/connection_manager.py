@@ -5,25 +5,57 @@ WebSocket连接管理器
     - 管理所有活跃的WebSocket连接
     - 维护邮箱地址到连接的映射关系
     - 提供邮件推送接口
+    - 按连接/API Key统计匹配耗时,超出预算的订阅降级或暂停匹配
 
 调用链:
     main.py -> ConnectionManager.add/remove
-    smtp_server.py -> ConnectionManager.push_email
+    smtp_server.py -> ConnectionManager.email_to_connections(查找收件人的连接)
+    smtp_server.py -> ParsedEmail.push_payload -> Connection.send_payload
+    smtp_server.py -> ConnectionManager.schedule_matching/record_match_time
 
 输入/输出: 见各方法说明
 """
 import asyncio
+import hashlib
 import logging
-from typing import Dict, List, Optional, Set
+import time
+from typing import Dict, List, Optional, Set, Tuple
 from datetime import datetime
 
 from fastapi import WebSocket
 from schemas.request import MatchRule, EmailContent, EmailReceivedMessage
+from utils.matcher import get_rule_registry
 
 
 logger = logging.getLogger(__name__)
 
 
+# 订阅的匹配状态
+STATE_NORMAL = "normal"
+STATE_DEPRIORITIZED = "deprioritized"  # 超出预算: 其他订阅推送之后再匹配
+STATE_SUSPENDED = "suspended"  # 超出预算×暂停倍数: 本窗口内不再匹配
+
+
+class MatchUsage:
+    """单个API Key的匹配耗时统计(按固定窗口计算预算)"""
+    
+    __slots__ = ("window_start", "window_ns", "total_ns", "evaluations", "skipped")
+    
+    def __init__(self):
+        self.window_start = time.monotonic()
+        self.window_ns = 0  # 当前窗口内的耗时
+        self.total_ns = 0  # 累计耗时
+        self.evaluations = 0  # 累计求值次数
+        self.skipped = 0  # 因暂停而跳过的次数
+    
+    def roll(self, window: int):
+        """窗口到期时清零当前窗口的耗时"""
+        now = time.monotonic()
+        if now - self.window_start >= window:
+            self.window_start = now
+            self.window_ns = 0
+
+
 class Connection:
     """单个WebSocket连接信息"""
     
@@ -32,7 +64,9 @@ class Connection:
         websocket: WebSocket,
         email: str,
         rules: List[MatchRule],
-        timeout: int = 300
+        timeout: int = 300,
+        include_content: bool = True,
+        api_key: str = ""
     ):
         """
         初始化连接
@@ -42,14 +76,25 @@ class Connection:
             email: 监控的邮箱地址
             rules: 匹配规则列表
             timeout: 超时时间(秒)
+            include_content: 推送时是否包含完整正文(否则只推送提取结果)
+            api_key: 建立连接使用的API Key(用于匹配耗时统计)
         """
         self.websocket = websocket
         self.email = email.lower()  # 统一转小写
         self.rules = rules
+        # 预编译的规则求值计划(结构相同的规则集共享同一个计划)
+        self.plan = get_rule_registry().acquire(rules)
         self.timeout = timeout
+        self.include_content = include_content
+        self.api_key = api_key
         self.created_at = datetime.now()
         self.connection_id = f"{self.email}_{self.created_at.timestamp()}"
         self.timeout_task: Optional[asyncio.Task] = None
+        
+        # 匹配耗时统计
+        self.match_time_ns = 0
+        self.match_count = 0
+        self.match_skipped = 0
     
     async def send_email(self, email_content: EmailContent) -> bool:
         """
@@ -71,6 +116,26 @@ class Connection:
             logger.error(f"推送邮件失败 {self.connection_id}: {e}")
             return False
     
+    async def send_payload(self, payload: str, subject: str = "") -> bool:
+        """
+        推送预先序列化的消息(JSON文本)
+        
+        输入:
+            payload: JSON文本(见ParsedEmail.push_payload)
+            subject: 邮件主题(用于日志)
+            
+        输出:
+            True: 推送成功
+            False: 推送失败
+        """
+        try:
+            await self.websocket.send_text(payload)
+            logger.info(f"推送邮件到 {self.connection_id}: {subject}")
+            return True
+        except Exception as e:
+            logger.error(f"推送邮件失败 {self.connection_id}: {e}")
+            return False
+    
     def start_timeout(self, callback):
         """
         启动超时检测
@@ -106,12 +171,33 @@ class ConnectionManager:
         
         self._lock = asyncio.Lock()
     
+        # 匹配耗时统计: {api_key: MatchUsage}
+        self.usage: Dict[str, MatchUsage] = {}
+        self.match_budget_ns = 0  # 0表示不限制
+        self.match_budget_window = 60
+        self.match_suspend_factor = 2.0
+    
+    def configure_budget(self, budget_ms: int = 0, window: int = 60, suspend_factor: float = 2.0):
+        """
+        配置每个API Key的匹配耗时预算
+        
+        输入:
+            budget_ms: 每个窗口内允许的匹配耗时(毫秒),0表示不限制
+            window: 统计窗口(秒)
+            suspend_factor: 耗时超过预算的多少倍后暂停匹配
+        """
+        self.match_budget_ns = max(0, budget_ms) * 1_000_000
+        self.match_budget_window = max(1, window)
+        self.match_suspend_factor = max(1.0, suspend_factor)
+    
     async def add_connection(
         self,
         websocket: WebSocket,
         email: str,
         rules: List[MatchRule],
-        timeout: int = 300
+        timeout: int = 300,
+        include_content: bool = True,
+        api_key: str = ""
     ) -> str:
         """
         添加新连接
@@ -121,6 +207,8 @@ class ConnectionManager:
             email: 监控的邮箱地址
             rules: 匹配规则
             timeout: 超时时间(秒)
+            include_content: 推送时是否包含完整正文
+            api_key: 建立连接使用的API Key
             
         输出:
             connection_id: 连接ID
@@ -129,7 +217,7 @@ class ConnectionManager:
             email = email.lower()
             
             # 创建连接对象
-            conn = Connection(websocket, email, rules, timeout)
+            conn = Connection(websocket, email, rules, timeout, include_content, api_key)
             
             # 添加到连接表
             self.connections[conn.connection_id] = conn
@@ -171,6 +259,9 @@ class ConnectionManager:
             # 取消超时任务
             conn.cancel_timeout()
             
+            # 释放共享规则集
+            get_rule_registry().release(conn.plan)
+            
             # 从邮箱映射中移除
             if conn.email in self.email_to_connections:
                 self.email_to_connections[conn.email].discard(connection_id)
@@ -234,6 +325,154 @@ class ConnectionManager:
         
         return success_count
     
+    def has_subscribers(self, email_address: str) -> bool:
+        """
+        邮箱是否有监控连接
+        
+        输入:
+            email_address: 邮箱地址
+            
+        输出:
+            True: 有监控连接
+        """
+        return bool(self.email_to_connections.get(email_address.lower()))
+    
+    def can_match_sender(self, email_address: str, sender: str) -> bool:
+        """
+        监控该邮箱的订阅是否可能匹配此发件人
+        
+        只根据发件人字段求值,涉及主题/正文的规则视为可能匹配。
+        没有监控连接时返回True(交给后续流程处理)
+        
+        输入:
+            email_address: 收件人邮箱
+            sender: 发件人邮箱
+            
+        输出:
+            False: 所有订阅都保证不匹配, True: 可能匹配
+        """
+        connection_ids = self.email_to_connections.get(email_address.lower(), set()).copy()
+        if not connection_ids:
+            return True
+        
+        checked = set()
+        for conn_id in connection_ids:
+            conn = self.connections.get(conn_id)
+            if not conn or id(conn.plan) in checked:
+                continue
+            checked.add(id(conn.plan))
+            if conn.plan.could_match_sender(sender):
+                return True
+        return not checked
+    
+    def match_state(self, conn: Connection) -> str:
+        """
+        获取连接当前的匹配状态
+        
+        输入:
+            conn: 连接对象
+            
+        输出:
+            normal / deprioritized / suspended
+        """
+        if not self.match_budget_ns:
+            return STATE_NORMAL
+        
+        usage = self.usage.get(conn.api_key)
+        if usage is None:
+            return STATE_NORMAL
+        
+        usage.roll(self.match_budget_window)
+        if usage.window_ns > self.match_budget_ns * self.match_suspend_factor:
+            return STATE_SUSPENDED
+        if usage.window_ns > self.match_budget_ns:
+            return STATE_DEPRIORITIZED
+        return STATE_NORMAL
+    
+    def schedule_matching(self, conns: List[Connection]) -> Tuple[List[Connection], List[Connection]]:
+        """
+        按匹配预算划分连接
+        
+        预算内的连接立即匹配,超出预算的连接在其他连接推送之后再匹配,暂停的连接被跳过
+        
+        输入:
+            conns: 连接列表
+            
+        输出:
+            (立即匹配的连接, 延后匹配的连接)
+        """
+        normal = []
+        deferred = []
+        for conn in conns:
+            state = self.match_state(conn)
+            if state == STATE_NORMAL:
+                normal.append(conn)
+            elif state == STATE_DEPRIORITIZED:
+                deferred.append(conn)
+            else:
+                conn.match_skipped += 1
+                self.usage[conn.api_key].skipped += 1
+                logger.debug(f"匹配耗时超出预算,跳过匹配 [{conn.connection_id}]")
+        return normal, deferred
+    
+    def record_match_time(self, conn: Connection, elapsed_ns: int):
+        """
+        记录一次匹配耗时
+        
+        输入:
+            conn: 连接对象
+            elapsed_ns: 分摊到该连接的耗时(纳秒)
+        """
+        conn.match_time_ns += elapsed_ns
+        conn.match_count += 1
+        
+        usage = self.usage.get(conn.api_key)
+        if usage is None:
+            usage = self.usage[conn.api_key] = MatchUsage()
+        usage.roll(self.match_budget_window)
+        usage.window_ns += elapsed_ns
+        usage.total_ns += elapsed_ns
+        usage.evaluations += 1
+    
+    def get_match_usage(self) -> Dict:
+        """
+        获取匹配耗时统计
+        
+        输出:
+            预算配置、每个API Key(脱敏)和每个连接的耗时与状态
+        """
+        keys = {}
+        for api_key, usage in self.usage.items():
+            usage.roll(self.match_budget_window)
+            keys[_mask_key(api_key)] = {
+                "window_ms": round(usage.window_ns / 1e6, 3),
+                "total_ms": round(usage.total_ns / 1e6, 3),
+                "evaluations": usage.evaluations,
+                "skipped": usage.skipped
+            }
+        
+        connections = []
+        for conn in self.connections.values():
+            connections.append({
+                "connection_id": conn.connection_id,
+                "api_key": _mask_key(conn.api_key),
+                "state": self.match_state(conn),
+                "match_time_ms": round(conn.match_time_ns / 1e6, 3),
+                "match_count": conn.match_count,
+                "skipped": conn.match_skipped
+            })
+        
+        for item in connections:
+            keys.setdefault(item["api_key"], {})["state"] = item["state"]
+        
+        return {
+            "budget_ms": self.match_budget_ns // 1_000_000,
+            "window": self.match_budget_window,
+            "suspend_factor": self.match_suspend_factor,
+            "api_keys": keys,
+            "connections": connections
+        }
+    
     def get_connection(self, connection_id: str) -> Optional[Connection]:
         """
         获取连接对象
@@ -265,6 +504,14 @@ class ConnectionManager:
         return list(self.email_to_connections.keys())
 
 
+def _mask_key(api_key: str) -> str:
+    """API Key脱敏(保留前4位加短哈希,不同的Key脱敏后不会合并;8位及以下的Key只保留哈希)"""
+    digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+    if len(api_key) <= 8:
+        return "***" + digest
+    return api_key[:4] + "***" + digest
+
+
 # 全局连接管理器实例
 _manager: Optional[ConnectionManager] = None
 
@@ -0,0 +1,120 @@
+"""
+SMTP在途内存预算
+
+功能:
+    - 限制同时处理中的邮件(接收中的DATA + 解析内容)占用的总字节数
+    - MAIL阶段按声明的SIZE(未声明时按最大邮件大小)预留,超出预算时返回452让发件方稍后重试
+    - DATA阶段按实际大小调整,处理完成、RSET、QUIT或连接断开时释放
+    - 预留按SMTP会话记录(弱引用),会话对象被回收时也会移除(兜底)
+    - 未声明SIZE的事务按max_message_size×2预留,同时进行的事务数约为
+      预算 / (2 × max_message_size)(默认10MB时每256MB约12个),需要按流量设置,默认关闭
+
+调用链:
+    RubbishMailHandler.handle_MAIL -> InflightBudget.reserve
+    RubbishMailHandler.handle_DATA -> InflightBudget.adjust -> 处理 -> release
+    RubbishMailHandler.handle_RSET / handle_QUIT / connection_lost -> InflightBudget.release
+    main.py / -> InflightBudget.get_stats
+
+输入: SMTP会话 + 字节数
+输出: 是否允许开始新事务
+"""
+import logging
+import threading
+import weakref
+from typing import Dict
+
+
+logger = logging.getLogger(__name__)
+
+
+class InflightBudget:
+    """在途邮件的全局字节预算(SMTP线程修改,状态接口在主线程读取,用锁保护)"""
+    
+    def __init__(self, max_bytes: int = 0):
+        """
+        初始化预算
+        
+        输入:
+            max_bytes: 预算(字节),0表示不限制
+        """
+        self.max_bytes = max_bytes
+        # 每个会话的预留字节数,会话对象被回收时自动移除
+        self._reserved: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self.peak = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+    
+    def _used(self) -> int:
+        """当前预留的总字节数(调用方持有锁)"""
+        return sum(self._reserved.values())
+    
+    def reserve(self, session, nbytes: int) -> bool:
+        """
+        为新事务预留
+        
+        输入:
+            session: SMTP会话
+            nbytes: 预留字节数
+            
+        输出:
+            True: 预留成功, False: 超出预算(应返回452)
+        """
+        with self._lock:
+            self._reserved.pop(session, None)
+            used = self._used()
+            if self.max_bytes and used + nbytes > self.max_bytes:
+                self.deferred += 1
+                allowed = False
+            else:
+                self._reserved[session] = nbytes
+                self.peak = max(self.peak, used + nbytes)
+                allowed = True
+        
+        if not allowed:
+            logger.warning(
+                f"在途邮件超出内存预算,推迟事务: "
+                f"已用{used / 1024 / 1024:.1f}MB + {nbytes / 1024 / 1024:.1f}MB > "
+                f"{self.max_bytes / 1024 / 1024:.1f}MB"
+            )
+        return allowed
+    
+    def adjust(self, session, nbytes: int):
+        """
+        按实际大小调整预留(数据已收到,不再拒绝)
+        
+        输入:
+            session: SMTP会话
+            nbytes: 实际占用字节数
+        """
+        with self._lock:
+            self._reserved[session] = nbytes
+            self.peak = max(self.peak, self._used())
+    
+    def release(self, session):
+        """
+        释放会话的预留
+        
+        输入:
+            session: SMTP会话
+        """
+        with self._lock:
+            self._reserved.pop(session, None)
+    
+    def get_stats(self) -> Dict:
+        """
+        获取预算使用情况
+        
+        输出:
+            预算、已用、使用率、峰值、在途事务数、被推迟的事务数
+        """
+        with self._lock:
+            used = self._used()
+            transactions = len(self._reserved)
+        return {
+            "max_bytes": self.max_bytes,
+            "used_bytes": used,
+            "utilization": round(used / self.max_bytes, 4) if self.max_bytes else 0,
+            "peak_bytes": self.peak,
+            "transactions": transactions,
+            "deferred": self.deferred
+        }
@@ -5,26 +5,215 @@
     - 从原始邮件数据解析邮件内容
     - 提取发件人、主题、正文
     - 处理MIME编码和多种字符集
+    - 附件(非正文部分)不解码,只记录文件名/类型/大小
+    - 正文部分最多解码max_text_bytes字节
+    - 主题/正文首次访问时才解码,推送JSON按(规则集, 描述, 正文选项)缓存
+    - 字节流直接扫描(mime_view),正文保留为memoryview切片,解码前不复制
 
 输入: 原始邮件字节流或Message对象
-输出: 解析后的邮件数据字典
+输出: ParsedEmail对象(兼容字典访问)
 """
+import binascii
 import email
-from email.header import decode_header
+import json
 from email.message import Message
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List, Tuple
 from datetime import datetime
 import logging
 
+from core.mime_view import RawPart, parse_headers, scan
+from utils.charset import decode_bytes, decode_header_value
+
 
 logger = logging.getLogger(__name__)
 
 
+# 解析限制(由main.py按配置设置)
+_limits = {"max_text_bytes": 0}
+
+
+class ParsedEmail:
+    """
+    解析后的邮件(同一封邮件的所有收件人/连接共享)
+    
+    - 主题、正文、HTML正文在首次访问时才解码(只按发件人/主题匹配且未命中时不解码正文)
+    - 正文取第一个解码后非空的text/plain部分,HTML正文取第一个非空的text/html部分
+    - body_text: 匹配用的HTML转纯文本结果(由MatchContext按需填充)
+    - 推送给客户端的JSON文本按key缓存,相同内容只序列化一次
+    - 支持get()/[]/to_dict(),与原来的字典格式兼容
+    """
+    
+    # 对外字段(to_dict的输出)
+    FIELDS = (
+        "sender", "sender_name", "subject", "body", "html_body",
+        "body_is_html", "attachments", "received_time"
+    )
+    _KEYS = frozenset(FIELDS + ("body_text",))
+    
+    __slots__ = (
+        "sender", "sender_name", "received_time", "attachments", "body_text",
+        "_subject_raw", "_subject", "_text_parts", "_html_parts", "_html_is_body",
+        "_body", "_html_body", "_payloads"
+    )
+    
+    def __init__(
+        self,
+        sender: str = "",
+        sender_name: Optional[str] = None,
+        subject_raw: str = "",
+        text_parts: Optional[List[Message]] = None,
+        html_parts: Optional[List[Message]] = None,
+        html_is_body: bool = False,
+        attachments: Optional[List[Dict[str, Any]]] = None,
+        received_time: str = ""
+    ):
+        """
+        输入:
+            sender: 发件人邮箱
+            sender_name: 发件人姓名
+            subject_raw: 未解码的Subject头部
+            text_parts: 纯文本正文候选部分(未解码,按出现顺序)
+            html_parts: HTML正文候选部分(未解码,按出现顺序)
+            html_is_body: 单部分HTML邮件,body使用HTML原文
+            attachments: 附件元数据
+            received_time: 接收时间(ISO格式)
+        """
+        self.sender = sender
+        self.sender_name = sender_name
+        self.received_time = received_time
+        self.attachments = attachments or []
+        self.body_text: Optional[str] = None
+        self._subject_raw = subject_raw
+        self._subject: Optional[str] = None
+        self._text_parts = text_parts or []
+        self._html_parts = html_parts or []
+        self._html_is_body = html_is_body
+        self._body: Optional[str] = None
+        self._html_body: Optional[str] = None
+        self._payloads: Dict[Any, str] = {}
+    
+    @property
+    def subject(self) -> str:
+        """邮件主题(首次访问时解码)"""
+        if self._subject is None:
+            self._subject = MailParser._decode_header_value(self._subject_raw)
+        return self._subject
+    
+    @property
+    def html_body(self) -> Optional[str]:
+        """HTML正文(首次访问时解码),没有HTML部分时为None"""
+        if self._html_parts:
+            self._html_body = MailParser._first_body(self._html_parts)
+            self._html_parts = []
+        return self._html_body
+    
+    @property
+    def body(self) -> str:
+        """纯文本正文(首次访问时解码),单部分HTML邮件为HTML原文"""
+        if self._body is None:
+            if self._html_is_body:
+                self._body = self.html_body or ""
+            else:
+                self._body = MailParser._first_body(self._text_parts) or ""
+                self._text_parts = []
+        return self._body
+    
+    @property
+    def body_is_html(self) -> bool:
+        """只有HTML正文(匹配时body按需由HTML转为纯文本),多部分邮件在纯文本正文为空时解码HTML判断"""
+        if self._html_is_body:
+            return True
+        return not self.body and bool(self.html_body)
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        """字典式读取字段"""
+        if key in self._KEYS:
+            return getattr(self, key)
+        return default
+    
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __setitem__(self, key: str, value: Any):
+        # 只允许写入匹配缓存
+        if key != "body_text":
+            raise KeyError(key)
+        self.body_text = value
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._KEYS
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        转换为字典(解码所有字段)
+        
+        输出:
+            与原parse_message返回格式相同的字典
+        """
+        return {name: getattr(self, name) for name in self.FIELDS}
+    
+    def push_payload(
+        self,
+        key: Any,
+        matched_rule: str,
+        include_content: bool,
+        extracted: Optional[Dict[str, List[str]]]
+    ) -> str:
+        """
+        获取推送给客户端的email_received消息(JSON文本,按key缓存)
+        
+        格式与EmailReceivedMessage(data=EmailContent(...)).model_dump()一致
+        
+        输入:
+            key: 缓存键,相同key的推送内容必须相同(如(规则集指纹, 描述, 正文选项))
+            matched_rule: 匹配的规则描述
+            include_content: 是否包含完整正文
+            extracted: 服务端提取结果
+            
+        输出:
+            JSON文本
+        """
+        payload = self._payloads.get(key)
+        if payload is None:
+            payload = json.dumps(
+                {
+                    "type": "email_received",
+                    "data": {
+                        "sender": self.sender,
+                        "sender_name": self.sender_name,
+                        "subject": self.subject,
+                        "body": self.body if include_content else "",
+                        "html_body": self.html_body if include_content else None,
+                        "received_time": self.received_time,
+                        "matched_rule": matched_rule,
+                        "extracted": extracted,
+                        "attachments": self.attachments or None
+                    }
+                },
+                ensure_ascii=False,
+                separators=(",", ":")
+            )
+            self._payloads[key] = payload
+        return payload
+
+
 class MailParser:
     """邮件解析器"""
     
     @staticmethod
-    def parse_from_bytes(email_bytes: bytes) -> Optional[Dict[str, Any]]:
+    def configure(max_text_bytes: int = 0):
+        """
+        配置解析限制
+        
+        输入:
+            max_text_bytes: 每个正文部分最多解码的字节数,0表示不限制
+        """
+        _limits["max_text_bytes"] = max(0, max_text_bytes)
+    
+    @staticmethod
+    def parse_from_bytes(email_bytes: bytes) -> Optional[ParsedEmail]:
         """
         从字节流解析邮件
         
@@ -32,9 +221,15 @@ class MailParser:
             email_bytes: 原始邮件字节流
             
         输出:
-            包含sender, subject, body等字段的字典
+            ParsedEmail对象(包含sender, subject, body等字段)
             解析失败返回None
         """
+        try:
+            # 零拷贝扫描: 只解析各部分头部,正文为原始数据的切片
+            return MailParser.parse_message(scan(email_bytes))
+        except Exception as e:
+            logger.warning(f"扫描邮件结构失败,使用email包解析: {e}")
+        
         try:
             msg = email.message_from_bytes(email_bytes)
             return MailParser.parse_message(msg)
@@ -43,7 +238,7 @@ class MailParser:
             return None
     
     @staticmethod
-    def parse_from_string(email_str: str) -> Optional[Dict[str, Any]]:
+    def parse_from_string(email_str: str) -> Optional[ParsedEmail]:
         """
         从字符串解析邮件
         
@@ -51,7 +246,7 @@ class MailParser:
             email_str: 原始邮件字符串
             
         输出:
-            包含sender, subject, body等字段的字典
+            ParsedEmail对象(包含sender, subject, body等字段)
             解析失败返回None
         """
         try:
@@ -62,56 +257,60 @@ class MailParser:
             return None
     
     @staticmethod
-    def parse_message(msg: Message) -> Optional[Dict[str, Any]]:
+    def parse_message(msg: Message) -> Optional[ParsedEmail]:
         """
         解析email.message.Message对象
         
         输入:
-            msg: email.message.Message对象
+            msg: email.message.Message对象(或mime_view扫描得到的RawPart)
             
         输出:
-            包含以下字段的字典:
+            ParsedEmail对象,包含以下字段:
             - sender: str - 发件人邮箱
             - sender_name: str | None - 发件人姓名
-            - subject: str - 邮件主题
-            - body: str - 纯文本正文
-            - html_body: str | None - HTML正文
+            - subject: str - 邮件主题(首次访问时解码)
+            - body: str - 纯文本正文(首次访问时解码)
+            - html_body: str | None - HTML正文(首次访问时解码)
+            - body_is_html: bool - 只有HTML正文(匹配时body按需由HTML转为纯文本)
+            - attachments: list - 附件元数据 [{filename, content_type, size}, ...]
             - received_time: str - 接收时间(ISO格式)
         """
         try:
             # 解析发件人
-            sender = MailParser._decode_header_value(msg.get("From", ""))
-            sender_name = None
-            
-            # 提取邮箱地址和姓名
-            if "<" in sender and ">" in sender:
-                sender_name = sender.split("<")[0].strip().strip('"')
-                sender = sender.split("<")[1].split(">")[0]
-            
-            # 解析主题
-            subject = MailParser._decode_header_value(msg.get("Subject", ""))
+            sender, sender_name = MailParser._split_sender(
+                MailParser._decode_header_value(msg.get("From", ""))
+            )
             
-            # 解析正文
-            body = ""
-            html_body = None
+            # 定位正文候选部分(不解码,首次访问时取第一个非空的部分)
+            text_parts = []
+            html_parts = []
+            html_is_body = False
+            attachments = []
             
             if msg.is_multipart():
-                # 多部分邮件
-                for part in msg.walk():
+                # 多部分邮件(附件不解码,只记录元数据)
+                for part in MailParser._iter_parts(msg):
+                    if MailParser._is_attachment(part):
+                        attachments.append(MailParser._attachment_info(part))
+                        continue
+                    
                     content_type = part.get_content_type()
                     
-                    if content_type == "text/plain" and not body:
-                        body = MailParser._get_email_body(part)
-                    elif content_type == "text/html" and not html_body:
-                        html_body = MailParser._get_email_body(part)
+                    if content_type == "text/plain":
+                        text_parts.append(part)
+                    elif content_type == "text/html":
+                        html_parts.append(part)
+            elif MailParser._is_attachment(msg):
+                # 整封邮件只有一个附件
+                attachments.append(MailParser._attachment_info(msg))
             else:
                 # 单部分邮件
                 content_type = msg.get_content_type()
                 if content_type == "text/plain":
-                    body = MailParser._get_email_body(msg)
+                    text_parts.append(msg)
                 elif content_type == "text/html":
-                    html_body = MailParser._get_email_body(msg)
-                    body = html_body  # 如果只有HTML,也给body赋值
+                    html_parts.append(msg)
+                    html_is_body = True  # 如果只有HTML,也给body赋值
             
             # 解析时间
             date_str = msg.get("Date", "")
@@ -119,19 +318,61 @@ class MailParser:
             
             # TODO: 可以尝试解析Date字段为datetime
             
-            return {
-                "sender": sender,
-                "sender_name": sender_name,
-                "subject": subject,
-                "body": body,
-                "html_body": html_body,
-                "received_time": received_time
-            }
+            return ParsedEmail(
+                sender=sender,
+                sender_name=sender_name,
+                subject_raw=msg.get("Subject", ""),
+                text_parts=text_parts,
+                html_parts=html_parts,
+                html_is_body=html_is_body,
+                attachments=attachments,
+                received_time=received_time
+            )
             
         except Exception as e:
             logger.error(f"解析Message对象失败: {e}")
             return None
     
+    @staticmethod
+    def parse_sender_from_bytes(email_bytes: bytes) -> str:
+        """
+        只解析头部,获取发件人邮箱(不解析正文)
+        
+        输入:
+            email_bytes: 原始邮件字节流
+            
+        输出:
+            发件人邮箱,解析失败返回空字符串
+        """
+        try:
+            # 只解析头部(到第一个空行),不复制正文
+            headers = parse_headers(email_bytes)
+            sender, _ = MailParser._split_sender(
+                MailParser._decode_header_value(headers.get("From", ""))
+            )
+            return sender
+        except Exception as e:
+            logger.warning(f"解析发件人头部失败: {e}")
+            return ""
+    
+    @staticmethod
+    def _split_sender(value: str) -> Tuple[str, Optional[str]]:
+        """
+        拆分发件人邮箱和姓名
+        
+        输入:
+            value: 解码后的From头部,如 "Name <user@example.com>"
+            
+        输出:
+            (邮箱地址, 姓名或None)
+        """
+        sender_name = None
+        sender = value
+        if "<" in value and ">" in value:
+            sender_name = value.split("<")[0].strip().strip('"')
+            sender = value.split("<")[1].split(">")[0]
+        return sender, sender_name
+    
     @staticmethod
     def _decode_header_value(value: str) -> str:
         """
@@ -141,33 +382,125 @@ class MailParser:
             value: 邮件头部原始值
             
         输出:
-            解码后的字符串
+            解码后的字符串(无编码字时直接返回,有编码字的值LRU缓存)
         """
-        if not value:
-            return ""
+        return decode_header_value(value)
+    
+    @staticmethod
+    def _iter_parts(msg: Message) -> Iterator[Message]:
+        """
+        遍历邮件的叶子部分
         
-        decoded_parts = decode_header(value)
-        result = []
+        只进入multipart容器,附带的邮件(message/rfc822)等作为整体返回,不展开
         
-        for part, encoding in decoded_parts:
-            if isinstance(part, bytes):
-                try:
-                    # 尝试使用指定编码
-                    result.append(part.decode(encoding or "utf-8"))
-                except:
-                    # 失败则尝试UTF-8,忽略错误
-                    try:
-                        result.append(part.decode("utf-8", errors="ignore"))
-                    except:
-                        # 再失败则尝试GBK
-                        try:
-                            result.append(part.decode("gbk", errors="ignore"))
-                        except:
-                            result.append(str(part))
+        输入:
+            msg: email.message.Message对象
+            
+        输出:
+            叶子部分迭代器
+        """
+        if msg.get_content_maintype() == "multipart":
+            for part in msg.get_payload() or []:
+                if isinstance(part, (Message, RawPart)):
+                    yield from MailParser._iter_parts(part)
+        else:
+            yield msg
+    
+    @staticmethod
+    def _is_attachment(part: Message) -> bool:
+        """是否为附件(非text类型,或声明为attachment)"""
+        if part.get_content_maintype() != "text":
+            return True
+        return part.get_content_disposition() == "attachment"
+    
+    @staticmethod
+    def _attachment_info(part: Message) -> Dict[str, Any]:
+        """
+        获取附件元数据(不解码内容)
+        
+        输入:
+            part: 附件部分
+            
+        输出:
+            {filename, content_type, size},size为按传输编码估算的解码后字节数
+        """
+        filename = part.get_filename()
+        payload = None if isinstance(part, RawPart) else part.get_payload()
+        size = part.estimated_size() if isinstance(part, RawPart) else None
+        if isinstance(payload, str):
+            if part.get("Content-Transfer-Encoding", "").strip().lower() == "base64":
+                # 去掉换行后每4个字符对应3个字节
+                chars = len(payload) - payload.count("\n") - payload.count("\r") - payload.count(" ")
+                size = chars * 3 // 4 - payload.count("=")
             else:
-                result.append(str(part))
+                size = len(payload)
         
-        return " ".join(result)
+        return {
+            "filename": MailParser._decode_header_value(filename) if filename else None,
+            "content_type": part.get_content_type(),
+            "size": size
+        }
+    
+    @staticmethod
+    def _decode_payload(msg: Message, limit: int) -> bytes:
+        """
+        解码正文部分的传输编码,最多解码limit字节
+        
+        超出限制时先截取编码后的内容再解码,不为整个部分分配内存
+        
+        输入:
+            msg: 正文部分
+            limit: 最多解码的字节数,0表示不限制
+            
+        输出:
+            解码后的字节
+        """
+        if isinstance(msg, RawPart):
+            # 直接在原始数据的切片上解码
+            return msg.decode_payload(limit)
+        
+        raw = msg.get_payload()
+        if not isinstance(raw, str) or not limit or len(raw) <= limit:
+            return msg.get_payload(decode=True) or b""
+        
+        cte = msg.get("Content-Transfer-Encoding", "").strip().lower()
+        try:
+            if cte == "base64":
+                # 每76个字符一行,多截取换行符的长度
+                chunk = "".join(raw[:(limit // 3 + 1) * 4 * 80 // 76 + 4].split())
+                data = binascii.a2b_base64(chunk[:len(chunk) // 4 * 4].encode("ascii", "ignore"))
+            elif cte == "quoted-printable":
+                # 每个字节最多编码为3个字符(=XX)
+                data = binascii.a2b_qp(raw[:limit * 3].encode("ascii", "surrogateescape"))
+            else:
+                chunk = raw[:limit]
+                try:
+                    data = chunk.encode("ascii", "surrogateescape")
+                except UnicodeError:
+                    data = chunk.encode("raw-unicode-escape")
+        except (binascii.Error, UnicodeError) as e:
+            logger.warning(f"截断解码正文失败,解码整个部分: {e}")
+            data = msg.get_payload(decode=True) or b""
+        
+        return data[:limit]
+    
+    @staticmethod
+    def _first_body(parts: List[Message]) -> Optional[str]:
+        """
+        按顺序解码候选部分,返回第一个非空的正文
+        
+        输入:
+            parts: 同一类型的正文候选部分
+            
+        输出:
+            第一个非空的正文;都为空时为空字符串,没有候选部分时为None
+        """
+        body = None
+        for part in parts:
+            body = MailParser._get_email_body(part)
+            if body:
+                break
+        return body
     
     @staticmethod
     def _get_email_body(msg: Message) -> str:
@@ -178,23 +511,12 @@ class MailParser:
             msg: email.message.Message对象
             
         输出:
-            正文字符串
+            正文字符串(超出max_text_bytes的部分被截断)
         """
         try:
-            payload = msg.get_payload(decode=True)
+            payload = MailParser._decode_payload(msg, _limits["max_text_bytes"])
             if payload:
-                charset = msg.get_content_charset() or "utf-8"
-                try:
-                    return payload.decode(charset, errors="ignore")
-                except:
-                    # 如果指定字符集失败,尝试常见字符集
-                    for enc in ["utf-8", "gbk", "gb2312", "latin-1"]:
-                        try:
-                            return payload.decode(enc, errors="ignore")
-                        except:
-                            continue
-                    # 都失败则返回空
-                    return ""
+                return decode_bytes(payload, msg.get_content_charset())
         except Exception as e:
             logger.warning(f"获取邮件正文失败: {e}")
         
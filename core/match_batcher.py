@@ -0,0 +1,259 @@
+"""
+邮件微批匹配
+
+功能:
+    - 突发流量(群发/注册潮)时,把短时间窗口内到达的邮件合并为一批
+    - 每个收件人每批只查找一次监控连接
+    - 每个规则集对整批邮件集中匹配一遍,再统一并发推送
+    - 窗口到期或批次满时立即处理,额外延迟不超过窗口长度
+    - 单封邮件处理出错只让这封邮件的handle_DATA收到异常,批次中其他邮件照常匹配、推送和自动拉黑
+
+调用链:
+    SMTPHandler.handle_DATA -> MatchBatcher.submit -> 等待批次处理完成
+    MatchBatcher._process_batch -> 查找连接 -> 预先匹配 -> 按规则集匹配整批 -> 并发推送
+
+输入: 解析后的邮件数据 + 匹配上下文 + 收件人
+输出: 是否有合法收件人(供handle_DATA决定是否自动拉黑)
+"""
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+
+from core.connection_manager import STATE_NORMAL
+from core.mail_parser import MailParser, ParsedEmail
+from utils.matcher import MatchContext, MatchPlan
+from utils.match_pool import get_match_engine
+
+if TYPE_CHECKING:
+    from core.smtp_server import RubbishMailHandler
+
+
+logger = logging.getLogger(__name__)
+
+
+class _BatchItem:
+    """批次中的一封邮件"""
+    
+    __slots__ = ("recipients", "email_data", "match_ctx", "sender", "future")
+    
+    def __init__(
+        self,
+        recipients: List[str],
+        email_data: ParsedEmail,
+        match_ctx: MatchContext,
+        sender: str,
+        future: asyncio.Future
+    ):
+        self.recipients = recipients
+        self.email_data = email_data
+        self.match_ctx = match_ctx
+        self.sender = sender
+        self.future = future
+
+
+class MatchBatcher:
+    """微批匹配器(运行在SMTP服务器的事件循环中)"""
+    
+    def __init__(self, handler: "RubbishMailHandler", window_ms: float = 2.0, max_batch: int = 64):
+        """
+        初始化批处理器
+        
+        输入:
+            handler: SMTP邮件处理器(提供收件人检查/匹配/推送内容构造)
+            window_ms: 批次窗口(毫秒),第一封邮件到达后最多等待这么久
+            max_batch: 批次最大邮件数,达到后立即处理
+        """
+        self.handler = handler
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self._pending: List[_BatchItem] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 处理中的批次任务
+        self._tasks = set()
+        
+        self.batches = 0
+        self.messages = 0
+    
+    async def submit(
+        self,
+        recipients: List[str],
+        email_data: ParsedEmail,
+        match_ctx: MatchContext,
+        sender: str
+    ) -> bool:
+        """
+        提交一封邮件,等待所在批次处理完成
+        
+        输入:
+            recipients: 收件人列表
+            email_data: 解析后的邮件
+            match_ctx: 邮件匹配上下文
+            sender: 发件人邮箱
+            
+        输出:
+            True: 至少一个收件人有监控连接
+        """
+        loop = asyncio.get_running_loop()
+        item = _BatchItem(recipients, email_data, match_ctx, sender, loop.create_future())
+        self._pending.append(item)
+        
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        
+        return await item.future
+    
+    def _flush(self):
+        """取出当前批次并开始处理"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        
+        batch, self._pending = self._pending, []
+        if batch:
+            # 保持任务引用直到完成,避免处理中的批次被回收
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, batch: List[_BatchItem]):
+        """处理批次,把每封邮件的结果或异常交给等待的handle_DATA"""
+        try:
+            results = await self._process_batch(batch)
+        except Exception as e:
+            logger.error(f"批量匹配出错: {e}", exc_info=True)
+            results = [e] * len(batch)
+        
+        for item, result in zip(batch, results):
+            if item.future.done():
+                continue
+            if isinstance(result, Exception):
+                item.future.set_exception(result)
+            else:
+                item.future.set_result(result)
+    
+    @staticmethod
+    def _fail(results: List[Union[bool, Exception]], index: int, error: Exception):
+        """记录单封邮件的错误(只影响这封邮件,批次中其他邮件继续处理)"""
+        if not isinstance(results[index], Exception):
+            logger.error(f"批量匹配中单封邮件出错: {error}", exc_info=error)
+            results[index] = error
+    
+    async def _process_batch(self, batch: List[_BatchItem]) -> List[Union[bool, Exception]]:
+        """
+        处理一批邮件
+        
+        输入:
+            batch: 批次中的邮件
+            
+        输出:
+            每封邮件是否有合法收件人,处理该邮件出错时为异常对象
+        """
+        handler = self.handler
+        manager = handler.connection_manager
+        self.batches += 1
+        self.messages += len(batch)
+        results: List[Union[bool, Exception]] = [False] * len(batch)
+        
+        # 1. 每个收件人每批只查找一次连接
+        lookups: Dict[str, Optional[list]] = {}
+        item_conns = []
+        for index, item in enumerate(batch):
+            per_recipient = []
+            try:
+                for recipient in item.recipients:
+                    key = MailParser.extract_recipient(recipient).lower()
+                    if key not in lookups:
+                        lookups[key] = handler._lookup_recipient(recipient)
+                    if lookups[key] is not None:
+                        per_recipient.append(lookups[key])
+            except Exception as e:
+                self._fail(results, index, e)
+                per_recipient = []
+            item_conns.append(per_recipient)
+        
+        # 2. 合法收件人收到的发件人域名记入白名单(每个域名每批一次)
+        learned = set()
+        for index, (item, per_recipient) in enumerate(zip(batch, item_conns)):
+            if per_recipient and '@' in item.sender:
+                domain = item.sender.split('@')[1].lower()
+                if domain not in learned:
+                    learned.add(domain)
+                    try:
+                        await handler.blacklist.learn_whitelist_domain(domain)
+                    except Exception as e:
+                        self._fail(results, index, e)
+        
+        # 3. 收集每个规则集需要匹配的邮件,以及每封邮件需要匹配的规则集
+        plans: Dict[str, MatchPlan] = {}
+        plan_items: Dict[str, List[int]] = {}
+        item_plans: List[Dict[str, MatchPlan]] = [{} for _ in batch]
+        for index, per_recipient in enumerate(item_conns):
+            for conns in per_recipient:
+                for conn in conns:
+                    fingerprint = conn.plan.fingerprint
+                    if fingerprint is None or manager.match_state(conn) != STATE_NORMAL:
+                        continue
+                    indexes = plan_items.setdefault(fingerprint, [])
+                    if not indexes or indexes[-1] != index:
+                        indexes.append(index)
+                    plans[fingerprint] = conn.plan
+                    item_plans[index][fingerprint] = conn.plan
+        
+        # 4. 启用多进程匹配时并行预先匹配整批,否则每个规则集对整批匹配一遍
+        engine = get_match_engine()
+        if engine is not None:
+            await asyncio.gather(*(
+                engine.evaluate(item.match_ctx, item_plans[index])
+                for index, item in enumerate(batch)
+                if item_plans[index]
+            ), return_exceptions=True)
+        for fingerprint, plan in plans.items():
+            for index in plan_items[fingerprint]:
+                if isinstance(results[index], Exception):
+                    continue
+                try:
+                    plan.evaluate(batch[index].match_ctx)
+                except Exception as e:
+                    self._fail(results, index, e)
+        
+        # 5. 构造推送内容(复用上面的匹配结果),统一并发推送;超出预算的连接在推送之后再匹配
+        sends = []
+        deferred_work = []
+        for index, (item, per_recipient) in enumerate(zip(batch, item_conns)):
+            if isinstance(results[index], Exception):
+                continue
+            try:
+                for conns in per_recipient:
+                    normal, deferred, shares = handler._schedule_matching(conns)
+                    for conn, payload in handler._match_connections(normal, item.email_data, item.match_ctx, shares):
+                        sends.append(conn.send_payload(payload, item.email_data.subject))
+                    if deferred:
+                        deferred_work.append((deferred, item.email_data, item.match_ctx, shares))
+            except Exception as e:
+                self._fail(results, index, e)
+                continue
+            results[index] = bool(per_recipient)
+        if sends:
+            await asyncio.gather(*sends, return_exceptions=True)
+        for deferred, email_data, match_ctx, shares in deferred_work:
+            handler._defer_matching(deferred, email_data, match_ctx, shares)
+        
+        logger.debug(f"批量匹配: {len(batch)}封邮件, {len(plans)}个规则集, {len(sends)}次推送")
+        return results
+    
+    def get_stats(self) -> Dict:
+        """
+        获取批处理统计
+        
+        输出:
+            窗口、批次上限、批次数、邮件数、平均批次大小
+        """
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "messages": self.messages,
+            "avg_batch_size": round(self.messages / self.batches, 2) if self.batches else 0
+        }
@@ -0,0 +1,304 @@
+"""
+零拷贝MIME扫描
+
+功能:
+    - 在收到的DATA字节上用bytes.find定位头部结束位置和multipart分隔线,不复制正文
+      (分隔线须位于行首且之后只有"--"、空白和换行,只以分隔线开头的正文行不算)
+    - 每个部分只解析(很小的)头部,正文保留为原始数据的memoryview切片
+    - 传输编码(base64/quoted-printable)直接在memoryview切片上用binascii解码,
+      超出上限时只解码切片的开头;缺少填充的base64与email包一样补齐"="后解码
+    - 附件(非multipart)不展开,大小按编码后的长度估算
+
+调用链:
+    MailParser.parse_from_bytes -> scan -> RawPart树 -> ParsedEmail(正文按需解码)
+    MailParser.parse_sender_from_bytes -> parse_headers
+
+输入: 原始邮件字节
+输出: RawPart(头部为email.message.Message,正文为memoryview)
+"""
+import binascii
+from email.message import Message
+from email.parser import HeaderParser
+from typing import List, Optional, Tuple
+
+
+# multipart最大嵌套深度,超出后作为单个部分处理
+MAX_DEPTH = 16
+
+# base64字母表(不含填充"=")
+_BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+_header_parser = HeaderParser()
+
+
+def _body_offset(data: bytes, start: int, end: int) -> Tuple[int, int]:
+    """
+    定位头部结束位置
+    
+    输入:
+        data: 原始邮件字节
+        start, end: 部分的范围
+        
+    输出:
+        (头部结束位置, 正文开始位置)
+    """
+    # 没有头部: 以空行开头
+    if data.startswith(b"\r\n", start):
+        return start, start + 2
+    if data.startswith(b"\n", start):
+        return start, start + 1
+    
+    crlf = data.find(b"\r\n\r\n", start, end)
+    lf = data.find(b"\n\n", start, end)
+    if crlf >= 0 and (lf < 0 or crlf <= lf):
+        return crlf + 2, crlf + 4
+    if lf >= 0:
+        return lf + 1, lf + 2
+    return end, end
+
+
+def _parse_header_block(view: memoryview, start: int, end: int) -> Message:
+    """解析头部(与email.message_from_bytes一致,按ASCII+surrogateescape解码)"""
+    return _header_parser.parsestr(str(view[start:end], "ascii", "surrogateescape"))
+
+
+def parse_headers(data: bytes) -> Message:
+    """
+    只解析邮件头部
+    
+    输入:
+        data: 原始邮件字节
+        
+    输出:
+        只含头部的Message对象
+    """
+    header_end, _ = _body_offset(data, 0, len(data))
+    return _parse_header_block(memoryview(data), 0, header_end)
+
+
+class RawPart:
+    """
+    MIME部分(头部已解析,正文为原始数据的切片)
+    
+    提供与email.message.Message相同的头部访问方法
+    """
+    
+    __slots__ = ("headers", "data", "view", "start", "end", "children")
+    
+    def __init__(self, headers: Message, data: bytes, view: memoryview, start: int, end: int):
+        """
+        输入:
+            headers: 部分头部
+            data: 原始邮件字节
+            view: 原始邮件的memoryview
+            start, end: 正文在原始数据中的范围
+        """
+        self.headers = headers
+        self.data = data
+        self.view = view
+        self.start = start
+        self.end = end
+        self.children: List["RawPart"] = []
+    
+    # ---- 与Message兼容的头部访问 ----
+    
+    def get(self, name: str, failobj=None):
+        return self.headers.get(name, failobj)
+    
+    def get_content_type(self) -> str:
+        return self.headers.get_content_type()
+    
+    def get_content_maintype(self) -> str:
+        return self.headers.get_content_maintype()
+    
+    def get_content_charset(self, failobj=None):
+        return self.headers.get_content_charset(failobj)
+    
+    def get_content_disposition(self) -> Optional[str]:
+        return self.headers.get_content_disposition()
+    
+    def get_filename(self, failobj=None):
+        return self.headers.get_filename(failobj)
+    
+    def is_multipart(self) -> bool:
+        return bool(self.children)
+    
+    def get_payload(self):
+        """multipart返回子部分列表"""
+        return self.children
+    
+    # ---- 正文 ----
+    
+    @property
+    def body(self) -> memoryview:
+        """正文切片(未解码传输编码)"""
+        return self.view[self.start:self.end]
+    
+    def _transfer_encoding(self) -> str:
+        return str(self.headers.get("Content-Transfer-Encoding", "")).strip().lower()
+    
+    def estimated_size(self) -> int:
+        """按传输编码估算解码后的大小(不解码)"""
+        length = self.end - self.start
+        if self._transfer_encoding() != "base64":
+            return length
+        chars = (
+            length
+            - self.data.count(b"\n", self.start, self.end)
+            - self.data.count(b"\r", self.start, self.end)
+            - self.data.count(b" ", self.start, self.end)
+        )
+        return max(0, chars * 3 // 4 - self.data.count(b"=", max(self.start, self.end - 4), self.end))
+    
+    def decode_payload(self, limit: int = 0) -> bytes:
+        """
+        解码传输编码
+        
+        输入:
+            limit: 最多解码的字节数,0表示不限制
+            
+        输出:
+            解码后的字节
+        """
+        cte = self._transfer_encoding()
+        end = self.end
+        if cte == "base64":
+            if limit:
+                # 每76个字符一行,多截取换行符的长度
+                end = min(end, self.start + (limit // 3 + 1) * 4 * 80 // 76 + 4)
+            data = _a2b_base64(self.view, self.start, end, truncated=end < self.end)
+        elif cte == "quoted-printable":
+            if limit:
+                # 每个字节最多编码为3个字符(=XX)
+                end = min(end, self.start + limit * 3)
+            data = binascii.a2b_qp(self.view[self.start:end])
+        else:
+            if limit:
+                end = min(end, self.start + limit)
+            data = bytes(self.view[self.start:end])
+        return data[:limit] if limit else data
+
+
+def _a2b_base64(view: memoryview, start: int, end: int, truncated: bool = False) -> bytes:
+    """
+    在memoryview切片上解码base64(结果与email包一致)
+    
+    输入:
+        view: 原始邮件的memoryview
+        start, end: 编码内容的范围
+        truncated: 切片是否因解码上限被截断
+        
+    输出:
+        解码后的字节
+        
+    说明:
+        被截断的切片末尾可能是不完整的4字符组,去掉这几个字符(截断处之后的内容本来就不需要);
+        完整的正文缺少末尾填充时补齐"=";长度比4的倍数多1、无法解码时返回原始内容
+    """
+    try:
+        return binascii.a2b_base64(view[start:end])
+    except binascii.Error:
+        pass
+    
+    data = bytes(view[start:end])
+    if truncated:
+        extra = (len(data) - len(data.translate(None, _BASE64_ALPHABET))) % 4
+        pos = len(data)
+        while extra and pos > 0:
+            pos -= 1
+            if data[pos] in _BASE64_ALPHABET:
+                extra -= 1
+        data = data[:pos]
+    try:
+        # 多余的填充会被忽略
+        return binascii.a2b_base64(data + b"==")
+    except binascii.Error:
+        return data
+
+
+def _is_delimiter_line(data: bytes, pos: int, end: int) -> bool:
+    """
+    分隔线之后是否为行尾(RFC 2046: 分隔线后只能是"--"、空白和换行)
+    
+    输入:
+        data: 原始邮件字节
+        pos: 分隔线之后的位置
+        end: 部分的结束位置
+    """
+    if data.startswith(b"--", pos, end):
+        pos += 2
+    while pos < end and data[pos] in b" \t":
+        pos += 1
+    return pos >= end or data[pos] in b"\r\n"
+
+
+def _find_delimiter(data: bytes, delimiter: bytes, start: int, end: int) -> int:
+    """查找位于行首且独占一行的分隔线(只以分隔线开头的正文行不算)"""
+    pos = data.find(delimiter, start, end)
+    while pos >= 0 and (
+        (pos > start and data[pos - 1] != 0x0A)
+        or not _is_delimiter_line(data, pos + len(delimiter), end)
+    ):
+        pos = data.find(delimiter, pos + 1, end)
+    return pos
+
+
+def _strip_newline(data: bytes, start: int, end: int) -> int:
+    """去掉末尾的一个换行(CRLF或LF),返回新的结束位置"""
+    if end > start and data[end - 1] == 0x0A:
+        end -= 1
+        if end > start and data[end - 1] == 0x0D:
+            end -= 1
+    return end
+
+
+def _scan_part(data: bytes, view: memoryview, start: int, end: int, depth: int) -> RawPart:
+    """扫描一个部分(multipart递归扫描子部分)"""
+    header_end, body_start = _body_offset(data, start, end)
+    headers = _parse_header_block(view, start, header_end)
+    part = RawPart(headers, data, view, min(body_start, end), end)
+    
+    boundary = headers.get_boundary() if headers.get_content_maintype() == "multipart" else None
+    if not boundary or depth >= MAX_DEPTH:
+        return part
+    
+    delimiter = b"--" + boundary.encode("ascii", "surrogateescape")
+    pos = _find_delimiter(data, delimiter, part.start, end)
+    child_start = None
+    while pos >= 0:
+        # 上一个子部分在分隔线前的换行处结束
+        if child_start is not None:
+            child_end = _strip_newline(data, child_start, pos)
+            part.children.append(_scan_part(data, view, child_start, child_end, depth + 1))
+        
+        after = pos + len(delimiter)
+        if data.startswith(b"--", after):
+            child_start = None
+            break
+        
+        line_end = data.find(b"\n", after, end)
+        if line_end < 0:
+            child_start = None
+            break
+        child_start = line_end + 1
+        pos = _find_delimiter(data, delimiter, child_start, end)
+    
+    # 没有结束分隔线: 最后一个子部分到数据末尾
+    if child_start is not None and child_start < end:
+        child_end = _strip_newline(data, child_start, end)
+        part.children.append(_scan_part(data, view, child_start, child_end, depth + 1))
+    
+    return part
+
+
+def scan(data: bytes) -> RawPart:
+    """
+    扫描邮件结构
+    
+    输入:
+        data: 原始邮件字节
+        
+    输出:
+        根部分(multipart的子部分在children中)
+    """
+    return _scan_part(data, memoryview(data), 0, len(data), 0)
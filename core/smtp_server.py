@@ -8,42 +8,170 @@ SMTP服务器模块
     - 不存储邮件,处理完即丢弃
 
 调用链:
-    外部邮件 -> SMTPHandler.handle_DATA -> 解析 -> 匹配规则 -> ConnectionManager.push_email
+    外部邮件 -> SMTPHandler.handle_DATA -> 解析 -> 匹配规则
+    -> ParsedEmail.push_payload(序列化一次) -> Connection.send_payload
 
 输入: 外部SMTP连接和邮件数据
 输出: 通过ConnectionManager推送给客户端
 """
 import asyncio
 import logging
-from typing import Optional
+from collections import Counter
+from typing import Optional, List, Dict, Tuple
 from aiosmtpd.controller import Controller
-from aiosmtpd.smtp import SMTP, Envelope, Session
+from aiosmtpd.smtp import SMTP, Envelope, Session, syntax
 
-from core.mail_parser import MailParser
-from core.connection_manager import get_connection_manager
-from core.blacklist import get_blacklist
-from utils.matcher import EmailMatcher
-from schemas.request import EmailContent
+from core.mail_parser import MailParser, ParsedEmail
+from core.connection_manager import Connection, get_connection_manager, STATE_NORMAL
+from core.blacklist import CATEGORY_OVERSIZE, get_blacklist
+from core.match_batcher import MatchBatcher
+from core.inflight_budget import InflightBudget
+from utils.matcher import MatchContext, MatchPlan
+from utils.match_pool import get_match_engine
 
 
 logger = logging.getLogger(__name__)
 
 
+class _MatchShares:
+    """一封邮件一个收件人的匹配耗时分摊: 规则集的实际耗时由共享它的连接(含延后匹配的)平分"""
+    
+    __slots__ = ("sharers", "shares")
+    
+    def __init__(self, conns: List[Connection]):
+        self.sharers = Counter(conn.plan.fingerprint for conn in conns)
+        self.shares: Dict[Optional[str], int] = {}
+    
+    def take(self, match_ctx: MatchContext, fingerprint: Optional[str]) -> int:
+        """分摊到一个连接的耗时(纳秒)"""
+        share = self.shares.get(fingerprint)
+        if share is None:
+            share = self.shares[fingerprint] = match_ctx.timings.pop(fingerprint, 0) // self.sharers[fingerprint]
+        return share
+
+
 class RubbishMailHandler:
     """SMTP邮件处理器"""
     
-    def __init__(self, allowed_domain: str, max_message_size: int = 10 * 1024 * 1024):
+    def __init__(
+        self,
+        allowed_domain: str,
+        max_message_size: int = 10 * 1024 * 1024,
+        sender_pushdown: str = "off",
+        batch_window_ms: float = 0,
+        batch_max_size: int = 64,
+        max_inflight_bytes: int = 0
+    ):
         """
         初始化处理器
         
         输入:
             allowed_domain: 允许的邮箱域名(只接收该域名的邮件)
             max_message_size: 最大邮件大小(字节),默认10MB
+            sender_pushdown: 发件人谓词下推模式
+                - "off": 关闭
+                - "header": 只解析头部From,所有订阅都不可能匹配时跳过正文解析
+                - "envelope": RCPT阶段按MAIL FROM判断,所有订阅都不可能匹配时临时拒收(450)
+            batch_window_ms: 微批匹配窗口(毫秒),0表示逐封匹配
+            batch_max_size: 每批最多邮件数
+            max_inflight_bytes: 在途邮件内存预算(字节),0表示不限制
         """
+        if sender_pushdown not in ("off", "header", "envelope"):
+            raise ValueError(f"未知的发件人下推模式: {sender_pushdown}")
         self.allowed_domain = allowed_domain.lower()
         self.max_message_size = max_message_size
+        self.sender_pushdown = sender_pushdown
         self.connection_manager = get_connection_manager()
         self.blacklist = get_blacklist()
+        self.batcher = MatchBatcher(self, batch_window_ms, batch_max_size) if batch_window_ms > 0 else None
+        self.inflight = InflightBudget(max_inflight_bytes)
+        # 进行中的延后匹配任务(保持引用,避免任务在完成前被回收)
+        self._deferred_tasks = set()
+    
+    @staticmethod
+    def _footprint(message_size: int) -> int:
+        """在途邮件占用估算: 原始数据 + 解析出的正文(不超过原始大小)"""
+        return message_size * 2
+    
+    def _declared_size(self, mail_options: List[str]) -> int:
+        """MAIL FROM声明的SIZE(未声明或超过上限时按最大邮件大小)"""
+        for option in mail_options:
+            name, _, value = option.partition("=")
+            if name.upper() == "SIZE" and value.isdigit():
+                return min(int(value), self.max_message_size)
+        return self.max_message_size
+    
+    async def handle_MAIL(
+        self,
+        server: SMTP,
+        session: Session,
+        envelope: Envelope,
+        address: str,
+        mail_options: List[str]
+    ):
+        """
+        处理MAIL命令
+        
+        按声明的SIZE(未声明时按最大邮件大小)预留在途内存预算,
+        超出预算时推迟事务,发件方稍后重试
+        
+        输出:
+            "250 OK": 接受发件人
+            "452 Error": 在途邮件超出内存预算
+        """
+        if not self.inflight.reserve(session, self._footprint(self._declared_size(mail_options))):
+            return "452 4.3.1 Insufficient system storage, try again later"
+        
+        envelope.mail_from = address
+        envelope.mail_options.extend(mail_options)
+        return "250 OK"
+    
+    async def handle_RSET(self, server: SMTP, session: Session, envelope: Envelope):
+        """处理RSET命令: 放弃当前事务,释放在途内存预算"""
+        self.inflight.release(session)
+        return "250 OK"
+    
+    async def handle_QUIT(self, server: SMTP, session: Session, envelope: Envelope):
+        """处理QUIT命令: 未发送DATA就结束的事务释放在途内存预算"""
+        self.inflight.release(session)
+        return "221 Bye"
+    
+    def connection_lost(self, session: Session):
+        """
+        SMTP连接断开(由_SMTPProtocol调用): 释放在途内存预算
+        
+        输入:
+            session: SMTP会话
+        """
+        self.inflight.release(session)
+    
+    async def handle_RCPT(
+        self,
+        server: SMTP,
+        session: Session,
+        envelope: Envelope,
+        address: str,
+        rcpt_options: List[str]
+    ):
+        """
+        处理RCPT命令
+        
+        envelope模式下,收件人的所有订阅仅凭MAIL FROM就保证不匹配时拒收,
+        不再接收正文。使用临时错误: 订阅随连接变化,发件方重试时可能已有匹配的订阅
+        
+        输出:
+            "250 OK": 接受收件人
+            "450 Error": 当前没有订阅可能匹配该发件人
+        """
+        if self.sender_pushdown == "envelope" and envelope.mail_from:
+            recipient_email = MailParser.extract_recipient(address).lower()
+            if not self.connection_manager.can_match_sender(recipient_email, envelope.mail_from):
+                logger.info(f"发件人不匹配任何订阅,临时拒收: {envelope.mail_from} -> {recipient_email}")
+                return "450 4.7.1 Recipient is not accepting mail from this sender right now"
+        
+        envelope.rcpt_tos.append(address)
+        envelope.rcpt_options.extend(rcpt_options)
+        return "250 OK"
     
     async def handle_DATA(self, server: SMTP, session: Session, envelope: Envelope):
         """
@@ -70,6 +198,7 @@ class RubbishMailHandler:
             
             # 2. 检查邮件大小
             message_size = len(envelope.content)
+            self.inflight.adjust(session, self._footprint(message_size))
             if message_size > self.max_message_size:
                 logger.warning(
                     f"🚫 拒绝超大邮件: {message_size / 1024 / 1024:.2f}MB "
@@ -78,7 +207,8 @@ class RubbishMailHandler:
                 # 自动拉黑发送超大邮件的IP
                 await self.blacklist.add_ip(
                     client_ip, 
-                    f"发送超大邮件 ({message_size / 1024 / 1024:.2f}MB)"
+                    f"发送超大邮件 ({message_size / 1024 / 1024:.2f}MB)",
+                    category=CATEGORY_OVERSIZE
                 )
                 return f"552 Message too large ({message_size / 1024 / 1024:.2f}MB > {self.max_message_size / 1024 / 1024}MB)"
             
@@ -92,6 +222,10 @@ class RubbishMailHandler:
             
             logger.info(f"收到邮件: 发件人={envelope.mail_from}, 收件人={recipients}, IP={client_ip}")
             
+            # header模式: 只解析头部From,所有收件人的订阅都不可能匹配时跳过正文解析
+            if self.sender_pushdown == "header" and await self._skip_by_header_sender(envelope):
+                return "250 OK"
+            
             # 解析邮件内容
             email_data = MailParser.parse_from_bytes(envelope.content)
             
@@ -99,13 +233,29 @@ class RubbishMailHandler:
                 logger.warning("邮件解析失败,丢弃")
                 return "250 OK"  # 返回OK但丢弃邮件
             
-            logger.debug(f"邮件主题: {email_data.get('subject')}")
+            logger.debug(f"邮件主题: {email_data.subject}")
             
-            # 处理每个收件人
-            has_valid_recipient = False
-            for recipient in recipients:
-                if await self._process_recipient(recipient, email_data, client_ip, envelope.mail_from):
-                    has_valid_recipient = True
+            # 同一封邮件的所有收件人/连接共享匹配上下文
+            match_ctx = MatchContext(email_data)
+            
+            if self.batcher is not None:
+                # 微批模式: 与窗口内到达的其他邮件一起匹配和推送
+                has_valid_recipient = await self.batcher.submit(
+                    recipients, email_data, match_ctx, envelope.mail_from
+                )
+            else:
+                # 启用多进程匹配时,先在进程池中并行匹配所有相关规则集
+                engine = get_match_engine()
+                if engine is not None:
+                    await engine.evaluate(match_ctx, self._collect_plans(recipients))
+            
+                # 处理每个收件人
+                has_valid_recipient = False
+                for recipient in recipients:
+                    if await self._process_recipient(
+                        recipient, email_data, match_ctx, client_ip, envelope.mail_from
+                    ):
+                        has_valid_recipient = True
             
             # 如果没有任何有效收件人,可能是垃圾邮件,自动拉黑
             if not has_valid_recipient:
@@ -116,11 +266,204 @@ class RubbishMailHandler:
         except Exception as e:
             logger.error(f"处理邮件时出错: {e}", exc_info=True)
             return "250 OK"  # 即使出错也返回OK,避免发件方重试
+        
+        finally:
+            # 处理完成,释放在途内存预算
+            self.inflight.release(session)
+    
+    async def _skip_by_header_sender(self, envelope: Envelope) -> bool:
+        """
+        根据头部From判断是否可以跳过正文解析
+        
+        只有所有收件人都有监控连接(合法收件人,不触发自动拉黑),
+        且所有订阅都保证不匹配时才跳过
+        
+        输入:
+            envelope: 邮件信封
+            
+        输出:
+            True: 已丢弃,无需继续处理
+        """
+        recipients = [MailParser.extract_recipient(r).lower() for r in envelope.rcpt_tos]
+        if not recipients or not all(self.connection_manager.has_subscribers(r) for r in recipients):
+            return False
+        
+        sender = MailParser.parse_sender_from_bytes(envelope.content)
+        if not sender:
+            return False
+        
+        if any(self.connection_manager.can_match_sender(r, sender) for r in recipients):
+            return False
+        
+        # 与正常流程一致: 有监控连接的收件人收到的发件人域名记入白名单
+        if '@' in sender:
+            await self.blacklist.learn_whitelist_domain(sender.split('@')[1].lower())
+        
+        logger.info(f"发件人不匹配任何订阅,跳过正文解析: {sender} -> {recipients}")
+        return True
+    
+    def _collect_plans(self, recipients: List[str]) -> Dict[str, MatchPlan]:
+        """
+        收集所有收件人的监控连接使用的规则集
+        
+        超出匹配预算(降级/暂停)的连接不参与预先匹配,
+        降级的连接稍后在本进程中匹配,不拖慢其他订阅
+        
+        输入:
+            recipients: 收件人列表
+            
+        输出:
+            {指纹: MatchPlan}
+        """
+        plans = {}
+        for recipient in recipients:
+            recipient_email = MailParser.extract_recipient(recipient).lower()
+            for conn_id in self.connection_manager.email_to_connections.get(recipient_email, set()).copy():
+                conn = self.connection_manager.get_connection(conn_id)
+                if conn and conn.plan.fingerprint is not None \
+                        and self.connection_manager.match_state(conn) == STATE_NORMAL:
+                    plans[conn.plan.fingerprint] = conn.plan
+        return plans
+    
+    def _lookup_recipient(self, recipient: str) -> Optional[List[Connection]]:
+        """
+        检查收件人并查找监控它的连接
+        
+        输入:
+            recipient: 收件人邮箱地址
+            
+        输出:
+            连接列表, None: 地址无效/域名不匹配/没有监控连接
+        """
+        # 提取纯邮箱地址
+        recipient_email = MailParser.extract_recipient(recipient).lower()
+        
+        logger.debug(f"处理收件人: {recipient_email}")
+        
+        # 检查域名
+        if "@" not in recipient_email:
+            logger.warning(f"无效的收件人地址: {recipient_email}")
+            return None
+        
+        domain = recipient_email.split("@")[1]
+        if domain != self.allowed_domain:
+            logger.info(f"域名不匹配,丢弃邮件: {recipient_email} (允许: {self.allowed_domain})")
+            return None
+        
+        # 获取所有监控该邮箱的连接
+        manager = self.connection_manager
+        connection_ids = manager.email_to_connections.get(recipient_email, set()).copy()
+        conns = [conn for conn in map(manager.get_connection, connection_ids) if conn]
+        
+        if not conns:
+            logger.info(f"没有连接监控邮箱 {recipient_email},丢弃邮件")
+            return None
+        
+        logger.info(f"找到 {len(conns)} 个连接监控 {recipient_email}")
+        return conns
+    
+    def _schedule_matching(
+        self,
+        conns: List[Connection]
+    ) -> Tuple[List[Connection], List[Connection], _MatchShares]:
+        """
+        按匹配预算划分连接(暂停的连接被跳过)
+        
+        输入:
+            conns: 监控收件人的连接
+            
+        输出:
+            (立即匹配的连接, 延后匹配的连接, 两者共用的耗时分摊)
+        """
+        normal, deferred = self.connection_manager.schedule_matching(conns)
+        return normal, deferred, _MatchShares(normal + deferred)
+    
+    def _match_connections(
+        self,
+        conns: List[Connection],
+        email_data: ParsedEmail,
+        match_ctx: MatchContext,
+        shares: _MatchShares
+    ) -> List[Tuple[Connection, str]]:
+        """
+        对连接进行规则匹配,构造需要推送的内容
+        
+        共享规则集的连接由MatchContext复用匹配结果,由ParsedEmail复用序列化后的推送内容
+        
+        输入:
+            conns: 需要匹配的连接
+            email_data: 解析后的邮件
+            match_ctx: 邮件匹配上下文
+            shares: 耗时分摊
+            
+        输出:
+            [(连接, 推送的JSON文本), ...]
+        """
+        manager = self.connection_manager
+        deliveries = []
+        for conn in conns:
+            # 匹配规则(预编译计划,短路求值)
+            matched, match_description = conn.plan.evaluate(match_ctx)
+            
+            # 记录匹配耗时: 规则集的实际耗时由共享它的连接平分
+            fingerprint = conn.plan.fingerprint
+            manager.record_match_time(conn, shares.take(match_ctx, fingerprint))
+            
+            if not matched:
+                logger.debug(f"规则不匹配 [{conn.connection_id}],不推送")
+                continue
+            
+            logger.info(f"规则匹配成功 [{conn.connection_id}]: {match_description}")
+            
+            # 序列化推送内容(相同规则集/描述/正文选项只序列化一次)
+            payload = email_data.push_payload(
+                (fingerprint, match_description, conn.include_content),
+                match_description,
+                conn.include_content,
+                conn.plan.extract(match_ctx)
+            )
+            deliveries.append((conn, payload))
+        return deliveries
+    
+    def _defer_matching(
+        self,
+        conns: List[Connection],
+        email_data: ParsedEmail,
+        match_ctx: MatchContext,
+        shares: _MatchShares
+    ):
+        """
+        在后续任务中匹配超出预算的连接并推送,不延迟其他连接的推送和SMTP响应
+        
+        输入:
+            conns: 延后匹配的连接
+            email_data: 解析后的邮件
+            match_ctx: 邮件匹配上下文
+            shares: 耗时分摊(与立即匹配的连接共用)
+        """
+        task = asyncio.ensure_future(self._match_deferred(conns, email_data, match_ctx, shares))
+        self._deferred_tasks.add(task)
+        task.add_done_callback(self._deferred_tasks.discard)
+    
+    async def _match_deferred(
+        self,
+        conns: List[Connection],
+        email_data: ParsedEmail,
+        match_ctx: MatchContext,
+        shares: _MatchShares
+    ):
+        """延后匹配任务"""
+        try:
+            for conn, payload in self._match_connections(conns, email_data, match_ctx, shares):
+                await conn.send_payload(payload, email_data.subject)
+        except Exception as e:
+            logger.error(f"延后匹配出错: {e}", exc_info=True)
     
     async def _process_recipient(
         self, 
         recipient: str, 
-        email_data: dict, 
+        email_data: ParsedEmail, 
+        match_ctx: MatchContext,
         client_ip: str, 
         sender: str
     ) -> bool:
@@ -129,7 +472,8 @@ class RubbishMailHandler:
         
         输入:
             recipient: 收件人邮箱地址
-            email_data: 解析后的邮件数据
+            email_data: 解析后的邮件
+            match_ctx: 邮件匹配上下文(字段缓存)
             client_ip: 客户端IP
             sender: 发件人邮箱
             
@@ -137,71 +481,23 @@ class RubbishMailHandler:
             True: 成功处理(有监控的连接), False: 无监控或域名不匹配
         """
         try:
-            # 提取纯邮箱地址
-            recipient_email = MailParser.extract_recipient(recipient).lower()
-            
-            logger.debug(f"处理收件人: {recipient_email}")
-            
-            # 检查域名
-            if "@" not in recipient_email:
-                logger.warning(f"无效的收件人地址: {recipient_email}")
-                return False
-            
-            domain = recipient_email.split("@")[1]
-            if domain != self.allowed_domain:
-                logger.info(f"域名不匹配,丢弃邮件: {recipient_email} (允许: {self.allowed_domain})")
+            conns = self._lookup_recipient(recipient)
+            if conns is None:
                 return False
             
-            # 查找监听该邮箱的连接
-            manager = get_connection_manager()
-            
-            # 获取所有监控该邮箱的连接
-            connection_ids = manager.email_to_connections.get(recipient_email, set()).copy()
-            
-            if not connection_ids:
-                logger.info(f"没有连接监控邮箱 {recipient_email},丢弃邮件")
-                return False
-            
-            logger.info(f"找到 {len(connection_ids)} 个连接监控 {recipient_email}")
-            
             # 有监控连接,说明这是合法收件人
-            # 对每个连接进行规则匹配
-            matched_any = False
-            for conn_id in connection_ids:
-                conn = manager.get_connection(conn_id)
-                if not conn:
-                    continue
-                
-                # 学习发件人域名到白名单(从用户规则中提取)
-                if '@' in sender:
-                    sender_domain = sender.split('@')[1].lower()
-                    await self.blacklist.learn_whitelist_domain(sender_domain)
-                
-                # 匹配规则
-                matched, match_description = EmailMatcher.match_any(
-                    conn.rules,
-                    email_data
-                )
-                
-                if matched:
-                    matched_any = True
-                    logger.info(f"规则匹配成功 [{conn_id}]: {match_description}")
-                    
-                    # 构造EmailContent对象
-                    email_content = EmailContent(
-                        sender=email_data.get("sender", ""),
-                        sender_name=email_data.get("sender_name"),
-                        subject=email_data.get("subject", ""),
-                        body=email_data.get("body", ""),
-                        html_body=email_data.get("html_body"),
-                        received_time=email_data.get("received_time", ""),
-                        matched_rule=match_description
-                    )
-                    
-                    # 推送给客户端
-                    await conn.send_email(email_content)
-                else:
-                    logger.debug(f"规则不匹配 [{conn_id}],不推送")
+            # 学习发件人域名到白名单(从用户规则中提取)
+            if '@' in sender:
+                sender_domain = sender.split('@')[1].lower()
+                await self.blacklist.learn_whitelist_domain(sender_domain)
+            
+            # 对预算内的连接进行规则匹配并推送给客户端,超出预算的连接在推送之后再匹配
+            normal, deferred, shares = self._schedule_matching(conns)
+            deliveries = self._match_connections(normal, email_data, match_ctx, shares)
+            for conn, payload in deliveries:
+                await conn.send_payload(payload, email_data.subject)
+            if deferred:
+                self._defer_matching(deferred, email_data, match_ctx, shares)
             
             return True  # 有监控连接,返回True
         
@@ -210,6 +506,32 @@ class RubbishMailHandler:
             return False
 
 
+class _SMTPProtocol(SMTP):
+    """SMTP协议: 连接断开、DATA被aiosmtpd直接拒绝时通知处理器(aiosmtpd没有对应的handle_*钩子)"""
+    
+    @syntax('DATA')
+    async def smtp_DATA(self, arg: str) -> None:
+        envelope = self.envelope
+        try:
+            await super().smtp_DATA(arg)
+        finally:
+            # 事务已结束(包括超过大小上限返回552、行过长返回500,不调用handle_DATA): 释放在途预留
+            if self.envelope is not envelope and self.session is not None:
+                self.event_handler.inflight.release(self.session)
+    
+    def connection_lost(self, error: Optional[Exception]) -> None:
+        super().connection_lost(error)
+        if self.session is not None:
+            self.event_handler.connection_lost(self.session)
+
+
+class _Controller(Controller):
+    """使用_SMTPProtocol的控制器"""
+    
+    def factory(self):
+        return _SMTPProtocol(self.handler, **self.SMTP_kwargs)
+
+
 class SMTPServer:
     """SMTP服务器控制器"""
     
@@ -218,7 +540,11 @@ class SMTPServer:
         host: str = "0.0.0.0",
         port: int = 8025,
         allowed_domain: str = "example.com",
-        max_message_size: int = 10 * 1024 * 1024
+        max_message_size: int = 10 * 1024 * 1024,
+        sender_pushdown: str = "off",
+        batch_window_ms: float = 0,
+        batch_max_size: int = 64,
+        max_inflight_bytes: int = 0
     ):
         """
         初始化SMTP服务器
@@ -228,6 +554,10 @@ class SMTPServer:
             port: 监听端口(建议非特权端口8025,生产环境用iptables转发25->8025)
             allowed_domain: 允许的邮箱域名
             max_message_size: 最大邮件大小(字节),默认10MB
+            sender_pushdown: 发件人谓词下推模式(off/header/envelope)
+            batch_window_ms: 微批匹配窗口(毫秒),0表示逐封匹配
+            batch_max_size: 每批最多邮件数
+            max_inflight_bytes: 在途邮件内存预算(字节),0表示不限制
         """
         self.host = host
         self.port = port
@@ -235,10 +565,17 @@ class SMTPServer:
         self.max_message_size = max_message_size
         
         # 创建处理器
-        self.handler = RubbishMailHandler(allowed_domain, max_message_size)
+        self.handler = RubbishMailHandler(
+            allowed_domain,
+            max_message_size,
+            sender_pushdown,
+            batch_window_ms,
+            batch_max_size,
+            max_inflight_bytes
+        )
         
         # 创建控制器
-        self.controller = Controller(
+        self.controller = _Controller(
             self.handler,
             hostname=host,
             port=port,
@@ -152,6 +152,14 @@ class MailMonitorClient:
                 print(f"主题: {msg_data.get('subject')}")
                 print(f"匹配规则: {msg_data.get('matched_rule')}")
                 print(f"时间: {msg_data.get('received_time')}")
+                
+                # 服务端提取结果(使用extract规则时)
+                extracted = msg_data.get('extracted')
+                if extracted:
+                    print("-" * 60)
+                    print("🔑 服务端提取结果:")
+                    for name, values in extracted.items():
+                        print(f"  {name}: {values}")
                 print("-" * 60)
                 print("正文:")
                 print(msg_data.get('body')[:500])  # 只显示前500字符
@@ -314,6 +314,54 @@ async def example_8_multi_field_search():
                 break
 
 
+async def example_9_server_side_extract():
+    """
+    示例9: 服务端提取验证码和确认链接
+    
+    场景: 只需要验证码和确认链接,不需要完整正文
+    服务端提取后只推送extracted字段,推送内容从几百KB缩小到几十字节
+    """
+    print("示例9: 服务端提取")
+    print("=" * 60)
+    
+    async with websockets.connect(WS_URL) as ws:
+        await ws.send(json.dumps({
+            "api_key": API_KEY,
+            "email": "temp@your-domain.com",
+            "rules": [
+                {
+                    "type": "keyword",
+                    "patterns": ["验证码", "verification", "confirm"],
+                    "search_in": ["subject", "body"],
+                    "extract": [
+                        {
+                            "name": "code",
+                            "type": "regex",
+                            "pattern": "(?:验证码|code)[^\\w]*([A-Z0-9]{4,6})"
+                        },
+                        {
+                            "name": "confirm_link",
+                            "type": "links",
+                            "pattern": "confirm|verify",
+                            "search_in": ["html", "body"]
+                        }
+                    ]
+                }
+            ]
+            # 未指定include_content时,有提取规则则不推送body/html_body
+        }))
+        
+        async for msg in ws:
+            data = json.loads(msg)
+            if data["type"] == "email_received":
+                email = data["data"]
+                extracted = email.get("extracted") or {}
+                print(f"✓ 收到邮件: {email['subject']}")
+                print(f"  验证码: {extracted.get('code')}")
+                print(f"  确认链接: {extracted.get('confirm_link')}")
+                break
+
+
 if __name__ == "__main__":
     print("""
 ╔════════════════════════════════════════════════════════════╗
@@ -337,12 +385,13 @@ if __name__ == "__main__":
         "6": ("高级验证码提取", example_6_advanced_verification),
         "7": ("排除特定发件人", example_7_exclude_pattern),
         "8": ("多字段搜索", example_8_multi_field_search),
+        "9": ("服务端提取验证码和链接", example_9_server_side_extract),
     }
     
     for key, (desc, _) in examples.items():
         print(f"{key}. {desc}")
     
-    choice = input("\n请选择(1-8): ").strip()
+    choice = input("\n请选择(1-9): ").strip()
     
     if choice in examples:
         try:
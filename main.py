@@ -13,7 +13,7 @@
 调用链:
     main → app.startup → 启动SMTP服务器
     websocket_endpoint → ConnectionManager.add_connection
-    SMTP收到邮件 → ConnectionManager.push_email
+    SMTP收到邮件 → 匹配规则 → ParsedEmail.push_payload → Connection.send_payload
 
 启动:
     python main.py
@@ -21,23 +21,42 @@
     uvicorn main:app --host 0.0.0.0 --port 8000
 """
 import asyncio
+import json
 import logging
+from itertools import islice
+from typing import Literal, Optional
 from datetime import datetime
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import uvicorn
 
 from core.config import get_settings
 from core.auth import init_auth, get_auth
 from core.smtp_server import SMTPServer
+from core.mail_parser import MailParser
 from core.connection_manager import get_connection_manager
-from core.blacklist import get_blacklist
+from core.blacklist import (
+    CATEGORY_AUTO,
+    CATEGORY_MANUAL,
+    CATEGORY_OVERSIZE,
+    MAX_PAGE_SIZE,
+    get_blacklist,
+    init_blacklist
+)
 from utils.log_rotation import get_log_rotation
+from utils.matcher import EmailMatcher
+from utils.match_pool import init_match_engine, get_match_engine
+from utils.charset import get_cache_info as get_charset_cache_info
+from utils.domain_trie import normalize_domain
+from utils.ip_trie import parse_ip_or_network
 from schemas.request import (
     MonitorRequest,
+    IPCheckRequest,
+    BlacklistImportEntry,
     MonitorStartMessage,
     ErrorMessage,
     HeartbeatMessage
@@ -83,10 +102,53 @@ async def lifespan(app: FastAPI):
     init_auth(settings.get_valid_api_keys())
     logger.info("[OK] API认证已初始化")
     
-    # 初始化黑名单
-    from core.blacklist import Blacklist
-    global _blacklist
-    _blacklist = Blacklist(storage_path=settings.blacklist.storage)
+    # 规则匹配扫描窗口
+    EmailMatcher.configure(
+        max_scan_bytes=settings.matcher.max_scan_bytes,
+        scan_mode=settings.matcher.scan_mode
+    )
+    if settings.matcher.max_scan_bytes:
+        logger.info(f"[OK] 正文扫描窗口: {settings.matcher.max_scan_bytes}字符 ({settings.matcher.scan_mode})")
+    
+    # 每个API Key的匹配耗时预算
+    get_connection_manager().configure_budget(
+        budget_ms=settings.monitor.match_budget_ms,
+        window=settings.monitor.match_budget_window,
+        suspend_factor=settings.monitor.match_suspend_factor
+    )
+    if settings.monitor.match_budget_ms:
+        logger.info(f"[OK] 匹配耗时预算: {settings.monitor.match_budget_ms}ms/{settings.monitor.match_budget_window}秒")
+    
+    # 邮件解析限制
+    MailParser.configure(max_text_bytes=settings.smtp.max_text_bytes)
+    
+    # 多进程匹配引擎(可选)
+    if settings.matcher.workers > 0:
+        init_match_engine(
+            workers=settings.matcher.workers,
+            shard_size=settings.matcher.shard_size,
+            max_scan_bytes=settings.matcher.max_scan_bytes,
+            scan_mode=settings.matcher.scan_mode
+        ).start()
+        logger.info(f"[OK] 多进程匹配: {settings.matcher.workers}个工作进程")
+    
+    # 初始化黑名单(修改由后台任务合并写入)
+    init_blacklist(
+        storage_path=settings.blacklist.storage,
+        flush_interval=settings.blacklist.flush_interval,
+        compact_records=settings.blacklist.compact_records,
+        compact_interval=settings.blacklist.compact_interval,
+        ip_feeds=settings.blacklist.ip_feeds,
+        feed_reload_interval=settings.blacklist.feed_reload_interval,
+        default_ttls={
+            CATEGORY_AUTO: settings.blacklist.auto_block_ttl,
+            CATEGORY_OVERSIZE: settings.blacklist.oversize_ttl,
+            CATEGORY_MANUAL: settings.blacklist.manual_ttl
+        },
+        reap_interval=settings.blacklist.reap_interval,
+        bloom_fp_rate=settings.blacklist.bloom_fp_rate,
+        reload_interval=settings.blacklist.reload_interval
+    ).start()
     logger.info(f"[OK] 黑名单已加载: {settings.blacklist.storage}")
     logger.info(f"[OK] 自动拉黑: {'开启' if settings.blacklist.auto_block else '关闭'}")
     
@@ -101,12 +163,18 @@ async def lifespan(app: FastAPI):
         host=smtp_host,
         port=settings.smtp.port,
         allowed_domain=settings.smtp.allowed_domain,
-        max_message_size=settings.smtp.max_message_size * 1024 * 1024  # MB转字节
+        max_message_size=settings.smtp.max_message_size * 1024 * 1024,  # MB转字节
+        sender_pushdown=settings.smtp.sender_pushdown,
+        batch_window_ms=settings.matcher.batch_window_ms,
+        batch_max_size=settings.matcher.batch_max_size,
+        max_inflight_bytes=settings.smtp.max_inflight_mb * 1024 * 1024
     )
     smtp_server.start()
     logger.info(f"[OK] SMTP服务器: {smtp_host}:{settings.smtp.port}")
     logger.info(f"[OK] 接收域名: {settings.smtp.allowed_domain}")
     logger.info(f"[OK] 邮件大小限制: {settings.smtp.max_message_size}MB")
+    if settings.smtp.sender_pushdown != "off":
+        logger.info(f"[OK] 发件人谓词下推: {settings.smtp.sender_pushdown}")
     
     # WebSocket配置
     logger.info(f"[OK] WebSocket API: {settings.server.host}:{settings.server.port}")
@@ -140,6 +208,14 @@ async def lifespan(app: FastAPI):
     if smtp_server:
         smtp_server.stop()
     
+    # 停止多进程匹配引擎
+    engine = get_match_engine()
+    if engine:
+        engine.stop()
+    
+    # 写入尚未保存的黑名单修改
+    get_blacklist().stop()
+    
     logger.info("服务已关闭")
     logger.info("="*60)
 
@@ -183,6 +259,7 @@ async def root():
             "max": settings.monitor.max_connections,
             "monitored_emails": manager.get_monitored_emails()
         },
+        "inflight": smtp_server.handler.inflight.get_stats() if smtp_server else None,
         "timestamp": datetime.now().isoformat()
     })
 
@@ -200,9 +277,11 @@ async def websocket_endpoint(websocket: WebSocket):
             {
                 "type": "keyword",
                 "patterns": ["验证码", "code"],
-                "search_in": ["subject", "body"]
+                "search_in": ["subject", "body"],
+                "extract": [{"name": "code", "pattern": "(\\d{6})"}]
             }
-        ]
+        ],
+        "include_content": false
     }
     
     服务器会推送以下消息:
@@ -273,7 +352,9 @@ async def websocket_endpoint(websocket: WebSocket):
             websocket=websocket,
             email=request.email,
             rules=request.rules,
-            timeout=settings.monitor.timeout
+            timeout=settings.monitor.timeout,
+            include_content=request.wants_content(),
+            api_key=request.api_key
         )
         
         logger.info(f"新监控: {connection_id} -> {request.email}")
@@ -285,7 +366,8 @@ async def websocket_endpoint(websocket: WebSocket):
                     "message": "监控已启动",
                     "email": request.email,
                     "rules_count": len(request.rules),
-                    "timeout": settings.monitor.timeout
+                    "timeout": settings.monitor.timeout,
+                    "include_content": request.wants_content()
                 }
             ).model_dump()
         )
@@ -331,6 +413,33 @@ async def websocket_endpoint(websocket: WebSocket):
             logger.info(f"清理连接: {connection_id}")
 
 
+@app.get("/api/matcher/stats", dependencies=[Depends(verify_api_key)])
+async def get_matcher_stats():
+    """
+    获取规则匹配统计(谓词求值次数和耗时)
+    
+    需要认证: Bearer Token (API Key)
+    """
+    stats = EmailMatcher.get_stats()
+    engine = get_match_engine()
+    if engine:
+        stats["engine"] = engine.get_stats()
+    if smtp_server and smtp_server.handler.batcher:
+        stats["batcher"] = smtp_server.handler.batcher.get_stats()
+    stats["charset"] = get_charset_cache_info()
+    return JSONResponse(stats)
+
+
+@app.get("/api/admin/match_usage", dependencies=[Depends(verify_api_key)])
+async def get_match_usage():
+    """
+    获取每个API Key和连接的匹配耗时及预算状态
+    
+    需要认证: Bearer Token (API Key)
+    """
+    return JSONResponse(get_connection_manager().get_match_usage())
+
+
 @app.get("/api/blacklist", dependencies=[Depends(verify_api_key)])
 async def get_blacklist_info():
     """
@@ -353,26 +462,154 @@ async def get_blacklist_detail():
     return JSONResponse(blacklist.get_detailed_list())
 
 
-@app.post("/api/blacklist/ip/{ip}", dependencies=[Depends(verify_api_key)])
-async def add_ip_to_blacklist(ip: str, reason: str = "手动添加"):
+@app.get("/api/blacklist/entries", dependencies=[Depends(verify_api_key)])
+async def list_blacklist_entries(
+    kind: Literal["ip", "domain", "whitelist"] = "ip",
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=MAX_PAGE_SIZE),
+    prefix: Optional[str] = None,
+    reason: Optional[str] = None,
+    added_after: Optional[str] = None,
+    added_before: Optional[str] = None
+):
+    """
+    按键顺序分页列出黑名单条目
+    
+    需要认证: Bearer Token (API Key)
+    
+    参数:
+        kind: ip / domain / whitelist
+        cursor: 上一页返回的next_cursor(可选)
+        limit: 每页条目数(最多1000)
+        prefix: 只列出以此开头的键(可选)
+        reason: 只列出拉黑原因包含该文本的条目(可选)
+        added_after / added_before: 添加时间区间(ISO格式,可选)
+    """
+    blacklist = get_blacklist()
+    return JSONResponse(blacklist.list_entries(
+        kind,
+        cursor=cursor,
+        limit=limit,
+        prefix=prefix,
+        reason=reason,
+        added_after=added_after,
+        added_before=added_before
+    ))
+
+
+@app.get("/api/blacklist/export", dependencies=[Depends(verify_api_key)])
+async def export_blacklist(kind: Optional[Literal["ip", "domain", "whitelist"]] = None):
+    """
+    以NDJSON流导出黑名单(每行一个条目,可直接用于批量导入)
+    
+    需要认证: Bearer Token (API Key)
+    
+    参数:
+        kind: 只导出一种类型(可选,默认全部)
+    """
+    blacklist = get_blacklist()
+    records = blacklist.export_entries((kind,) if kind else ("ip", "domain", "whitelist"))
+    
+    def chunks():
+        # 同步生成器由线程池迭代(SQLite读取不阻塞事件循环),每1000行输出一次
+        while True:
+            batch = list(islice(records, 1000))
+            if not batch:
+                return
+            yield "".join(
+                json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+                for record in batch
+            )
+    
+    return StreamingResponse(
+        chunks(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="blacklist.ndjson"'}
+    )
+
+
+@app.post("/api/blacklist/import", dependencies=[Depends(verify_api_key)])
+async def import_blacklist(request: Request):
+    """
+    批量导入黑名单(请求体为NDJSON流,格式与导出相同)
+    
+    先读取并校验全部行,有无效行时不导入任何条目;全部有效时一次应用,只写入一次
+    
+    需要认证: Bearer Token (API Key)
+    
+    请求体(每行一个JSON):
+        {"kind": "ip", "key": "1.2.3.0/24", "reason": "...", "ttl": 86400}
+        {"kind": "domain", "key": "spam.example"}
+        {"kind": "whitelist", "key": "github.com"}
+    """
+    entries = []
+    errors = []
+    invalid = 0
+    line_no = 0
+    
+    def parse(line: bytes):
+        nonlocal invalid, line_no
+        line_no += 1
+        if not line.strip():
+            return
+        try:
+            entries.append(BlacklistImportEntry.model_validate_json(line).model_dump())
+        except ValidationError as e:
+            invalid += 1
+            if len(errors) < 20:
+                errors.append({"line": line_no, "error": e.errors()[0]["msg"]})
+    
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            parse(line)
+    parse(buffer)
+    
+    if invalid:
+        raise HTTPException(status_code=400, detail={
+            "message": f"{invalid}行无效,未导入任何条目",
+            "errors": errors
+        })
+    
+    blacklist = get_blacklist()
+    result = await blacklist.import_entries(entries)
+    return JSONResponse({
+        "success": True,
+        "total": len(entries),
+        **result
+    })
+
+
+@app.post("/api/blacklist/ip/{ip:path}", dependencies=[Depends(verify_api_key)])
+async def add_ip_to_blacklist(ip: str, reason: str = "手动添加", ttl: Optional[int] = Query(default=None, ge=0)):
     """
     添加IP到黑名单
     
     需要认证: Bearer Token (API Key)
     
     参数:
-        ip: IP地址
+        ip: IP地址或CIDR网段(如 1.2.3.0/24、2001:db8::/32)
         reason: 拉黑原因(可选)
+        ttl: 有效期(秒,可选),0表示永久,不指定时使用blacklist.manual_ttl
     """
+    try:
+        ip = parse_ip_or_network(ip)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无效的IP地址或网段: {ip}")
+    
     blacklist = get_blacklist()
-    success = await blacklist.add_ip(ip, reason)
+    success = await blacklist.add_ip(ip, reason, ttl=ttl, category=CATEGORY_MANUAL)
     
     if success:
         return JSONResponse({
             "success": True,
             "message": f"已添加IP到黑名单: {ip}",
             "ip": ip,
-            "reason": reason
+            "reason": reason,
+            "expires_at": blacklist.blocked_ips.get(ip, {}).get("expires_at")
         })
     else:
         return JSONResponse({
@@ -382,7 +619,7 @@ async def add_ip_to_blacklist(ip: str, reason: str = "手动添加"):
         })
 
 
-@app.delete("/api/blacklist/ip/{ip}", dependencies=[Depends(verify_api_key)])
+@app.delete("/api/blacklist/ip/{ip:path}", dependencies=[Depends(verify_api_key)])
 async def remove_ip_from_blacklist(ip: str):
     """
     从黑名单移除IP
@@ -390,7 +627,7 @@ async def remove_ip_from_blacklist(ip: str):
     需要认证: Bearer Token (API Key)
     
     参数:
-        ip: IP地址
+        ip: IP地址或CIDR网段
     """
     blacklist = get_blacklist()
     success = await blacklist.remove_ip(ip)
@@ -406,7 +643,7 @@ async def remove_ip_from_blacklist(ip: str):
 
 
 @app.post("/api/blacklist/domain/{domain}", dependencies=[Depends(verify_api_key)])
-async def add_domain_to_blacklist(domain: str, reason: str = "手动添加"):
+async def add_domain_to_blacklist(domain: str, reason: str = "手动添加", ttl: Optional[int] = Query(default=None, ge=0)):
     """
     添加域名到黑名单
     
@@ -415,16 +652,18 @@ async def add_domain_to_blacklist(domain: str, reason: str = "手动添加"):
     参数:
         domain: 域名
         reason: 拉黑原因(可选)
+        ttl: 有效期(秒,可选),0表示永久,不指定时使用blacklist.manual_ttl
     """
     blacklist = get_blacklist()
-    success = await blacklist.add_domain(domain, reason)
+    success = await blacklist.add_domain(domain, reason, ttl=ttl, category=CATEGORY_MANUAL)
     
     if success:
         return JSONResponse({
             "success": True,
             "message": f"已添加域名到黑名单: {domain}",
             "domain": domain,
-            "reason": reason
+            "reason": reason,
+            "expires_at": blacklist.blocked_domains.get(normalize_domain(domain), {}).get("expires_at")
         })
     else:
         return JSONResponse({
@@ -457,6 +696,40 @@ async def remove_domain_from_blacklist(domain: str):
         raise HTTPException(status_code=404, detail=f"域名不在黑名单中: {domain}")
 
 
+@app.post("/api/blacklist/check", dependencies=[Depends(verify_api_key)])
+async def check_ips(request: IPCheckRequest):
+    """
+    批量检查IP是否被拉黑(单个地址、网段、IP黑名单源)
+    
+    需要认证: Bearer Token (API Key)
+    
+    参数:
+        ips: IP地址列表(最多10000个)
+    """
+    blacklist = get_blacklist()
+    results = await blacklist.check_ips(request.ips)
+    return JSONResponse({
+        "total": len(results),
+        "blocked": sum(1 for result in results if result["blocked"]),
+        "results": results
+    })
+
+
+@app.post("/api/blacklist/feeds/reload", dependencies=[Depends(verify_api_key)])
+async def reload_ip_feeds():
+    """
+    立即重新加载IP黑名单源(在后台线程构建新表后整体替换)
+    
+    需要认证: Bearer Token (API Key)
+    """
+    blacklist = get_blacklist()
+    await blacklist.reload_feeds()
+    return JSONResponse({
+        "success": True,
+        **blacklist.feeds.get_stats()
+    })
+
+
 if __name__ == "__main__":
     settings = get_settings()
     
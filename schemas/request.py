@@ -8,8 +8,67 @@
 
 输入/输出: 见各个Schema的字段说明
 """
-from typing import Optional, List, Literal
-from pydantic import BaseModel, Field, field_validator, EmailStr
+import re
+from datetime import datetime
+from typing import Optional, List, Literal, Dict, Union
+from pydantic import BaseModel, Field, field_validator, model_validator, EmailStr
+
+from utils.domain_trie import normalize_domain
+from utils.ip_trie import parse_ip_or_network
+
+
+class ExtractRule(BaseModel):
+    """
+    提取规则(服务端提取,推送中只返回提取结果)
+    
+    字段:
+        name: 结果名称,作为推送中extracted的键
+        type: 提取类型
+            - "regex": 返回正则捕获组
+            - "links": 返回链接(HTML中的href,纯文本中的http(s)地址),pattern用于过滤URL
+        pattern: 正则表达式(regex必填,links可选)
+        group: 捕获组编号或名称,默认1(正则没有捕获组时返回整个匹配)
+        search_in: 提取范围,支持 "sender", "subject", "body", "html"(HTML正文)
+        max_matches: 最多返回的结果数
+    """
+    name: str = Field(
+        min_length=1,
+        description="结果名称,例如: code, confirm_link"
+    )
+    type: Literal["regex", "links"] = Field(
+        default="regex",
+        description="提取类型: regex=捕获组, links=链接"
+    )
+    pattern: Optional[str] = Field(
+        default=None,
+        description="正则表达式(regex必填, links用于过滤URL)"
+    )
+    group: Union[int, str] = Field(
+        default=1,
+        description="捕获组编号或名称"
+    )
+    search_in: List[Literal["sender", "subject", "body", "html"]] = Field(
+        default=["subject", "body", "html"],
+        description="提取范围: sender=发件人, subject=主题, body=正文, html=HTML正文"
+    )
+    max_matches: int = Field(
+        default=1,
+        ge=1,
+        le=100,
+        description="最多返回的结果数"
+    )
+    
+    @model_validator(mode="after")
+    def validate_pattern(self):
+        """验证正则表达式"""
+        if self.type == "regex" and not self.pattern:
+            raise ValueError("regex提取规则必须提供pattern")
+        if self.pattern:
+            try:
+                re.compile(self.pattern)
+            except re.error as e:
+                raise ValueError(f"正则表达式错误 '{self.pattern}': {e}")
+        return self
 
 
 class MatchRule(BaseModel):
@@ -17,29 +76,74 @@ class MatchRule(BaseModel):
     邮件匹配规则
     
     字段:
-        type: 匹配类型,支持 "keyword"(关键词) 或 "regex"(正则表达式)
-        patterns: 匹配模式列表,多个模式之间为OR关系
+        type: 匹配类型
+            - "keyword"(关键词) / "regex"(正则表达式): 字段谓词,在search_in中搜索patterns
+            - "all"(全部满足) / "any"(任一满足) / "not"(取反): 组合表达式,作用于rules
+        patterns: 匹配模式列表,多个模式之间为OR关系(仅keyword/regex使用)
         search_in: 搜索范围,支持 "sender"(发件人), "subject"(主题), "body"(正文)
+        rules: 子规则列表(仅all/any/not使用, not只能包含一个子规则)
+        extract: 提取规则列表,规则集匹配后在服务端提取内容
+        max_scan_bytes: 正文/HTML最多扫描的长度(按解码后的字符计),未指定时使用全局配置,0表示不限制
+        scan_mode: 超出长度时的扫描窗口, "head"(开头) 或 "head_tail"(开头+结尾各一半)
     """
-    type: Literal["keyword", "regex"] = Field(
-        description="匹配类型: keyword=关键词匹配, regex=正则表达式匹配"
+    type: Literal["keyword", "regex", "all", "any", "not"] = Field(
+        description="匹配类型: keyword=关键词匹配, regex=正则表达式匹配, all/any/not=组合表达式"
     )
     patterns: List[str] = Field(
-        min_length=1,
-        description="匹配模式列表,至少包含一个模式"
+        default=[],
+        description="匹配模式列表,keyword/regex至少包含一个模式"
     )
     search_in: List[Literal["sender", "subject", "body"]] = Field(
         default=["sender", "subject", "body"],
         description="搜索范围: sender=发件人, subject=主题, body=正文"
     )
+    rules: List["MatchRule"] = Field(
+        default=[],
+        description="子规则列表: all/any至少一个, not恰好一个"
+    )
+    extract: List[ExtractRule] = Field(
+        default=[],
+        description="提取规则列表,匹配后在服务端提取验证码/链接等"
+    )
+    max_scan_bytes: Optional[int] = Field(
+        default=None,
+        ge=0,
+        description="正文/HTML最多扫描的长度,未指定时使用全局配置,0表示不限制"
+    )
+    scan_mode: Optional[Literal["head", "head_tail"]] = Field(
+        default=None,
+        description="扫描窗口: head=只扫描开头, head_tail=开头和结尾各一半"
+    )
     
     @field_validator("patterns")
     @classmethod
     def validate_patterns(cls, v):
-        """验证模式列表非空"""
-        if not v or all(not p.strip() for p in v):
-            raise ValueError("patterns不能为空")
+        """去除空白模式"""
         return [p.strip() for p in v if p.strip()]
+    
+    @model_validator(mode="after")
+    def validate_expression(self):
+        """验证谓词/组合表达式的结构"""
+        if self.type in ("keyword", "regex"):
+            if not self.patterns:
+                raise ValueError("patterns不能为空")
+            if self.rules:
+                raise ValueError(f"{self.type}规则不能包含子规则")
+            if self.type == "regex":
+                for pattern in self.patterns:
+                    try:
+                        re.compile(pattern)
+                    except re.error as e:
+                        raise ValueError(f"正则表达式错误 '{pattern}': {e}")
+        elif self.type == "not":
+            if len(self.rules) != 1:
+                raise ValueError("not规则必须恰好包含一个子规则")
+        elif not self.rules:
+            raise ValueError(f"{self.type}规则至少包含一个子规则")
+        return self
+
+
+MatchRule.model_rebuild()
 
 
 class MonitorRequest(BaseModel):
@@ -50,6 +154,9 @@ class MonitorRequest(BaseModel):
         api_key: API密钥,用于身份验证
         email: 要监控的邮箱地址(必须属于allowed_domain)
         rules: 匹配规则列表,只要有一个规则匹配就推送
+        include_content: 是否推送完整正文
+            - 未指定: 规则中没有提取规则时推送完整正文,有提取规则时只推送提取结果
+            - true/false: 强制推送/不推送body和html_body
     """
     api_key: str = Field(
         min_length=1,
@@ -62,6 +169,26 @@ class MonitorRequest(BaseModel):
         min_length=1,
         description="匹配规则列表,至少包含一个规则"
     )
+    include_content: Optional[bool] = Field(
+        default=None,
+        description="是否推送完整正文,默认有提取规则时不推送"
+    )
+    
+    def has_extract_rules(self) -> bool:
+        """规则树中是否包含提取规则"""
+        stack = list(self.rules)
+        while stack:
+            rule = stack.pop()
+            if rule.extract:
+                return True
+            stack.extend(rule.rules)
+        return False
+    
+    def wants_content(self) -> bool:
+        """推送时是否包含完整正文"""
+        if self.include_content is not None:
+            return self.include_content
+        return not self.has_extract_rules()
     
     @field_validator("email")
     @classmethod
@@ -72,6 +199,20 @@ class MonitorRequest(BaseModel):
         return v.lower()
 
 
+class AttachmentInfo(BaseModel):
+    """
+    附件元数据(服务端不解码附件内容)
+    
+    字段:
+        filename: 文件名(如果有)
+        content_type: MIME类型
+        size: 估算的大小(字节)
+    """
+    filename: Optional[str] = Field(default=None, description="文件名")
+    content_type: str = Field(description="MIME类型")
+    size: Optional[int] = Field(default=None, description="估算的大小(字节)")
+
+
 class EmailContent(BaseModel):
     """
     邮件内容(服务端推送给客户端)
@@ -80,18 +221,22 @@ class EmailContent(BaseModel):
         sender: 发件人邮箱
         sender_name: 发件人姓名(如果有)
         subject: 邮件主题
-        body: 邮件正文(纯文本)
-        html_body: 邮件正文(HTML格式,如果有)
+        body: 邮件正文(纯文本,未请求完整正文时为空)
+        html_body: 邮件正文(HTML格式,如果有;未请求完整正文时为None)
         received_time: 收到时间(ISO格式)
         matched_rule: 匹配的规则描述
+        extracted: 服务端提取结果 {name: [值, ...]}(有提取规则时)
+        attachments: 附件元数据列表(有附件时)
     """
     sender: str = Field(description="发件人邮箱")
     sender_name: Optional[str] = Field(default=None, description="发件人姓名")
     subject: str = Field(description="邮件主题")
-    body: str = Field(description="邮件正文(纯文本)")
+    body: str = Field(default="", description="邮件正文(纯文本)")
     html_body: Optional[str] = Field(default=None, description="邮件正文(HTML)")
     received_time: str = Field(description="收到时间(ISO格式)")
     matched_rule: str = Field(description="匹配的规则描述")
+    extracted: Optional[Dict[str, List[str]]] = Field(default=None, description="服务端提取结果")
+    attachments: Optional[List[AttachmentInfo]] = Field(default=None, description="附件元数据")
 
 
 class WebSocketMessage(BaseModel):
@@ -135,3 +280,77 @@ class HeartbeatMessage(WebSocketMessage):
         description="心跳时间戳"
     )
 
+
+class IPCheckRequest(BaseModel):
+    """
+    批量检查IP请求(审计用)
+    
+    输入:
+        ips: 要检查的IP地址
+    """
+    ips: List[str] = Field(
+        description="要检查的IP地址",
+        min_length=1,
+        max_length=10000
+    )
+
+
+class BlacklistImportEntry(BaseModel):
+    """
+    批量导入黑名单的一行(NDJSON,与导出格式相同)
+    
+    字段:
+        kind: "ip" / "domain" / "whitelist"
+        key: IP地址/CIDR网段或域名(导入时规范化)
+        reason: 拉黑原因
+        ttl: 有效期(秒),0表示永久,不指定时使用blacklist.manual_ttl
+        added_at / count / expires_at: 有added_at时按原样恢复条目(导出的行),忽略ttl
+    """
+    kind: Literal["ip", "domain", "whitelist"] = Field(
+        description="条目类型"
+    )
+    key: str = Field(
+        min_length=1,
+        description="IP地址/CIDR网段或域名"
+    )
+    reason: Optional[str] = Field(
+        default=None,
+        description="拉黑原因,默认为\"批量导入\""
+    )
+    ttl: Optional[int] = Field(
+        default=None,
+        ge=0,
+        description="有效期(秒),0表示永久"
+    )
+    added_at: Optional[str] = Field(
+        default=None,
+        description="添加时间(ISO格式)"
+    )
+    count: int = Field(
+        default=1,
+        ge=1,
+        description="拉黑次数"
+    )
+    expires_at: Optional[str] = Field(
+        default=None,
+        description="过期时间(ISO格式),为空表示永久"
+    )
+    
+    @field_validator("added_at", "expires_at")
+    @classmethod
+    def validate_timestamp(cls, v):
+        """验证时间格式"""
+        if v is not None:
+            datetime.fromisoformat(v)
+        return v
+    
+    @model_validator(mode="after")
+    def normalize_key(self):
+        """规范化IP/网段/域名"""
+        if self.kind == "ip":
+            self.key = parse_ip_or_network(self.key)
+        else:
+            self.key = normalize_domain(self.key)
+            if not self.key:
+                raise ValueError("域名不能为空")
+        return self
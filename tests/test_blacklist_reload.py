@@ -0,0 +1,121 @@
+"""
+黑名单热加载的回归测试
+
+功能:
+    - 快照被外部修改(手工删除条目)后重新加载,日志中早于修改的记录不会把条目恢复
+    - 早于外部修改、尚未压缩的其他记录(如自动拉黑)在重新加载后保留
+    - 外部修改之后写入日志的记录和尚未写入的修改在重新加载后保留,重启后结果一致
+
+运行: python -m pytest tests
+"""
+import asyncio
+import json
+import os
+
+from core.blacklist import Blacklist
+
+
+def _edit_snapshot(path, edit):
+    """模拟外部编辑: 读取快照,修改后原子替换"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    edit(data)
+    tmp = str(path) + ".edit"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def test_reload_does_not_restore_entries_deleted_from_snapshot(tmp_path):
+    path = tmp_path / "blacklist.json"
+    
+    async def run():
+        blacklist = Blacklist(str(path), reload_interval=0)
+        await blacklist.add_ip("1.1.1.1")
+        await blacklist.add_ip("2.2.2.2")
+        await blacklist.add_domain("spam.example")
+        await blacklist.flush(compact=True)
+        
+        # 压缩之后的修改只在日志中
+        await blacklist.add_ip("1.1.1.1")
+        await blacklist.add_ip("3.3.3.3")
+        await blacklist.flush()
+        assert blacklist._store.journal_records > 0
+        
+        # 手工删除1.1.1.1(快照中有,日志中也有它的更新记录)
+        _edit_snapshot(path, lambda data: data["blocked_ips"].pop("1.1.1.1"))
+        
+        # 外部修改之后写入日志的记录,以及尚未写入的修改
+        await blacklist.add_ip("4.4.4.4")
+        await blacklist.flush()
+        await blacklist.add_ip("5.5.5.5", save=False)
+        
+        assert await blacklist.reload()
+        assert not await blacklist.is_ip_blocked("1.1.1.1")
+        assert await blacklist.is_ip_blocked("2.2.2.2")
+        assert await blacklist.is_ip_blocked("4.4.4.4")
+        assert await blacklist.is_ip_blocked("5.5.5.5")
+        assert await blacklist.is_domain_blocked("spam.example")
+        # 3.3.3.3只在修改前的日志中,外部修改没有涉及它
+        assert await blacklist.is_ip_blocked("3.3.3.3")
+        
+        assert not await blacklist.reload()
+        blacklist.stop()
+    
+    asyncio.run(run())
+    
+    # 重启(快照 + 剩余日志)与重新加载后的内存状态一致
+    restarted = Blacklist(str(path), reload_interval=0)
+    assert sorted(restarted.blocked_ips) == ["2.2.2.2", "3.3.3.3", "4.4.4.4", "5.5.5.5"]
+    restarted.stop()
+
+
+def test_reload_without_changes_keeps_journal(tmp_path):
+    path = tmp_path / "blacklist.json"
+    
+    async def run():
+        blacklist = Blacklist(str(path), reload_interval=0)
+        await blacklist.add_ip("1.1.1.1")
+        await blacklist.flush(compact=True)
+        await blacklist.add_ip("2.2.2.2")
+        await blacklist.flush()
+        
+        # 快照没有被外部修改: 强制重新加载仍重放日志
+        assert await blacklist.reload(force=True)
+        assert await blacklist.is_ip_blocked("2.2.2.2")
+        blacklist.stop()
+    
+    asyncio.run(run())
+
+
+def test_reload_applies_edit_on_top_of_journal(tmp_path):
+    path = tmp_path / "blacklist.json"
+    
+    async def run():
+        blacklist = Blacklist(str(path), reload_interval=0)
+        await blacklist.add_ip("1.1.1.1", reason="auto")
+        await blacklist.flush(compact=True)
+        await blacklist.add_ip("3.3.3.3")
+        await blacklist.add_domain("spam.example")
+        await blacklist.flush()
+        
+        # 外部修改之后没有再写入日志: 手工添加一个IP并修改一个条目
+        def edit(data):
+            data["blocked_ips"]["9.9.9.9"] = dict(data["blocked_ips"]["1.1.1.1"], reason="manual")
+            data["blocked_ips"]["1.1.1.1"]["reason"] = "manual"
+        _edit_snapshot(path, edit)
+        
+        assert await blacklist.reload()
+        assert blacklist.blocked_ips["1.1.1.1"]["reason"] == "manual"
+        assert await blacklist.is_ip_blocked("9.9.9.9")
+        assert await blacklist.is_ip_blocked("3.3.3.3")
+        assert await blacklist.is_domain_blocked("spam.example")
+        blacklist.stop()
+    
+    asyncio.run(run())
+    
+    restarted = Blacklist(str(path), reload_interval=0)
+    assert sorted(restarted.blocked_ips) == ["1.1.1.1", "3.3.3.3", "9.9.9.9"]
+    assert restarted.blocked_ips["1.1.1.1"]["reason"] == "manual"
+    assert "spam.example" in restarted.blocked_domains
+    restarted.stop()
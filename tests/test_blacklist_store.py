@@ -0,0 +1,30 @@
+"""
+黑名单存储的回归测试
+
+功能:
+    - SQLite存储没有快照: 强制压缩时待写入的记录照常写入数据库,重新打开后仍在
+
+运行: python -m pytest tests
+"""
+import asyncio
+
+from core.blacklist import Blacklist
+
+
+def test_sqlite_compact_flush_keeps_pending_records(tmp_path):
+    path = tmp_path / "blacklist.db"
+    
+    async def run():
+        blacklist = Blacklist(str(path), reload_interval=0)
+        await blacklist.add_ip("1.1.1.1", save=False)
+        await blacklist.add_domain("spam.example", save=False)
+        assert await blacklist.flush(compact=True)
+        assert not blacklist._pending
+        blacklist.stop()
+    
+    asyncio.run(run())
+    
+    reopened = Blacklist(str(path), reload_interval=0)
+    assert "1.1.1.1" in reopened.blocked_ips
+    assert "spam.example" in reopened.blocked_domains
+    reopened.stop()
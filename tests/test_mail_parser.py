@@ -0,0 +1,92 @@
+"""
+邮件解析的回归测试
+
+功能:
+    - 7位编码(ISO-2022-JP)的主题和正文按声明的字符集解码
+    - 多部分邮件: 正文/HTML正文取第一个解码后非空的部分(与按需解码之前的解析结果一致)
+    - 只有HTML部分的多部分邮件: body为空, body_is_html为True, 匹配时按HTML转换后的文本
+    - 单部分HTML邮件: body为HTML原文
+
+运行: python -m pytest tests
+"""
+from core.mail_parser import MailParser
+from utils.matcher import MatchContext
+
+
+def test_iso_2022_jp_subject_and_body():
+    body = "認証コードは123456です".encode("iso-2022-jp")
+    assert body.isascii()
+    raw = (
+        b"From: a@example.com\r\n"
+        b"Subject: =?iso-2022-jp?b?GyRCRyc+WiUzITwlSSROJCpDTiRpJDsbKEI=?=\r\n"
+        b"Content-Type: text/plain; charset=ISO-2022-JP\r\n"
+        b"Content-Transfer-Encoding: 7bit\r\n"
+        b"\r\n" + body + b"\r\n"
+    )
+    parsed = MailParser.parse_from_bytes(raw)
+    
+    assert parsed.subject == "認証コードのお知らせ"
+    assert parsed.body.strip() == "認証コードは123456です"
+
+
+def _multipart(*parts) -> bytes:
+    lines = [
+        b"From: Sender <a@example.com>",
+        b"Subject: test",
+        b"MIME-Version: 1.0",
+        b'Content-Type: multipart/alternative; boundary="b1"',
+        b"",
+    ]
+    for content_type, body in parts:
+        lines += [
+            b"--b1",
+            b"Content-Type: " + content_type + b"; charset=utf-8",
+            b"",
+            body,
+        ]
+    lines.append(b"--b1--")
+    return b"\r\n".join(lines) + b"\r\n"
+
+
+def test_multipart_html_only():
+    parsed = MailParser.parse_from_bytes(_multipart((b"text/html", b"<p>Your code is <b>123456</b></p>")))
+    
+    assert parsed.body == ""
+    assert parsed.html_body == "<p>Your code is <b>123456</b></p>"
+    assert parsed.body_is_html is True
+    assert MatchContext(parsed).text("body") == "Your code is 123456"
+
+
+def test_multipart_skips_empty_parts():
+    parsed = MailParser.parse_from_bytes(_multipart(
+        (b"text/plain", b""),
+        (b"text/html", b""),
+        (b"text/plain", b"plain text"),
+        (b"text/html", b"<p>html</p>"),
+    ))
+    
+    assert parsed.body == "plain text"
+    assert parsed.html_body == "<p>html</p>"
+    assert parsed.body_is_html is False
+
+
+def test_multipart_empty_text_part_uses_html():
+    parsed = MailParser.parse_from_bytes(_multipart((b"text/plain", b""), (b"text/html", b"<p>html</p>")))
+    
+    assert parsed.body == ""
+    assert parsed.body_is_html is True
+
+
+def test_single_part_html():
+    raw = (
+        b"From: a@example.com\r\n"
+        b"Subject: test\r\n"
+        b"Content-Type: text/html; charset=utf-8\r\n"
+        b"\r\n"
+        b"<p>hello</p>\r\n"
+    )
+    parsed = MailParser.parse_from_bytes(raw)
+    
+    assert parsed.body == parsed.html_body
+    assert parsed.body_is_html is True
+    assert parsed.to_dict()["body_is_html"] is True
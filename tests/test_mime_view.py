@@ -0,0 +1,139 @@
+"""
+零拷贝MIME扫描的回归测试
+
+功能:
+    - 同一份原始邮件分别用mime_view.scan和email包解析,比较结构和解码后的正文
+    - 覆盖缺少填充的base64、以分隔线开头的正文行、嵌套multipart、按上限截断解码
+
+运行: python -m pytest tests
+"""
+import base64
+import email
+import quopri
+
+import pytest
+
+from core.mime_view import scan
+
+
+def _tree(part):
+    """(内容类型, 解码后的正文或子部分列表)"""
+    if part.is_multipart():
+        return part.get_content_type(), [_tree(child) for child in part.get_payload()]
+    if hasattr(part, "decode_payload"):
+        return part.get_content_type(), part.decode_payload()
+    return part.get_content_type(), part.get_payload(decode=True)
+
+
+def _assert_same_as_email(raw: bytes):
+    assert _tree(scan(raw)) == _tree(email.message_from_bytes(raw))
+
+
+def _single(body: bytes, cte: str) -> bytes:
+    return (
+        b"From: a@example.com\r\n"
+        b"Subject: test\r\n"
+        b"Content-Type: text/plain; charset=utf-8\r\n"
+        b"Content-Transfer-Encoding: " + cte.encode() + b"\r\n"
+        b"\r\n" + body
+    )
+
+
+@pytest.mark.parametrize("body", [
+    b"aGVsbG8gd29ybGQ",            # 缺两个填充字符
+    b"aGVsbG8gd29ybGQ\r\n",
+    b"aGVsbG8gd29y\r\nbGQ",        # 换行后的最后一组不完整
+    b"aGVsbG8gd29ybA",             # 缺一个填充字符
+    b"aGVsbG8gd29ybGQ=",
+    b"aGVsbG8gd29ybGQh",
+])
+def test_base64_without_padding(body):
+    _assert_same_as_email(_single(body, "base64"))
+    assert scan(_single(body, "base64")).decode_payload().startswith(b"hello wor")
+
+
+def test_base64_missing_padding_keeps_trailing_code():
+    encoded = base64.b64encode("验证码: 123456".encode("utf-8")).rstrip(b"=")
+    assert scan(_single(encoded, "base64")).decode_payload().decode("utf-8").endswith("123456")
+
+
+def test_boundary_prefix_line_is_not_a_delimiter():
+    raw = (
+        b"Content-Type: multipart/mixed; boundary=ab\r\n"
+        b"\r\n"
+        b"--ab\r\n"
+        b"Content-Type: text/plain\r\n"
+        b"\r\n"
+        b"first line\r\n"
+        b"--abc not a boundary\r\n"
+        b"--ab-- neither\r\n"
+        b"code 123456\r\n"
+        b"--ab \t\r\n"
+        b"Content-Type: text/plain\r\n"
+        b"\r\n"
+        b"second part\r\n"
+        b"--ab--\r\n"
+    )
+    _assert_same_as_email(raw)
+    first, second = scan(raw).get_payload()
+    assert first.decode_payload().endswith(b"code 123456")
+    assert second.decode_payload() == b"second part"
+
+
+def test_nested_multipart():
+    html = "<p>验证码 <b>654321</b></p>".encode("utf-8")
+    raw = (
+        b"From: a@example.com\n"
+        b"Content-Type: multipart/mixed; boundary=\"outer\"\n"
+        b"\n"
+        b"preamble\n"
+        b"--outer\n"
+        b"Content-Type: multipart/alternative; boundary=\"inner\"\n"
+        b"\n"
+        b"--inner\n"
+        b"Content-Type: text/plain; charset=utf-8\n"
+        b"Content-Transfer-Encoding: quoted-printable\n"
+        b"\n"
+        + quopri.encodestring("验证码 654321".encode("utf-8")) +
+        b"\n--inner\n"
+        b"Content-Type: text/html; charset=utf-8\n"
+        b"Content-Transfer-Encoding: base64\n"
+        b"\n"
+        + base64.encodebytes(html).rstrip(b"=\n") +
+        b"\n--inner--\n"
+        b"--outer\n"
+        b"Content-Type: application/octet-stream\n"
+        b"Content-Disposition: attachment; filename=a.bin\n"
+        b"Content-Transfer-Encoding: base64\n"
+        b"\n"
+        + base64.encodebytes(bytes(range(256)) * 4) +
+        b"--outer--\n"
+        b"epilogue\n"
+    )
+    _assert_same_as_email(raw)
+    alternative, attachment = scan(raw).get_payload()
+    assert [part.get_content_type() for part in alternative.get_payload()] == ["text/plain", "text/html"]
+    assert alternative.get_payload()[1].decode_payload() == html
+    assert attachment.get_filename() == "a.bin"
+
+
+@pytest.mark.parametrize("cte, encode", [
+    ("base64", base64.encodebytes),
+    ("quoted-printable", quopri.encodestring),
+    ("8bit", lambda data: data),
+])
+@pytest.mark.parametrize("limit", [1, 57, 100, 1000, 4095])
+def test_limit_cut_mid_part(cte, encode, limit):
+    text = "".join(f"第{i}行 verification code {i:06d}\n" for i in range(200)).encode("utf-8")
+    raw = (
+        b"Content-Type: multipart/mixed; boundary=b\r\n"
+        b"\r\n"
+        b"--b\r\n"
+        b"Content-Type: text/plain; charset=utf-8\r\n"
+        b"Content-Transfer-Encoding: " + cte.encode() + b"\r\n"
+        b"\r\n" + encode(text).replace(b"\n", b"\r\n") + b"\r\n"
+        b"--b--\r\n"
+    )
+    _assert_same_as_email(raw)
+    full = email.message_from_bytes(raw).get_payload()[0].get_payload(decode=True)
+    assert scan(raw).get_payload()[0].decode_payload(limit) == full[:limit]
@@ -0,0 +1,114 @@
+"""
+布隆过滤器
+
+功能:
+    - 位数组 + k个哈希位置(由一次哈希拆成两半做双重哈希),判断键"一定不存在"或"可能存在"
+    - 按预计容量和目标误判率确定位数(取2的幂)和哈希个数
+    - 只能添加不能删除: 删除条目后旧的位仍然置位(只会多出误判,不会漏判),由调用方定期重建
+    - 键用Python内置哈希(元组/字符串),过滤器只在本进程内使用,启动时从黑名单重建
+
+调用链:
+    Blacklist._build_indexes / rebuild_filter -> BloomFilter.build
+    Blacklist.add_ip -> BloomFilter.add
+    Blacklist.is_ip_blocked -> BloomFilter.__contains__
+
+输入: 可哈希的键
+输出: 键是否可能存在
+"""
+import math
+from typing import Hashable, Iterable
+
+
+# 最小容量(空黑名单也预留一些空间,避免刚启动时频繁重建)
+MIN_CAPACITY = 1024
+
+
+class BloomFilter:
+    """布隆过滤器(添加由调用方加锁,查找不加锁)"""
+    
+    __slots__ = ("capacity", "fp_rate", "size", "hashes", "count", "bits_set", "_mask", "_bits")
+    
+    def __init__(self, capacity: int, fp_rate: float = 0.01):
+        """
+        输入:
+            capacity: 预计容量(键的个数),超过后误判率上升
+            fp_rate: 达到容量时的目标误判率
+        """
+        self.capacity = max(capacity, MIN_CAPACITY)
+        self.fp_rate = fp_rate
+        bits = -self.capacity * math.log(fp_rate) / (math.log(2) ** 2)
+        # 位数取2的幂: 取模改为按位与
+        self.size = 1 << max(6, math.ceil(math.log2(bits)))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self.bits_set = 0
+        self._mask = self.size - 1
+        self._bits = bytearray(self.size // 8)
+    
+    @classmethod
+    def build(cls, keys: Iterable[Hashable], fp_rate: float = 0.01, headroom: float = 2.0) -> "BloomFilter":
+        """
+        从一组键构建(容量按键数留出余量,之后的添加不会很快超出)
+        
+        输入:
+            keys: 键
+            fp_rate: 目标误判率
+            headroom: 容量相对当前键数的倍数
+            
+        输出:
+            过滤器
+        """
+        keys = list(keys)
+        bloom = cls(int(len(keys) * headroom), fp_rate)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+    
+    def __len__(self) -> int:
+        """添加过的键数(含重复添加)"""
+        return self.count
+    
+    def add(self, key: Hashable):
+        """
+        添加键
+        
+        输入:
+            key: 键(元组或字符串)
+        """
+        h = hash(key)
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        mask = self._mask
+        bits = self._bits
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) & mask
+            byte = pos >> 3
+            bit = 1 << (pos & 7)
+            if not bits[byte] & bit:
+                bits[byte] |= bit
+                self.bits_set += 1
+        self.count += 1
+    
+    def __contains__(self, key: Hashable) -> bool:
+        h = hash(key)
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        mask = self._mask
+        bits = self._bits
+        # 大多数不存在的键在第一个位置就能判定
+        pos = h1 & mask
+        if not bits[pos >> 3] & (1 << (pos & 7)):
+            return False
+        for i in range(1, self.hashes):
+            pos = (h1 + i * h2) & mask
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+    
+    def estimated_fp_rate(self) -> float:
+        """按已置位比例估算的当前误判率(含已删除键留下的位)"""
+        return (self.bits_set / self.size) ** self.hashes
+    
+    def nbytes(self) -> int:
+        """位数组占用的字节数"""
+        return len(self._bits)
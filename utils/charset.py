@@ -0,0 +1,161 @@
+"""
+字符集解码
+
+功能:
+    - 纯ASCII内容且字符集兼容ASCII时直接解码(ISO-2022-JP/HZ/UTF-7等7位编码按声明的字符集解码)
+    - 声明的字符集 -> UTF-8 -> GB18030 依次严格解码,都失败时按声明字符集忽略错误解码
+    - 字符集名称到编解码器的查找按名称缓存(gb2312/gbk统一按超集GB18030解码)
+    - 头部值没有编码字(=?...?=)时不调用decode_header;有编码字的值LRU缓存
+      (通知类邮件的发件人/主题大量重复)
+
+调用链:
+    MailParser._decode_header_value -> decode_header_value
+    MailParser._get_email_body -> decode_bytes
+
+输入: 原始字节/头部值 + 声明的字符集
+输出: 解码后的字符串
+"""
+import codecs
+from email.header import decode_header
+from functools import lru_cache
+from typing import Optional
+
+
+# 常见字符集别名: 按超集解码,避免声明为gb2312但包含GBK/GB18030字符时解码失败
+_ALIASES = {
+    "gb2312": "gb18030",
+    "gbk": "gb18030",
+    "x-gbk": "gb18030",
+    "cp936": "gb18030",
+    "ascii": "utf-8",
+    "us-ascii": "utf-8",
+}
+
+# 声明的字符集解码失败时依次尝试
+_FALLBACKS = ("utf-8", "gb18030")
+
+# 7位有状态编码: 内容全是ASCII字节,由转义序列切换字符集
+_STATEFUL_PREFIXES = ("iso2022", "hz", "utf-7")
+
+_ASCII_BYTES = bytes(range(128))
+
+
+@lru_cache(maxsize=128)
+def _lookup(charset: str) -> Optional[str]:
+    """
+    查找字符集对应的编解码器名称(按名称缓存)
+    
+    输入:
+        charset: 字符集名称(任意大小写)
+        
+    输出:
+        规范化的编解码器名称,未知字符集返回None
+    """
+    name = charset.strip().strip('"').lower()
+    name = _ALIASES.get(name, name)
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+@lru_cache(maxsize=128)
+def _ascii_compatible(codec: str) -> bool:
+    """
+    纯ASCII字节按该编解码器解码是否与ASCII相同(按名称缓存)
+    
+    输入:
+        codec: 规范化的编解码器名称
+        
+    输出:
+        True: 纯ASCII内容可以直接解码
+    """
+    if codec.startswith(_STATEFUL_PREFIXES):
+        return False
+    try:
+        return _ASCII_BYTES.decode(codec) == _ASCII_BYTES.decode("ascii")
+    except UnicodeDecodeError:
+        return False
+
+
+def decode_bytes(data: bytes, charset: Optional[str] = None) -> str:
+    """
+    按声明的字符集解码字节
+    
+    输入:
+        data: 原始字节
+        charset: 声明的字符集(可为None)
+        
+    输出:
+        解码后的字符串(不会抛出异常)
+    """
+    if not data:
+        return ""
+    declared = _lookup(charset) if charset else None
+    if data.isascii() and (declared is None or _ascii_compatible(declared)):
+        return data.decode("ascii")
+    
+    for name in (declared,) + _FALLBACKS:
+        if name is None:
+            continue
+        try:
+            return data.decode(name)
+        except UnicodeDecodeError:
+            continue
+    
+    return data.decode(declared or "utf-8", errors="ignore")
+
+
+def _join_parts(parts) -> str:
+    """拼接decode_header的结果"""
+    result = []
+    for part, encoding in parts:
+        if isinstance(part, bytes):
+            result.append(decode_bytes(part, encoding))
+        else:
+            result.append(part)
+    return "".join(result)
+
+
+@lru_cache(maxsize=1024)
+def _decode_encoded_words(value: str) -> str:
+    """解码包含编码字的头部值(LRU缓存)"""
+    return _join_parts(decode_header(value))
+
+
+def decode_header_value(value) -> str:
+    """
+    解码邮件头部值(处理MIME编码字)
+    
+    输入:
+        value: 邮件头部原始值(字符串;含8位原始字节时email包返回Header对象)
+        
+    输出:
+        解码后的字符串
+    """
+    if not value:
+        return ""
+    try:
+        if not isinstance(value, str):
+            return _join_parts(decode_header(value))
+        if "=?" not in value:
+            return value
+        return _decode_encoded_words(value)
+    except Exception:
+        # 畸形编码字: 原样返回
+        return str(value)
+
+
+def get_cache_info() -> dict:
+    """
+    获取缓存统计
+    
+    输出:
+        字符集查找和头部值缓存的命中/未命中次数
+    """
+    lookup = _lookup.cache_info()
+    headers = _decode_encoded_words.cache_info()
+    return {
+        "charset_lookup": {"hits": lookup.hits, "misses": lookup.misses, "size": lookup.currsize},
+        "header_values": {"hits": headers.hits, "misses": headers.misses, "size": headers.currsize},
+    }
@@ -0,0 +1,135 @@
+"""
+域名后缀树
+
+功能:
+    - 按反转的标签(com -> example -> mail)存储域名,一个条目覆盖它的所有子域名
+    - 查找返回最长(最具体)的匹配后缀,成本与域名的标签数成正比,与条目数量无关
+
+调用链:
+    Blacklist.add_domain/remove_domain/learn_whitelist_domain -> DomainTrie.add/remove
+    Blacklist.is_domain_blocked / auto_block_stranger -> DomainTrie.match
+
+输入: 域名
+输出: 匹配的最长后缀(已添加的域名)
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+def normalize_domain(domain: str) -> str:
+    """
+    规范化域名(小写,去掉首尾空白和末尾的点)
+    
+    输入:
+        domain: 域名
+        
+    输出:
+        规范化的域名
+    """
+    return domain.strip().rstrip(".").lower()
+
+
+class _Node:
+    """后缀树节点"""
+    
+    __slots__ = ("children", "domain")
+    
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # 以该节点结尾的已添加域名
+        self.domain: Optional[str] = None
+
+
+class DomainTrie:
+    """域名集合(最长后缀匹配)"""
+    
+    def __init__(self):
+        self._root = _Node()
+        self._size = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def __contains__(self, domain: str) -> bool:
+        node = self._root
+        for label in reversed(normalize_domain(domain).split(".")):
+            node = node.children.get(label)
+            if node is None:
+                return False
+        return node.domain is not None
+    
+    def __iter__(self) -> Iterator[str]:
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node.domain is not None:
+                yield node.domain
+            stack.extend(node.children.values())
+    
+    def add(self, domain: str):
+        """
+        添加域名(同时覆盖其所有子域名)
+        
+        输入:
+            domain: 域名
+        """
+        domain = normalize_domain(domain)
+        node = self._root
+        for label in reversed(domain.split(".")):
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = _Node()
+            node = child
+        if node.domain is None:
+            self._size += 1
+        node.domain = domain
+    
+    def remove(self, domain: str) -> bool:
+        """
+        移除域名(不影响单独添加的子域名)
+        
+        输入:
+            domain: 域名
+            
+        输出:
+            True: 已移除, False: 不存在
+        """
+        path: List[Tuple[_Node, str]] = []
+        node = self._root
+        for label in reversed(normalize_domain(domain).split(".")):
+            child = node.children.get(label)
+            if child is None:
+                return False
+            path.append((node, label))
+            node = child
+        if node.domain is None:
+            return False
+        
+        node.domain = None
+        self._size -= 1
+        
+        # 清理不再有用的节点
+        while path and node.domain is None and not node.children:
+            parent, label = path.pop()
+            del parent.children[label]
+            node = parent
+        return True
+    
+    def match(self, domain: str) -> Optional[str]:
+        """
+        查找域名的最长已添加后缀
+        
+        输入:
+            domain: 域名(如 a1.spam.example)
+            
+        输出:
+            匹配的域名(如 spam.example),没有匹配时返回None
+        """
+        node = self._root
+        best = None
+        for label in reversed(normalize_domain(domain).split(".")):
+            node = node.children.get(label)
+            if node is None:
+                break
+            if node.domain is not None:
+                best = node.domain
+        return best
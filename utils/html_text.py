@@ -0,0 +1,91 @@
+"""
+HTML转纯文本
+
+功能:
+    - 基于标准库html.parser的流式解析,不构建DOM
+    - 跳过script/style/head等不可见内容,丢弃标签和属性(CSS、跟踪链接)
+    - 块级标签转为换行,合并多余空白,实体自动解码
+
+调用链:
+    MatchContext.text(body) -> 只有HTML正文的邮件首次需要body时 -> html_to_text
+
+输入: HTML字符串
+输出: 可见文本
+"""
+import re
+from html.parser import HTMLParser
+from typing import List
+
+
+# 内容不可见的标签
+_SKIP_TAGS = frozenset({"script", "style", "head", "noscript", "template", "svg"})
+
+# 产生换行的块级标签
+_BLOCK_TAGS = frozenset({
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt",
+    "fieldset", "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4",
+    "h5", "h6", "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section",
+    "table", "tbody", "td", "tfoot", "th", "thead", "title", "tr", "ul"
+})
+
+# 每次送入解析器的长度
+_CHUNK_SIZE = 64 * 1024
+
+_SPACES_RE = re.compile(r"[ \t\r\f\v\xa0]+")
+_NEWLINES_RE = re.compile(r"\s*\n\s*")
+
+
+class _TextExtractor(HTMLParser):
+    """收集可见文本的解析器"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks: List[str] = []
+        self._skip_depth = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.chunks.append("\n")
+    
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self.chunks.append("\n")
+    
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            if self._skip_depth:
+                self._skip_depth -= 1
+        elif tag in _BLOCK_TAGS:
+            self.chunks.append("\n")
+    
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.chunks.append(data)
+
+
+def html_to_text(html: str) -> str:
+    """
+    提取HTML中的可见文本
+    
+    输入:
+        html: HTML字符串
+        
+    输出:
+        纯文本(块级元素之间换行,多余空白已合并)
+    """
+    if not html:
+        return ""
+    
+    parser = _TextExtractor()
+    try:
+        for start in range(0, len(html), _CHUNK_SIZE):
+            parser.feed(html[start:start + _CHUNK_SIZE])
+        parser.close()
+    except Exception:
+        # 畸形HTML: 保留已解析出的文本
+        pass
+    
+    text = _SPACES_RE.sub(" ", "".join(parser.chunks))
+    return _NEWLINES_RE.sub("\n", text).strip()
@@ -0,0 +1,358 @@
+"""
+IP区间表(批量导入的第三方黑名单)
+
+功能:
+    - 从本地文件加载IP黑名单源(每行一个地址/CIDR网段/"起始-结束"区间,#或;之后为注释)
+    - 区间按起始地址排序并合并重叠/相邻的区间,IPv4存在两个array('I')中(每个区间8字节),
+      IPv6存为整数列表;查找用bisect,成本O(log n)
+    - 每个源一张表,重新加载在线程中构建新表,构建完成后整体替换(查找方看到的总是完整的表)
+    - 批量查找: 地址排序后与区间表同步扫描一遍
+
+调用链:
+    Blacklist.start -> IPRangeFeeds.reload(线程中构建) -> 替换
+    Blacklist.is_ip_blocked -> IPRangeFeeds.lookup
+    Blacklist.check_ips -> IPRangeFeeds.lookup_many
+
+输入: 黑名单源文件 / IP地址
+输出: 包含该地址的源名称
+"""
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.ip_trie import IPAddress, parse_address
+
+
+logger = logging.getLogger(__name__)
+
+
+def _ipv4_int(value: str) -> Optional[int]:
+    """快速解析点分十进制IPv4地址(不是IPv4时返回None)"""
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, value), "big")
+    except OSError:
+        return None
+
+
+def parse_range(text: str) -> Optional[Tuple[int, int, int]]:
+    """
+    解析一行中的地址/网段/区间
+    
+    输入:
+        text: "1.2.3.4" / "1.2.3.0/24" / "1.2.3.0-1.2.3.255" / IPv6同理
+        
+    输出:
+        (版本, 起始整数, 结束整数),无法解析时返回None
+    """
+    if "-" in text:
+        first, _, last = text.partition("-")
+        start, end = parse_address(first), parse_address(last)
+        if start is None or end is None or start.version != end.version or int(start) > int(end):
+            return None
+        return start.version, int(start), int(end)
+    
+    address, _, prefix = text.partition("/")
+    value = _ipv4_int(address)
+    if value is not None:
+        # IPv4快速路径
+        if not prefix:
+            return 4, value, value
+        if not prefix.isdigit() or int(prefix) > 32:
+            return None
+        host_bits = 32 - int(prefix)
+        start = value >> host_bits << host_bits
+        return 4, start, start | ((1 << host_bits) - 1)
+    
+    try:
+        network = ipaddress.ip_network(text, strict=False)
+    except ValueError:
+        return None
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+def _merge(ranges: List[Tuple[int, int]]) -> Tuple[List[int], List[int]]:
+    """排序并合并重叠/相邻的区间"""
+    ranges.sort()
+    starts: List[int] = []
+    ends: List[int] = []
+    for start, end in ranges:
+        if ends and start <= ends[-1] + 1:
+            if end > ends[-1]:
+                ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
+class IPRangeTable:
+    """一个黑名单源的区间表(构建后只读)"""
+    
+    __slots__ = ("name", "entries", "_starts4", "_ends4", "_starts6", "_ends6")
+    
+    def __init__(self, name: str, entries: int, v4: Tuple[List[int], List[int]], v6: Tuple[List[int], List[int]]):
+        """
+        输入:
+            name: 源名称
+            entries: 源中的有效条目数
+            v4: 合并后的IPv4区间(起始列表, 结束列表)
+            v6: 合并后的IPv6区间
+        """
+        self.name = name
+        self.entries = entries
+        self._starts4 = array("I", v4[0])
+        self._ends4 = array("I", v4[1])
+        self._starts6 = v6[0]
+        self._ends6 = v6[1]
+    
+    @classmethod
+    def from_lines(cls, name: str, lines: Iterable[str]) -> "IPRangeTable":
+        """
+        从文本行构建
+        
+        输入:
+            name: 源名称
+            lines: 每行一个条目(#或;之后为注释,空白后的内容忽略)
+            
+        输出:
+            区间表
+        """
+        v4: List[Tuple[int, int]] = []
+        v6: List[Tuple[int, int]] = []
+        invalid = 0
+        for line in lines:
+            text = line.split("#", 1)[0].split(";", 1)[0].strip()
+            if not text:
+                continue
+            parsed = parse_range(text.split()[0])
+            if parsed is None:
+                invalid += 1
+                continue
+            version, start, end = parsed
+            (v4 if version == 4 else v6).append((start, end))
+        
+        if invalid:
+            logger.warning(f"IP黑名单源 {name}: 跳过{invalid}行无法解析的内容")
+        return cls(name, len(v4) + len(v6), _merge(v4), _merge(v6))
+    
+    @classmethod
+    def load(cls, path: Path) -> "IPRangeTable":
+        """
+        从文件构建
+        
+        输入:
+            path: 源文件路径
+            
+        输出:
+            区间表(名称为文件名)
+        """
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return cls.from_lines(Path(path).name, f)
+    
+    def __len__(self) -> int:
+        """合并后的区间数"""
+        return len(self._starts4) + len(self._starts6)
+    
+    def _arrays(self, version: int):
+        return (self._starts4, self._ends4) if version == 4 else (self._starts6, self._ends6)
+    
+    def contains(self, address: IPAddress) -> bool:
+        """
+        检查地址是否在某个区间内
+        
+        输入:
+            address: 已解析的地址
+            
+        输出:
+            True: 在区间内
+        """
+        starts, ends = self._arrays(address.version)
+        value = int(address)
+        index = bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+    
+    def contains_sorted(self, version: int, values: List[int]) -> List[bool]:
+        """
+        批量检查(地址已排序): 与区间表同步扫描
+        
+        输入:
+            version: 地址版本
+            values: 升序的地址整数
+            
+        输出:
+            每个地址是否在区间内
+        """
+        starts, ends = self._arrays(version)
+        result = []
+        index = -1
+        count = len(starts)
+        for value in values:
+            # 区间数远多于地址时用bisect跳转,否则逐个前进
+            if index + 1 < count and starts[index + 1] <= value:
+                index = bisect_right(starts, value, index + 1) - 1
+            result.append(index >= 0 and value <= ends[index])
+        return result
+    
+    def nbytes(self) -> int:
+        """区间数据占用的字节数(IPv6按每个整数32字节估算)"""
+        return (
+            self._starts4.itemsize * (len(self._starts4) + len(self._ends4))
+            + 32 * (len(self._starts6) + len(self._ends6))
+        )
+
+
+class IPRangeFeeds:
+    """一组IP黑名单源(按文件修改时间增量重新加载,整体替换)"""
+    
+    def __init__(self, paths: Iterable[str] = ()):
+        """
+        输入:
+            paths: 源文件路径
+        """
+        self.paths = [Path(path) for path in paths]
+        # 源名称 -> 区间表;重新加载时替换整个字典,不原地修改
+        self._tables: Dict[str, IPRangeTable] = {}
+        self._mtimes: Dict[Path, float] = {}
+        self._reload_lock = asyncio.Lock()
+        self.reloads = 0
+        self.last_reload_at: Optional[str] = None
+    
+    def __len__(self) -> int:
+        """所有源的区间总数"""
+        return sum(len(table) for table in self._tables.values())
+    
+    def _build(self, force: bool) -> Optional[Dict[str, IPRangeTable]]:
+        """
+        构建新的表集合(在线程中运行);文件未变化的源沿用旧表
+        
+        输入:
+            force: 忽略修改时间,全部重新加载
+            
+        输出:
+            新的表集合,没有变化时返回None
+        """
+        tables: Dict[str, IPRangeTable] = {}
+        mtimes: Dict[Path, float] = {}
+        changed = set(self._mtimes) != set(path for path in self.paths if path.exists())
+        for path in self.paths:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                # 只在启动/强制加载或文件消失时提示一次
+                if force or path in self._mtimes:
+                    logger.warning(f"IP黑名单源不存在: {path}")
+                continue
+            mtimes[path] = mtime
+            old = self._tables.get(path.name)
+            if not force and old is not None and self._mtimes.get(path) == mtime:
+                tables[path.name] = old
+                continue
+            try:
+                tables[path.name] = IPRangeTable.load(path)
+                changed = True
+            except Exception as e:
+                logger.error(f"加载IP黑名单源失败: {path}: {e}")
+                if old is not None:
+                    tables[path.name] = old
+                    mtimes[path] = self._mtimes[path]
+        
+        self._mtimes = mtimes
+        return tables if changed or force else None
+    
+    def load(self):
+        """同步加载全部源(启动时)"""
+        self._tables = self._build(force=True) or {}
+        self._log_loaded()
+    
+    async def reload(self, force: bool = False) -> bool:
+        """
+        在线程中重新加载变化的源,完成后整体替换
+        
+        输入:
+            force: 忽略修改时间,全部重新加载
+            
+        输出:
+            True: 有源被重新加载
+        """
+        async with self._reload_lock:
+            tables = await asyncio.to_thread(self._build, force)
+            if tables is None:
+                return False
+            self._tables = tables
+            self.reloads += 1
+            self._log_loaded()
+            return True
+    
+    def _log_loaded(self):
+        self.last_reload_at = datetime.now().isoformat()
+        if self._tables:
+            logger.info(
+                f"已加载IP黑名单源: {len(self._tables)}个, "
+                f"{sum(table.entries for table in self._tables.values())}个条目, "
+                f"合并为{len(self)}个区间"
+            )
+    
+    def lookup(self, address: IPAddress) -> Optional[str]:
+        """
+        查找包含地址的源
+        
+        输入:
+            address: 已解析的地址
+            
+        输出:
+            源名称,不在任何源中时返回None
+        """
+        for name, table in self._tables.items():
+            if table.contains(address):
+                return name
+        return None
+    
+    def lookup_many(self, addresses: List[Optional[IPAddress]]) -> List[Optional[str]]:
+        """
+        批量查找
+        
+        输入:
+            addresses: 已解析的地址(None表示无效地址)
+            
+        输出:
+            每个地址所在的源名称(不在任何源中或地址无效为None)
+        """
+        result: List[Optional[str]] = [None] * len(addresses)
+        tables = self._tables
+        for version in (4, 6):
+            order = sorted(
+                (i for i, address in enumerate(addresses) if address is not None and address.version == version),
+                key=lambda i: int(addresses[i])
+            )
+            if not order:
+                continue
+            values = [int(addresses[i]) for i in order]
+            for name, table in tables.items():
+                for i, hit in zip(order, table.contains_sorted(version, values)):
+                    if hit and result[i] is None:
+                        result[i] = name
+        return result
+    
+    def get_stats(self) -> Dict:
+        """
+        获取统计
+        
+        输出:
+            每个源的条目数/区间数/占用字节数,重新加载次数
+        """
+        return {
+            "feeds": {
+                name: {"entries": table.entries, "ranges": len(table), "bytes": table.nbytes()}
+                for name, table in self._tables.items()
+            },
+            "ranges": len(self),
+            "reloads": self.reloads,
+            "last_reload_at": self.last_reload_at
+        }
@@ -0,0 +1,318 @@
+"""
+IP网段前缀树
+
+功能:
+    - 压缩前缀树(patricia): 地址转为整数,节点保存前缀的值和长度,只有分叉处才有节点
+    - IPv4和IPv6各一棵树,查找按位比较,成本与前缀长度成正比,与网段数量无关
+    - 查找返回包含地址的最长(最具体)网段
+    - IPv4映射的IPv6地址(::ffff:a.b.c.d)按IPv4查找
+
+调用链:
+    Blacklist.add_ip/remove_ip -> parse_ip_or_network -> IPTrie.add/remove
+    Blacklist.is_ip_blocked -> IPTrie.lookup
+    Blacklist.is_ip_blocked(过滤器) -> address_value + IPTrie.prefix_lengths
+
+输入: 网段(CIDR) / IP地址
+输出: 包含该地址的网段
+"""
+import ipaddress
+import socket
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_address(value: str) -> Optional[IPAddress]:
+    """
+    解析IP地址(IPv4映射的IPv6地址转为IPv4)
+    
+    输入:
+        value: IP地址字符串
+        
+    输出:
+        地址对象,不是合法地址时返回None
+    """
+    try:
+        address = ipaddress.ip_address(value.strip())
+    except ValueError:
+        return None
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+
+def address_value(value: str) -> Optional[Tuple[int, int]]:
+    """
+    IP地址转为(版本, 整数)(常见写法用inet_pton解析,不构造ipaddress对象;IPv4映射地址按IPv4)
+    
+    输入:
+        value: IP地址字符串
+        
+    输出:
+        (4或6, 地址整数),不是合法地址时返回None
+    """
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, value), "big")
+    except OSError:
+        pass
+    try:
+        number = int.from_bytes(socket.inet_pton(socket.AF_INET6, value), "big")
+    except OSError:
+        # 带空白、带scope等其他写法
+        address = parse_address(value)
+        if address is None:
+            return None
+        return address.version, int(address)
+    if number >> 32 == 0xFFFF:
+        return 4, number & 0xFFFFFFFF
+    return 6, number
+
+
+def parse_ip_or_network(value: str) -> str:
+    """
+    规范化IP地址或网段
+    
+    输入:
+        value: IP地址或CIDR网段(主机位可以不为0,如1.2.3.4/24)
+        
+    输出:
+        规范化的字符串: 单个地址(含/32、/128)为地址本身,网段为"网络地址/前缀长度"
+        
+    异常:
+        ValueError: 不是合法的地址或网段
+    """
+    value = value.strip()
+    if "/" not in value:
+        address = parse_address(value)
+        if address is None:
+            raise ValueError(f"无效的IP地址: {value}")
+        return str(address)
+    
+    network = ipaddress.ip_network(value, strict=False)
+    if network.version == 6 and network.prefixlen >= 96 and network.network_address.ipv4_mapped is not None:
+        network = ipaddress.ip_network(
+            f"{network.network_address.ipv4_mapped}/{network.prefixlen - 96}", strict=False
+        )
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+class _Node:
+    """前缀树节点"""
+    
+    __slots__ = ("value", "length", "key", "children")
+    
+    def __init__(self, value: int, length: int, key: Optional[str] = None):
+        """
+        输入:
+            value: 前缀(整数,低位为0)
+            length: 前缀长度
+            key: 网段字符串(只有插入过的网段有,分叉节点为None)
+        """
+        self.value = value
+        self.length = length
+        self.key = key
+        self.children: List[Optional["_Node"]] = [None, None]
+
+
+def _bit(value: int, index: int, width: int) -> int:
+    """取第index位(从最高位开始计数)"""
+    return (value >> (width - 1 - index)) & 1
+
+
+def _common_length(a: int, b: int, limit: int, width: int) -> int:
+    """两个前缀在前limit位中相同的位数"""
+    diff = (a ^ b) >> (width - limit)
+    return limit - diff.bit_length()
+
+
+def _mask(value: int, length: int, width: int) -> int:
+    """保留前length位"""
+    return value >> (width - length) << (width - length) if length else 0
+
+
+class _Tree:
+    """一种地址族的前缀树"""
+    
+    __slots__ = ("width", "root", "size", "_lengths", "lengths")
+    
+    def __init__(self, width: int):
+        self.width = width
+        self.root = _Node(0, 0)
+        self.size = 0
+        # 每种前缀长度的网段数;lengths为出现过的长度(变化时整体替换,查找方不加锁读取)
+        self._lengths: Dict[int, int] = {}
+        self.lengths: Tuple[int, ...] = ()
+    
+    def _count(self, length: int, delta: int):
+        """更新前缀长度的网段数"""
+        count = self._lengths.get(length, 0) + delta
+        if count:
+            self._lengths[length] = count
+        else:
+            del self._lengths[length]
+        # 出现新的长度或某种长度的网段全部删除
+        if count == 0 or (count == 1 and delta > 0):
+            self.lengths = tuple(sorted(self._lengths))
+    
+    def insert(self, value: int, length: int, key: str):
+        """插入前缀(已存在时更新key)"""
+        width = self.width
+        node = self.root
+        while True:
+            if length == node.length:
+                if node.key is None:
+                    self.size += 1
+                    self._count(length, 1)
+                node.key = key
+                return
+            
+            bit = _bit(value, node.length, width)
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _Node(value, length, key)
+                self.size += 1
+                self._count(length, 1)
+                return
+            
+            common = _common_length(value, child.value, min(length, child.length), width)
+            if common == child.length:
+                node = child
+                continue
+            
+            # 在分歧处拆分: 先构造完整的新子树再挂上去(并发查找看到的总是完整结构)
+            if common == length:
+                new = _Node(value, length, key)
+                new.children[_bit(child.value, length, width)] = child
+            else:
+                new = _Node(_mask(value, common, width), common)
+                new.children[_bit(child.value, common, width)] = child
+                new.children[_bit(value, common, width)] = _Node(value, length, key)
+            node.children[bit] = new
+            self.size += 1
+            self._count(length, 1)
+            return
+    
+    def delete(self, value: int, length: int) -> bool:
+        """删除前缀,返回是否存在"""
+        width = self.width
+        path: List[Tuple[_Node, int]] = []
+        node = self.root
+        while node.length < length:
+            bit = _bit(value, node.length, width)
+            child = node.children[bit]
+            if child is None or child.length > length or \
+                    _common_length(value, child.value, child.length, width) != child.length:
+                return False
+            path.append((node, bit))
+            node = child
+        if node.length != length or node.key is None:
+            return False
+        
+        node.key = None
+        self.size -= 1
+        self._count(length, -1)
+        
+        # 压缩: 去掉没有key且子节点少于两个的节点
+        while path and node.key is None:
+            parent, bit = path.pop()
+            kids = [c for c in node.children if c is not None]
+            if len(kids) == 2:
+                break
+            parent.children[bit] = kids[0] if kids else None
+            node = parent
+        return True
+    
+    def lookup(self, value: int) -> Optional[str]:
+        """最长前缀匹配"""
+        width = self.width
+        node = self.root
+        best = node.key
+        while node.length < width:
+            child = node.children[_bit(value, node.length, width)]
+            if child is None or (value ^ child.value) >> (width - child.length):
+                break
+            node = child
+            if node.key is not None:
+                best = node.key
+        return best
+    
+    def keys(self) -> Iterator[str]:
+        """遍历所有网段"""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.key is not None:
+                yield node.key
+            stack.extend(c for c in node.children if c is not None)
+
+
+class IPTrie:
+    """IPv4/IPv6网段集合(最长前缀匹配)"""
+    
+    def __init__(self):
+        self._trees: Dict[int, _Tree] = {4: _Tree(32), 6: _Tree(128)}
+    
+    def __len__(self) -> int:
+        return sum(tree.size for tree in self._trees.values())
+    
+    def __iter__(self) -> Iterator[str]:
+        for tree in self._trees.values():
+            yield from tree.keys()
+    
+    @staticmethod
+    def _network(cidr: str) -> IPNetwork:
+        return ipaddress.ip_network(cidr, strict=False)
+    
+    def add(self, cidr: str):
+        """
+        添加网段
+        
+        输入:
+            cidr: 规范化的网段(parse_ip_or_network的结果)
+        """
+        network = self._network(cidr)
+        self._trees[network.version].insert(int(network.network_address), network.prefixlen, cidr)
+    
+    def remove(self, cidr: str) -> bool:
+        """
+        移除网段
+        
+        输入:
+            cidr: 规范化的网段
+            
+        输出:
+            True: 已移除, False: 不存在
+        """
+        network = self._network(cidr)
+        return self._trees[network.version].delete(int(network.network_address), network.prefixlen)
+    
+    def prefix_lengths(self, version: int) -> Tuple[int, ...]:
+        """
+        已添加网段的前缀长度
+        
+        输入:
+            version: 地址版本(4/6)
+            
+        输出:
+            升序的前缀长度
+        """
+        return self._trees[version].lengths
+    
+    def lookup(self, ip: Union[str, IPAddress]) -> Optional[str]:
+        """
+        查找包含地址的最具体网段
+        
+        输入:
+            ip: IP地址(字符串或已解析的地址)
+            
+        输出:
+            网段字符串,没有匹配或地址无效时返回None
+        """
+        address = parse_address(ip) if isinstance(ip, str) else ip
+        if address is None:
+            return None
+        return self._trees[address.version].lookup(int(address))
@@ -0,0 +1,388 @@
+"""
+多进程匹配引擎(可选)
+
+功能:
+    - 将规则集匹配分发到进程池,利用多核处理正则密集型负载
+    - 按(邮件, 规则集)分片,一封邮件的多个规则集可在多个进程中并行匹配
+    - 工作进程按指纹缓存已编译的规则集,连接增减时增量更新
+    - 规则集只下发指纹,首次使用或工作进程缓存未命中时才下发规范化JSON
+    - 每封邮件只序列化一次,正文/HTML为主进程截取好的扫描窗口(大小由配置而非邮件决定)
+    - 通过run_in_executor异步收集结果,不阻塞SMTP/WebSocket事件循环
+    - 工作进程随结果返回谓词统计和各节点求值/匹配次数的增量,主进程合并后
+      /api/matcher/stats和规则排序用到的选择率与单进程匹配时一致
+
+调用链:
+    main.lifespan -> init_match_engine -> MatchEngine.start
+    smtp_server收到邮件 -> MatchEngine.evaluate -> 结果写入MatchContext
+    -> MatchPlan.evaluate直接复用结果
+    MatchEngine.evaluate -> MatcherStats.merge / MatchPlan.add_counters(合并工作进程统计)
+
+输入: MatchContext + 需要匹配的规则集
+输出: 匹配结果写入MatchContext.results / MatchContext.extracted
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import pickle
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from schemas.request import MatchRule
+from utils.matcher import (
+    WINDOWED_FIELDS, EmailMatcher, MatchContext, MatchPlan, get_matcher_stats, get_rule_registry
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# 正文/HTML不限制扫描长度时发送的原始字段(body_text已转换时一并发送,避免工作进程重复转换)
+_FULL_SOURCES = {
+    "body": ("body", "html_body", "body_is_html", "body_text"),
+    "html": ("html_body",),
+}
+
+# 工作进程内的计划缓存: {指纹: MatchPlan}
+_worker_plans: "OrderedDict[str, MatchPlan]" = OrderedDict()
+_worker_max_plans = 1024
+
+
+def _init_worker(max_scan_bytes: int, scan_mode: str, max_plans: int):
+    """工作进程初始化: 同步扫描窗口配置"""
+    global _worker_max_plans
+    EmailMatcher.configure(max_scan_bytes=max_scan_bytes, scan_mode=scan_mode)
+    _worker_max_plans = max_plans
+
+
+def _ping() -> bool:
+    """预热工作进程"""
+    return True
+
+
+class _ShippedContext(MatchContext):
+    """
+    工作进程侧的匹配上下文
+    
+    正文/HTML只有主进程截取好的扫描窗口,代价估算使用主进程提供的全文长度
+    """
+    
+    __slots__ = ("_lengths",)
+    
+    def __init__(self, fields: Dict[str, Any], windows: Dict[Tuple[str, int, str], str], lengths: Dict[str, int]):
+        """
+        输入:
+            fields: 邮件字段(发件人/主题,以及不限制扫描长度的正文)
+            windows: {(字段, 最大扫描长度, 扫描模式): 窗口内容}
+            lengths: {字段: 全文长度}
+        """
+        super().__init__(fields)
+        self._windows.update(windows)
+        self._lengths = lengths
+    
+    def text(self, field: str, limit: int = 0, mode: str = "head") -> str:
+        window = self._windows.get((field, limit, mode))
+        if window is not None:
+            return window
+        return super().text(field, limit, mode)
+    
+    def length(self, field: str, limit: int = 0) -> int:
+        length = self._lengths.get(field)
+        if length is None:
+            return super().length(field, limit)
+        return min(length, limit) if limit else length
+
+
+def _ship_email(ctx: MatchContext, plans: List[MatchPlan]) -> bytes:
+    """
+    构建发送给工作进程的邮件数据(每封邮件一次)
+    
+    只包含规则集用到的字段;正文/HTML只发送各规则集扫描窗口内的内容,
+    有规则集不限制扫描长度时才发送全文
+    
+    输入:
+        ctx: 邮件匹配上下文
+        plans: 需要匹配的规则集
+        
+    输出:
+        序列化后的(fields, windows, lengths),各分片共用
+    """
+    needed = set()
+    for plan in plans:
+        needed |= plan.windows()
+    
+    fields: Dict[str, Any] = {}
+    windows: Dict[Tuple[str, int, str], str] = {}
+    lengths: Dict[str, int] = {}
+    full = {field for field, limit, _ in needed if field in WINDOWED_FIELDS and not limit}
+    for field, limit, mode in needed:
+        if field not in WINDOWED_FIELDS:
+            fields[field] = ctx.email_data.get(field)
+        elif field not in full:
+            windows[(field, limit, mode)] = ctx.text(field, limit, mode)
+            lengths[field] = ctx.length(field)
+    for field in full:
+        for name in _FULL_SOURCES[field]:
+            fields[name] = ctx.email_data.get(name)
+    return pickle.dumps((fields, windows, lengths), pickle.HIGHEST_PROTOCOL)
+
+
+def _worker_plan(fingerprint: str, spec: Optional[str]) -> Optional[MatchPlan]:
+    """获取(必要时编译)规则集计划,LRU淘汰;未缓存且没有规范化JSON时返回None"""
+    plan = _worker_plans.get(fingerprint)
+    if plan is not None:
+        _worker_plans.move_to_end(fingerprint)
+        return plan
+    if spec is None:
+        return None
+    
+    rules = [MatchRule.model_validate(item) for item in json.loads(spec)]
+    plan = EmailMatcher.compile(rules)
+    plan.fingerprint = fingerprint
+    _worker_plans[fingerprint] = plan
+    while len(_worker_plans) > _worker_max_plans:
+        _worker_plans.popitem(last=False)
+    return plan
+
+
+def _match_shard(
+    email: bytes,
+    specs: List[Tuple[str, Optional[str]]],
+    retired: List[str]
+) -> Tuple[List[Tuple[str, bool, str, Optional[Dict[str, List[str]]], int, List[int]]], List[int], List[str]]:
+    """
+    在工作进程中匹配一个分片
+    
+    输入:
+        email: _ship_email的结果
+        specs: [(指纹, 规范化JSON或None), ...],None表示主进程认为工作进程已缓存
+        retired: 已被主进程移除的指纹(从缓存中淘汰)
+        
+    输出:
+        ([(指纹, 是否匹配, 匹配描述, 提取结果, 耗时ns, 节点计数增量), ...], 谓词统计增量, 缓存未命中的指纹)
+    """
+    for fingerprint in retired:
+        _worker_plans.pop(fingerprint, None)
+    
+    stats = get_matcher_stats()
+    stats_before = stats.snapshot()
+    ctx = _ShippedContext(*pickle.loads(email))
+    results = []
+    missing = []
+    for fingerprint, spec in specs:
+        started = time.perf_counter_ns()
+        plan = _worker_plan(fingerprint, spec)
+        if plan is None:
+            missing.append(fingerprint)
+            continue
+        counters_before = plan.counters()
+        matched, description = plan.evaluate(ctx)
+        extracted = plan.extract(ctx) if matched else None
+        elapsed_ns = time.perf_counter_ns() - started
+        counters = [after - before for after, before in zip(plan.counters(), counters_before)]
+        results.append((fingerprint, matched, description, extracted, elapsed_ns, counters))
+    return results, [after - before for after, before in zip(stats.snapshot(), stats_before)], missing
+
+
+class MatchEngine:
+    """多进程匹配引擎(主进程侧)"""
+    
+    def __init__(
+        self,
+        workers: int,
+        shard_size: int = 16,
+        max_scan_bytes: int = 0,
+        scan_mode: str = "head",
+        max_cached_plans: int = 1024
+    ):
+        """
+        初始化引擎
+        
+        输入:
+            workers: 工作进程数
+            shard_size: 每个分片包含的规则集数量
+            max_scan_bytes: 扫描窗口(与主进程配置一致)
+            scan_mode: 扫描模式
+            max_cached_plans: 每个工作进程缓存的规则集数量上限
+        """
+        self.workers = workers
+        self.shard_size = max(1, shard_size)
+        self.max_scan_bytes = max_scan_bytes
+        self.scan_mode = scan_mode
+        self.max_cached_plans = max_cached_plans
+        self._pool: Optional[ProcessPoolExecutor] = None
+        
+        # 已移除的规则集: {指纹: 剩余随任务下发次数}
+        # 无法指定某个工作进程接收,随后续若干任务广播,其余由LRU兜底
+        self._retired: Dict[str, int] = {}
+        # 已下发过规范化JSON的指纹(之后只下发指纹,工作进程未命中时补发)
+        self._shipped: set = set()
+        
+        self.tasks = 0
+        self.rule_sets = 0
+        self.worker_time_ns = 0
+        self.failures = 0
+        self.spec_misses = 0
+        
+        get_rule_registry().add_release_listener(self._on_release)
+    
+    def start(self):
+        """启动进程池并预热工作进程"""
+        if self._pool is not None:
+            return
+        
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.max_scan_bytes, self.scan_mode, self.max_cached_plans)
+        )
+        for _ in range(self.workers):
+            self._pool.submit(_ping)
+        logger.info(f"✓ 启动多进程匹配引擎: {self.workers}个工作进程, 分片大小{self.shard_size}")
+    
+    def stop(self):
+        """停止进程池"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            logger.info("✓ 停止多进程匹配引擎")
+    
+    def _on_release(self, fingerprint: str):
+        """规则集被移除: 通知工作进程淘汰"""
+        self._retired[fingerprint] = self.workers * 4
+        self._shipped.discard(fingerprint)
+    
+    def _take_retired(self) -> List[str]:
+        """取出本次任务需要下发的淘汰列表"""
+        if not self._retired:
+            return []
+        
+        retired = list(self._retired)
+        for fingerprint in retired:
+            self._retired[fingerprint] -= 1
+            if self._retired[fingerprint] <= 0:
+                del self._retired[fingerprint]
+        return retired
+    
+    async def evaluate(self, ctx: MatchContext, plans: Dict[str, MatchPlan]):
+        """
+        在进程池中并行匹配规则集,结果写入ctx
+        
+        输入:
+            ctx: 邮件匹配上下文
+            plans: {指纹: MatchPlan},需要匹配的规则集
+            
+        说明:
+            失败时不写入结果,调用方在本进程中按原流程匹配
+        """
+        if self._pool is None:
+            return
+        
+        pending = [fingerprint for fingerprint in plans if fingerprint not in ctx.results]
+        if not pending:
+            return
+        
+        email = _ship_email(ctx, [plans[fingerprint] for fingerprint in pending])
+        registry = get_rule_registry()
+        specs = []
+        for fingerprint in pending:
+            if fingerprint in self._shipped:
+                specs.append((fingerprint, None))
+                continue
+            spec = registry.get_spec(fingerprint)
+            if spec is not None:
+                specs.append((fingerprint, spec))
+                self._shipped.add(fingerprint)
+        
+        while specs:
+            shards = [specs[i:i + self.shard_size] for i in range(0, len(specs), self.shard_size)]
+            loop = asyncio.get_running_loop()
+            futures = [
+                loop.run_in_executor(self._pool, _match_shard, email, shard, self._take_retired())
+                for shard in shards
+            ]
+            
+            try:
+                shard_results = await asyncio.gather(*futures)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"多进程匹配失败,回退到本进程匹配: {e}")
+                return
+            
+            self.tasks += len(shards)
+            specs = []
+            stats = get_matcher_stats()
+            for results, stats_delta, missing in shard_results:
+                stats.merge(stats_delta)
+                for fingerprint, matched, description, extracted, elapsed_ns, counters in results:
+                    # 工作进程中的选择率观测合并到主进程的计划,用于后续排序
+                    plans[fingerprint].add_counters(counters)
+                    ctx.results[fingerprint] = (matched, description)
+                    ctx.timings[fingerprint] = elapsed_ns
+                    if extracted is not None:
+                        ctx.extracted[fingerprint] = extracted
+                    self.rule_sets += 1
+                    self.worker_time_ns += elapsed_ns
+                # 处理该分片的工作进程没有缓存: 补发规范化JSON重试(已移除的规则集留给本进程)
+                self.spec_misses += len(missing)
+                for fingerprint in missing:
+                    spec = registry.get_spec(fingerprint)
+                    if spec is not None:
+                        specs.append((fingerprint, spec))
+    
+    def get_stats(self) -> Dict:
+        """
+        获取引擎统计
+        
+        输出:
+            工作进程数、任务数、匹配的规则集数、工作进程耗时、失败次数、规则集缓存未命中次数
+        """
+        return {
+            "workers": self.workers,
+            "shard_size": self.shard_size,
+            "tasks": self.tasks,
+            "rule_sets": self.rule_sets,
+            "worker_time_ms": round(self.worker_time_ns / 1e6, 3),
+            "failures": self.failures,
+            "spec_misses": self.spec_misses
+        }
+
+
+# 全局匹配引擎实例(由main.py按配置初始化,未启用时为None)
+_engine: Optional[MatchEngine] = None
+
+
+def init_match_engine(
+    workers: int,
+    shard_size: int = 16,
+    max_scan_bytes: int = 0,
+    scan_mode: str = "head"
+) -> MatchEngine:
+    """
+    初始化全局匹配引擎
+    
+    输入:
+        workers: 工作进程数
+        shard_size: 每个分片包含的规则集数量
+        max_scan_bytes: 扫描窗口
+        scan_mode: 扫描模式
+        
+    输出:
+        MatchEngine实例
+    """
+    global _engine
+    _engine = MatchEngine(workers, shard_size, max_scan_bytes, scan_mode)
+    return _engine
+
+
+def get_match_engine() -> Optional[MatchEngine]:
+    """
+    获取全局匹配引擎
+    
+    输出:
+        MatchEngine实例,未启用时返回None
+    """
+    return _engine
@@ -5,6 +5,15 @@
     - 支持关键词匹配(不区分大小写)
     - 支持正则表达式匹配
     - 在指定字段(发件人/主题/正文)中搜索
+    - 支持all/any/not组合表达式
+    - 规则预编译为求值计划(MatchPlan),短路求值
+    - 按估算代价和观测选择率动态排序,廉价且高选择性的谓词先执行
+    - 统计谓词求值次数和耗时
+    - 结构相同的规则集按指纹共享同一个编译计划,每封邮件只求值一次
+    - 提取规则(验证码捕获组/链接)预编译,匹配后在服务端提取一次
+    - 正文/HTML扫描窗口(max_scan_bytes),匹配代价由配置而非邮件大小决定
+    - 仅凭发件人判断规则集是否可能匹配(三值求值),供SMTP阶段提前丢弃
+    - 只有HTML正文的邮件,body按需转为纯文本后匹配(每封邮件一次)
 
 输入:
     rule: MatchRule对象
@@ -12,92 +21,854 @@
     
 输出:
     (bool, str): (是否匹配, 匹配描述)
+
+调用链:
+    Connection初始化 -> RuleSetRegistry.acquire -> MatchPlan(按指纹共享)
+    smtp_server收到邮件 -> MatchContext(email_data) -> MatchPlan.evaluate(同指纹结果复用)
+    Connection移除 -> RuleSetRegistry.release
 """
 import re
-from typing import Tuple, Dict, Any
-from schemas.request import MatchRule
+import html
+import json
+import time
+import hashlib
+import threading
+from typing import Tuple, Dict, Any, List, Optional, Callable, Iterator
+from schemas.request import MatchRule, ExtractRule
+from utils.html_text import html_to_text
 
 
-class EmailMatcher:
-    """邮件匹配器"""
+# 字段名 -> 描述中使用的中文名
+FIELD_LABELS = {
+    "sender": "发件人",
+    "subject": "主题",
+    "body": "正文",
+}
+
+# 字段名 -> 邮件数据字典中的键(未列出的同名)
+FIELD_SOURCES = {
+    "html": "html_body",
+}
+
+# 受扫描窗口限制的字段(大小由发件方决定)
+WINDOWED_FIELDS = {"body", "html"}
+
+# 只知道发件人时的已知字段集合
+_SENDER_ONLY = frozenset({"sender"})
+
+# 全局扫描窗口(由EmailMatcher.configure设置,规则未指定时使用)
+_scan_defaults = {"max_scan_bytes": 0, "scan_mode": "head"}
+
+# 链接提取: HTML中的<a href>和纯文本中的http(s)地址
+_HREF_RE = re.compile(r"""<a\b[^>]*?\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+_URL_RE = re.compile(r"""https?://[^\s<>"')\]]+""", re.IGNORECASE)
+
+# 每字符每模式的相对扫描代价
+KEYWORD_COST = 1.0
+REGEX_COST = 4.0
+
+
+class MatcherStats:
+    """全局匹配统计(谓词求值次数和耗时)"""
     
-    @staticmethod
-    def match(rule: MatchRule, email_data: Dict[str, Any]) -> Tuple[bool, str]:
+    __slots__ = ("evaluations", "matches", "time_ns", "by_type", "memo_hits")
+    
+    def __init__(self):
+        self.evaluations = 0
+        self.matches = 0
+        self.time_ns = 0
+        self.memo_hits = 0  # 共享规则集复用已有结果的次数
+        # {谓词类型: [求值次数, 匹配次数, 耗时ns]}
+        self.by_type: Dict[str, List[int]] = {"keyword": [0, 0, 0], "regex": [0, 0, 0]}
+    
+    def record(self, predicate_type: str, matched: bool, elapsed_ns: int):
+        """记录一次谓词求值"""
+        self.evaluations += 1
+        self.time_ns += elapsed_ns
+        counters = self.by_type[predicate_type]
+        counters[0] += 1
+        counters[2] += elapsed_ns
+        if matched:
+            self.matches += 1
+            counters[1] += 1
+    
+    def snapshot(self) -> List[int]:
         """
-        检查邮件是否匹配规则
+        计数器快照(多进程匹配时工作进程据此计算增量)
+        
+        输出:
+            [求值次数, 匹配次数, 耗时ns, 复用次数, 各谓词类型的3个计数...]
+        """
+        values = [self.evaluations, self.matches, self.time_ns, self.memo_hits]
+        for counters in self.by_type.values():
+            values.extend(counters)
+        return values
+    
+    def merge(self, delta: List[int]):
+        """
+        合并工作进程返回的计数增量
         
         输入:
-            rule: 匹配规则对象
-            email_data: 邮件数据字典,包含:
-                - sender: 发件人 (str)
-                - subject: 主题 (str)
-                - body: 正文 (str)
+            delta: 两次snapshot之差
+        """
+        self.evaluations += delta[0]
+        self.matches += delta[1]
+        self.time_ns += delta[2]
+        self.memo_hits += delta[3]
+        offset = 4
+        for counters in self.by_type.values():
+            for i in range(3):
+                counters[i] += delta[offset + i]
+            offset += 3
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """导出统计信息"""
+        return {
+            "predicate_evaluations": self.evaluations,
+            "predicate_matches": self.matches,
+            "time_ms": round(self.time_ns / 1e6, 3),
+            "memo_hits": self.memo_hits,
+            "by_type": {
+                name: {
+                    "evaluations": counters[0],
+                    "matches": counters[1],
+                    "time_ms": round(counters[2] / 1e6, 3),
+                }
+                for name, counters in self.by_type.items()
+            },
+        }
+
+
+_stats = MatcherStats()
+
+
+class MatchContext:
+    """
+    单封邮件的匹配上下文
+    
+    同一封邮件被多个连接/规则匹配时,字段内容和小写化结果只计算一次,
+    共享规则集(相同指纹)的匹配结果也只计算一次
+    """
+    
+    __slots__ = ("email_data", "_windows", "_lowered", "results", "extracted", "timings")
+    
+    def __init__(self, email_data: Dict[str, Any]):
+        """
+        输入:
+            email_data: 邮件数据(ParsedEmail或字典,包含sender, subject, body)
+        """
+        self.email_data = email_data
+        # 截取后的字段内容: {(字段, 长度, 模式): 内容}
+        self._windows: Dict[Tuple[str, int, str], str] = {}
+        self._lowered: Dict[Tuple[str, int, str], str] = {}
+        # 规则集匹配结果: {指纹: (是否匹配, 匹配描述)}
+        self.results: Dict[str, Tuple[bool, str]] = {}
+        # 规则集提取结果: {指纹: {name: [值, ...]}}
+        self.extracted: Dict[str, Dict[str, List[str]]] = {}
+        # 规则集实际求值耗时: {指纹: 纳秒},用于按订阅统计匹配耗时
+        self.timings: Dict[str, int] = {}
+    
+    def text(self, field: str, limit: int = 0, mode: str = "head") -> str:
+        """
+        获取字段内容
+    
+        输入:
+            field: 字段名
+            limit: 正文/HTML最多返回的长度,0表示不限制
+            mode: "head"=开头, "head_tail"=开头和结尾各一半
+    
+        输出:
+            字段内容(超出limit时为截取后的窗口,结果缓存)
+        """
+        value = self._value(field)
+        if not limit or field not in WINDOWED_FIELDS or len(value) <= limit:
+            return value
+        
+        key = (field, limit, mode)
+        window = self._windows.get(key)
+        if window is None:
+            if mode == "head_tail":
+                head = limit // 2
+                window = value[:head] + "\n" + value[len(value) - (limit - head):]
+            else:
+                window = value[:limit]
+            self._windows[key] = window
+        return window
+    
+    def length(self, field: str, limit: int = 0) -> int:
+        """获取字段(窗口)长度,用于代价估算"""
+        if field == "body" and self.email_data.get("body_is_html") and self.email_data.get("body_text") is None:
+            # 尚未转换为纯文本,用HTML长度估算(不为估算代价而提前转换)
+            length = len(self.email_data.get("html_body") or "")
+        else:
+            length = len(self._value(field))
+        if limit and field in WINDOWED_FIELDS:
+            return min(length, limit)
+        return length
+    
+    def _value(self, field: str) -> str:
+        """
+        获取字段原始内容
+        
+        只有HTML正文的邮件(body_is_html),body为HTML转换后的纯文本,
+        首次使用时转换并缓存到邮件数据的body_text中
+        """
+        if field == "body" and self.email_data.get("body_is_html"):
+            text = self.email_data.get("body_text")
+            if text is None:
+                text = html_to_text(self.email_data.get("html_body") or "")
+                self.email_data["body_text"] = text
+            return text
+        return self.email_data.get(FIELD_SOURCES.get(field, field)) or ""
+    
+    def lowered(self, field: str, limit: int = 0, mode: str = "head") -> str:
+        """获取字段小写内容(缓存)"""
+        key = (field, limit, mode)
+        value = self._lowered.get(key)
+        if value is None:
+            value = self.text(field, limit, mode).lower()
+            self._lowered[key] = value
+        return value
+
+
+def _window(owner) -> Tuple[int, str]:
+    """
+    扫描窗口(规则配置优先,否则使用全局配置)
+    
+    输入:
+        owner: 带max_scan_bytes/scan_mode属性的谓词或提取器
+    
+    输出:
+        (最大扫描长度, 扫描模式)
+    """
+    limit = owner.max_scan_bytes if owner.max_scan_bytes is not None else _scan_defaults["max_scan_bytes"]
+    return limit, owner.scan_mode or _scan_defaults["scan_mode"]
+
+
+class _Node:
+    """
+    求值节点基类
+    
+    记录求值次数和匹配次数,用于估算选择率(拉普拉斯平滑)
+    """
+    
+    __slots__ = ("evaluations", "matches")
+    
+    def __init__(self):
+        self.evaluations = 0
+        self.matches = 0
+    
+    def selectivity(self) -> float:
+        """观测到的匹配概率"""
+        return (self.matches + 1) / (self.evaluations + 2)
+    
+    def cost(self, ctx: MatchContext) -> float:
+        """估算本节点对该邮件的求值代价"""
+        raise NotImplementedError
+    
+    def evaluate(self, ctx: MatchContext) -> Tuple[bool, str]:
+        matched, description = self._evaluate(ctx)
+        self.evaluations += 1
+        if matched:
+            self.matches += 1
+        return matched, description
+    
+    def _evaluate(self, ctx: MatchContext) -> Tuple[bool, str]:
+        raise NotImplementedError
+
+    def partial(self, ctx: MatchContext, known: frozenset) -> Optional[bool]:
+        """
+        只知道部分字段时的三值求值(不计入统计)
         
+        输入:
+            ctx: 只包含已知字段的上下文
+            known: 已知字段集合
+            
         输出:
-            (是否匹配, 匹配描述)
-            - 匹配: (True, "关键词 'xxx' 匹配于主题")
-            - 不匹配: (False, "")
+            True/False: 结果已确定, None: 取决于未知字段
         """
-        # 获取要搜索的字段内容
-        search_contents = {}
-        if "sender" in rule.search_in:
-            search_contents["发件人"] = email_data.get("sender", "")
-        if "subject" in rule.search_in:
-            search_contents["主题"] = email_data.get("subject", "")
-        if "body" in rule.search_in:
-            search_contents["正文"] = email_data.get("body", "")
-        
-        # 根据匹配类型执行匹配
-        if rule.type == "keyword":
-            return EmailMatcher._match_keyword(rule.patterns, search_contents)
-        elif rule.type == "regex":
-            return EmailMatcher._match_regex(rule.patterns, search_contents)
+        raise NotImplementedError
+
+
+class _Predicate(_Node):
+    """字段谓词: 在指定字段中搜索关键词或正则"""
+    
+    __slots__ = ("type", "patterns", "fields", "max_scan_bytes", "scan_mode", "_needles", "_regexes", "_unit_cost")
+    
+    def __init__(self, rule: MatchRule):
+        super().__init__()
+        self.type = rule.type
+        self.patterns = list(rule.patterns)
+        self.fields = [f for f in FIELD_LABELS if f in rule.search_in]
+        self.max_scan_bytes = rule.max_scan_bytes  # None表示使用全局配置
+        self.scan_mode = rule.scan_mode
+        self._needles = [p.lower() for p in self.patterns]
+        self._regexes = [re.compile(p, re.IGNORECASE) for p in self.patterns] if rule.type == "regex" else []
+        self._unit_cost = (REGEX_COST if rule.type == "regex" else KEYWORD_COST) * len(self.patterns)
+    
+    def cost(self, ctx: MatchContext) -> float:
+        limit, _ = _window(self)
+        return self._unit_cost * (1 + sum(ctx.length(f, limit) for f in self.fields))
+    
+    def _evaluate(self, ctx: MatchContext) -> Tuple[bool, str]:
+        started = time.perf_counter_ns()
+        matched, description = self._search(ctx)
+        _stats.record(self.type, matched, time.perf_counter_ns() - started)
+        return matched, description
+    
+    def partial(self, ctx: MatchContext, known: frozenset) -> Optional[bool]:
+        matched, _ = self._search(ctx, [f for f in self.fields if f in known])
+        if matched:
+            return True
+        if all(f in known for f in self.fields):
+            return False
+        return None
+    
+    def _search(self, ctx: MatchContext, fields: Optional[List[str]] = None) -> Tuple[bool, str]:
+        fields = self.fields if fields is None else fields
+        limit, mode = _window(self)
+        # 短字段先搜索(通常 发件人 < 主题 < 正文)
+        if len(fields) > 1:
+            fields = sorted(fields, key=lambda f: ctx.length(f, limit))
+        if self.type == "keyword":
+            for field in fields:
+                content = ctx.lowered(field, limit, mode)
+                for pattern, needle in zip(self.patterns, self._needles):
+                    if needle in content:
+                        return True, f"关键词 '{pattern}' 匹配于{FIELD_LABELS[field]}"
         else:
-            return False, f"未知的匹配类型: {rule.type}"
+            for field in fields:
+                content = ctx.text(field, limit, mode)
+                for pattern, regex in zip(self.patterns, self._regexes):
+                    if regex.search(content):
+                        return True, f"正则 '{pattern}' 匹配于{FIELD_LABELS[field]}"
+        return False, ""
+
+
+class _AllNode(_Node):
+    """
+    AND: 任一子节点不匹配即短路返回
     
-    @staticmethod
-    def _match_keyword(patterns: list[str], search_contents: Dict[str, str]) -> Tuple[bool, str]:
+    子节点按 代价/不匹配概率 升序执行,廉价且最可能失败的先执行
+    """
+    
+    __slots__ = ("children",)
+    
+    def __init__(self, children: list):
+        super().__init__()
+        self.children = children
+    
+    def cost(self, ctx: MatchContext) -> float:
+        return sum(child.cost(ctx) for child in self.children)
+    
+    def _evaluate(self, ctx: MatchContext) -> Tuple[bool, str]:
+        descriptions = []
+        for child in _order(self.children, ctx, want_match=False):
+            matched, description = child.evaluate(ctx)
+            if not matched:
+                return False, ""
+            if description:
+                descriptions.append(description)
+        return True, " 且 ".join(descriptions)
+
+    def partial(self, ctx: MatchContext, known: frozenset) -> Optional[bool]:
+        result = True
+        for child in self.children:
+            value = child.partial(ctx, known)
+            if value is False:
+                return False
+            if value is None:
+                result = None
+        return result
+
+
+class _AnyNode(_Node):
+    """
+    OR: 任一子节点匹配即短路返回
+    
+    子节点按 代价/匹配概率 升序执行,廉价且最可能匹配的先执行
+    """
+    
+    __slots__ = ("children",)
+    
+    def __init__(self, children: list):
+        super().__init__()
+        self.children = children
+    
+    def cost(self, ctx: MatchContext) -> float:
+        return sum(child.cost(ctx) for child in self.children)
+    
+    def _evaluate(self, ctx: MatchContext) -> Tuple[bool, str]:
+        for child in _order(self.children, ctx, want_match=True):
+            matched, description = child.evaluate(ctx)
+            if matched:
+                return True, description
+        return False, ""
+
+    def partial(self, ctx: MatchContext, known: frozenset) -> Optional[bool]:
+        result = False
+        for child in self.children:
+            value = child.partial(ctx, known)
+            if value is True:
+                return True
+            if value is None:
+                result = None
+        return result
+
+
+class _NotNode(_Node):
+    """NOT: 子节点不匹配时成立"""
+    
+    __slots__ = ("child",)
+    
+    def __init__(self, child):
+        super().__init__()
+        self.child = child
+    
+    def cost(self, ctx: MatchContext) -> float:
+        return self.child.cost(ctx)
+    
+    def selectivity(self) -> float:
+        return 1 - self.child.selectivity()
+    
+    def _evaluate(self, ctx: MatchContext) -> Tuple[bool, str]:
+        matched, _ = self.child.evaluate(ctx)
+        if matched:
+            return False, ""
+        return True, ""
+    
+    def partial(self, ctx: MatchContext, known: frozenset) -> Optional[bool]:
+        value = self.child.partial(ctx, known)
+        return None if value is None else not value
+
+
+class _Extractor:
+    """提取器: 预编译的提取规则(扫描窗口与所属规则一致)"""
+    
+    __slots__ = ("name", "type", "fields", "group", "max_matches", "max_scan_bytes", "scan_mode", "_regex")
+    
+    def __init__(self, rule: ExtractRule, owner: MatchRule):
+        self.name = rule.name
+        self.type = rule.type
+        self.fields = list(rule.search_in)
+        self.group = rule.group
+        self.max_matches = rule.max_matches
+        self.max_scan_bytes = owner.max_scan_bytes
+        self.scan_mode = owner.scan_mode
+        self._regex = re.compile(rule.pattern, re.IGNORECASE) if rule.pattern else None
+    
+    def extract(self, ctx: MatchContext) -> List[str]:
+        """
+        从邮件中提取内容
+        
+        输入:
+            ctx: 邮件匹配上下文
+            
+        输出:
+            去重后的提取结果(按出现顺序,最多max_matches个)
         """
-        关键词匹配(不区分大小写)
+        values: List[str] = []
+        limit, mode = _window(self)
+        for field in self.fields:
+            content = ctx.text(field, limit, mode)
+            if not content:
+                continue
+            candidates = self._links(field, content) if self.type == "links" else self._captures(content)
+            for value in candidates:
+                if value and value not in values:
+                    values.append(value)
+                    if len(values) >= self.max_matches:
+                        return values
+        return values
+    
+    def _captures(self, content: str):
+        """正则捕获组"""
+        for match in self._regex.finditer(content):
+            if match.re.groups == 0:
+                yield match.group(0)
+                continue
+            try:
+                yield match.group(self.group)
+            except IndexError:
+                yield match.group(0)
+    
+    def _links(self, field: str, content: str):
+        """链接(可选用pattern过滤)"""
+        if field == "html":
+            urls = (html.unescape(m.group(m.lastindex)).strip() for m in _HREF_RE.finditer(content))
+        else:
+            urls = (m.group(0) for m in _URL_RE.finditer(content))
+        for url in urls:
+            if self._regex is None or self._regex.search(url):
+                yield url
+
+
+def _order(children: list, ctx: MatchContext, want_match: bool) -> list:
+    """
+    按期望代价排序子节点
+    
+    输入:
+        children: 子节点列表
+        ctx: 邮件匹配上下文(字段长度决定代价)
+        want_match: True=OR(找第一个匹配), False=AND(找第一个不匹配)
+        
+    输出:
+        排序后的子节点列表
+    """
+    if len(children) < 2:
+        return children
+    
+    def rank(child) -> float:
+        p = child.selectivity()
+        return child.cost(ctx) / (p if want_match else 1 - p)
+    
+    return sorted(children, key=rank)
+
+
+class MatchPlan:
+    """
+    编译后的规则求值计划
+    
+    顶层规则之间为OR关系,与match_any语义一致。
+    通过RuleSetRegistry获取的计划带有指纹,同一MatchContext内结果会被复用
+    """
+    
+    __slots__ = ("root", "fingerprint", "extractors")
+    
+    def __init__(self, root, fingerprint: Optional[str] = None, extractors: Optional[List[_Extractor]] = None):
+        self.root = root
+        self.fingerprint = fingerprint
+        self.extractors = extractors or []
+    
+    def evaluate(self, ctx: MatchContext) -> Tuple[bool, str]:
+        """
+        对邮件求值
         
         输入:
-            patterns: 关键词列表
-            search_contents: 要搜索的内容字典 {字段名: 内容}
+            ctx: 邮件匹配上下文
             
         输出:
             (是否匹配, 匹配描述)
         """
-        for field_name, content in search_contents.items():
-            content_lower = content.lower()
-            for pattern in patterns:
-                pattern_lower = pattern.lower()
-                if pattern_lower in content_lower:
-                    return True, f"关键词 '{pattern}' 匹配于{field_name}"
+        if self.fingerprint is not None:
+            cached = ctx.results.get(self.fingerprint)
+            if cached is not None:
+                _stats.memo_hits += 1
+                return cached
         
-        return False, ""
+        started = time.perf_counter_ns()
+        matched, description = self.root.evaluate(ctx)
+        if matched and not description:
+            description = "组合规则匹配"
+        
+        if self.fingerprint is not None:
+            ctx.results[self.fingerprint] = (matched, description)
+            ctx.timings[self.fingerprint] = time.perf_counter_ns() - started
+        return matched, description
+    
+    def _nodes(self) -> Iterator[_Node]:
+        """按先序遍历所有节点(同一规范化规则集在各进程中顺序一致)"""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            if isinstance(node, _NotNode):
+                stack.append(node.child)
+            elif isinstance(node, (_AllNode, _AnyNode)):
+                stack.extend(reversed(node.children))
+    
+    def windows(self) -> set:
+        """
+        规则集用到的字段及其扫描窗口(谓词和提取规则)
+        
+        输出:
+            {(字段, 最大扫描长度, 扫描模式), ...}
+        """
+        owners = [node for node in self._nodes() if isinstance(node, _Predicate)] + self.extractors
+        return {(field, *_window(owner)) for owner in owners for field in owner.fields}
+    
+    def counters(self) -> List[int]:
+        """
+        各节点的求值/匹配次数(用于在进程间同步选择率)
+        
+        输出:
+            [节点1求值次数, 节点1匹配次数, 节点2求值次数, ...]
+        """
+        values = []
+        for node in self._nodes():
+            values.append(node.evaluations)
+            values.append(node.matches)
+        return values
+    
+    def add_counters(self, delta: List[int]):
+        """
+        累加工作进程中观测到的求值/匹配次数
+        
+        输入:
+            delta: 两次counters之差(节点数不一致时忽略)
+        """
+        nodes = list(self._nodes())
+        if len(delta) != 2 * len(nodes):
+            return
+        for i, node in enumerate(nodes):
+            node.evaluations += delta[2 * i]
+            node.matches += delta[2 * i + 1]
+    
+    def could_match_sender(self, sender: str) -> bool:
+        """
+        仅凭发件人判断规则集是否可能匹配
+        
+        输入:
+            sender: 发件人邮箱
+            
+        输出:
+            False: 无论主题/正文是什么都不可能匹配; True: 可能匹配
+        """
+        return self.root.partial(MatchContext({"sender": sender}), _SENDER_ONLY) is not False
+    
+    def extract(self, ctx: MatchContext) -> Optional[Dict[str, List[str]]]:
+        """
+        执行规则集中的所有提取规则(同一上下文内只执行一次)
+        
+        输入:
+            ctx: 邮件匹配上下文
+            
+        输出:
+            {name: [值, ...]},规则集没有提取规则时返回None
+        """
+        if not self.extractors:
+            return None
+        
+        key = self.fingerprint if self.fingerprint is not None else str(id(self))
+        extracted = ctx.extracted.get(key)
+        if extracted is None:
+            extracted = {}
+            for extractor in self.extractors:
+                values = extractor.extract(ctx)
+                if extractor.name in extracted:
+                    extracted[extractor.name].extend(v for v in values if v not in extracted[extractor.name])
+                else:
+                    extracted[extractor.name] = values
+            ctx.extracted[key] = extracted
+        return extracted
+
+
+class RuleSetRegistry:
+    """
+    规则集驻留表
+    
+    结构相同的规则列表(规范化后指纹相同)共享同一个MatchPlan,
+    按引用计数管理,最后一个连接释放时移除
+    """
+    
+    def __init__(self):
+        # {指纹: MatchPlan}
+        self._plans: Dict[str, MatchPlan] = {}
+        # {指纹: 引用计数}
+        self._refs: Dict[str, int] = {}
+        # {指纹: 规范化JSON},供多进程匹配引擎在工作进程中重建计划
+        self._specs: Dict[str, str] = {}
+        # 规则集移除回调: callback(指纹)
+        self._release_listeners: List[Callable[[str], None]] = []
+        self._lock = threading.Lock()
     
     @staticmethod
-    def _match_regex(patterns: list[str], search_contents: Dict[str, str]) -> Tuple[bool, str]:
+    def canonical_json(rules: List[MatchRule]) -> str:
         """
-        正则表达式匹配
+        规则列表的规范化JSON
         
         输入:
-            patterns: 正则表达式列表
-            search_contents: 要搜索的内容字典 {字段名: 内容}
+            rules: 规则列表
             
         输出:
-            (是否匹配, 匹配描述)
+            JSON字符串(字段顺序和search_in顺序不影响结果)
         """
-        for field_name, content in search_contents.items():
-            for pattern in patterns:
-                try:
-                    if re.search(pattern, content, re.IGNORECASE):
-                        return True, f"正则 '{pattern}' 匹配于{field_name}"
-                except re.error as e:
-                    # 正则表达式格式错误
-                    return False, f"正则表达式错误: {e}"
+        return json.dumps(
+            [RuleSetRegistry._canonical(rule) for rule in rules],
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+    
+    @staticmethod
+    def fingerprint(rules: List[MatchRule]) -> str:
+        """
+        计算规则列表的规范化指纹
         
-        return False, ""
+        输入:
+            rules: 规则列表
+            
+        输出:
+            sha1十六进制字符串(字段顺序和search_in顺序不影响指纹)
+        """
+        return RuleSetRegistry._hash(RuleSetRegistry.canonical_json(rules))
+    
+    @staticmethod
+    def _hash(canonical: str) -> str:
+        """规范化JSON的sha1"""
+        return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _canonical(rule: MatchRule) -> Dict[str, Any]:
+        """规则的规范化表示"""
+        data = rule.model_dump(exclude={"rules"})
+        data["search_in"] = sorted(set(rule.search_in))
+        data["rules"] = [RuleSetRegistry._canonical(child) for child in rule.rules]
+        return data
+    
+    def acquire(self, rules: List[MatchRule]) -> MatchPlan:
+        """
+        获取规则列表对应的共享计划(引用计数+1)
+        
+        输入:
+            rules: 规则列表
+            
+        输出:
+            MatchPlan对象(结构相同的规则列表返回同一对象)
+        """
+        canonical = self.canonical_json(rules)
+        fingerprint = self._hash(canonical)
+        with self._lock:
+            plan = self._plans.get(fingerprint)
+            if plan is None:
+                plan = EmailMatcher.compile(rules)
+                plan.fingerprint = fingerprint
+                self._plans[fingerprint] = plan
+                self._specs[fingerprint] = canonical
+                self._refs[fingerprint] = 0
+            self._refs[fingerprint] += 1
+            return plan
+    
+    def release(self, plan: MatchPlan):
+        """
+        释放共享计划(引用计数-1,归零时移除)
+        
+        输入:
+            plan: acquire返回的MatchPlan
+        """
+        fingerprint = plan.fingerprint
+        with self._lock:
+            if fingerprint not in self._refs:
+                return
+            self._refs[fingerprint] -= 1
+            if self._refs[fingerprint] <= 0:
+                del self._refs[fingerprint]
+                del self._plans[fingerprint]
+                del self._specs[fingerprint]
+                removed = True
+            else:
+                removed = False
+        
+        if removed:
+            for listener in self._release_listeners:
+                listener(fingerprint)
+    
+    def get_spec(self, fingerprint: str) -> Optional[str]:
+        """
+        获取规则集的规范化JSON
+        
+        输入:
+            fingerprint: 规则集指纹
+            
+        输出:
+            JSON字符串,规则集不存在时返回None
+        """
+        return self._specs.get(fingerprint)
+    
+    def add_release_listener(self, callback: Callable[[str], None]):
+        """
+        注册规则集移除回调
+        
+        输入:
+            callback: 最后一个连接释放规则集时调用, callback(指纹)
+        """
+        self._release_listeners.append(callback)
+    
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取驻留统计
+        
+        输出:
+            rule_sets: 不同规则集数量, subscribers: 引用总数
+        """
+        with self._lock:
+            return {
+                "rule_sets": len(self._plans),
+                "subscribers": sum(self._refs.values())
+            }
+
+
+class EmailMatcher:
+    """邮件匹配器"""
+    
+    @staticmethod
+    def configure(max_scan_bytes: int = 0, scan_mode: str = "head"):
+        """
+        设置全局扫描窗口
+        
+        输入:
+            max_scan_bytes: 正文/HTML最多扫描的长度(字符),0表示不限制
+            scan_mode: "head"=只扫描开头, "head_tail"=开头和结尾各一半
+        """
+        if scan_mode not in ("head", "head_tail"):
+            raise ValueError(f"未知的扫描模式: {scan_mode}")
+        _scan_defaults["max_scan_bytes"] = max(0, max_scan_bytes)
+        _scan_defaults["scan_mode"] = scan_mode
+    
+    @staticmethod
+    def compile(rules: List[MatchRule]) -> MatchPlan:
+        """
+        将规则列表编译为求值计划
+        
+        规则树中所有节点的提取规则都归属于该计划,规则集匹配后统一执行
+        
+        输入:
+            rules: 规则列表(顶层为OR关系)
+            
+        输出:
+            MatchPlan对象
+        """
+        extractors = []
+        stack = list(rules)
+        while stack:
+            rule = stack.pop(0)
+            extractors.extend(_Extractor(extract, rule) for extract in rule.extract)
+            stack.extend(rule.rules)
+        return MatchPlan(
+            _AnyNode([EmailMatcher._compile_node(rule) for rule in rules]),
+            extractors=extractors
+        )
+    
+    @staticmethod
+    def _compile_node(rule: MatchRule):
+        """递归编译单个规则节点"""
+        if rule.type in ("keyword", "regex"):
+            return _Predicate(rule)
+        if rule.type == "not":
+            return _NotNode(EmailMatcher._compile_node(rule.rules[0]))
+        children = [EmailMatcher._compile_node(child) for child in rule.rules]
+        if rule.type == "all":
+            return _AllNode(children)
+        return _AnyNode(children)
+    
+    @staticmethod
+    def match(rule: MatchRule, email_data: Dict[str, Any]) -> Tuple[bool, str]:
+        """
+        检查邮件是否匹配规则
+        
+        输入:
+            rule: 匹配规则对象
+            email_data: 邮件数据字典,包含:
+                - sender: 发件人 (str)
+                - subject: 主题 (str)
+                - body: 正文 (str)
+        
+        输出:
+            (是否匹配, 匹配描述)
+            - 匹配: (True, "关键词 'xxx' 匹配于主题")
+            - 不匹配: (False, "")
+        """
+        return EmailMatcher.compile([rule]).evaluate(MatchContext(email_data))
     
     @staticmethod
     def match_any(rules: list[MatchRule], email_data: Dict[str, Any]) -> Tuple[bool, str]:
@@ -111,10 +882,44 @@ class EmailMatcher:
         输出:
             (是否匹配, 第一个匹配的规则描述)
         """
-        for rule in rules:
-            matched, description = EmailMatcher.match(rule, email_data)
-            if matched:
-                return True, description
+        return EmailMatcher.compile(rules).evaluate(MatchContext(email_data))
         
-        return False, ""
+    @staticmethod
+    def get_stats() -> Dict[str, Any]:
+        """
+        获取全局匹配统计
+        
+        输出:
+            谓词求值次数、匹配次数、耗时(毫秒),按谓词类型细分,
+            以及共享规则集数量
+        """
+        stats = _stats.to_dict()
+        stats.update(get_rule_registry().get_stats())
+        return stats
+
+
+# 全局规则集驻留表
+_registry: Optional[RuleSetRegistry] = None
+
 
+def get_rule_registry() -> RuleSetRegistry:
+    """
+    获取全局规则集驻留表
+    
+    输出:
+        RuleSetRegistry实例
+    """
+    global _registry
+    if _registry is None:
+        _registry = RuleSetRegistry()
+    return _registry
+
+
+def get_matcher_stats() -> MatcherStats:
+    """
+    获取本进程的全局匹配统计
+    
+    输出:
+        MatcherStats实例
+    """
+    return _stats